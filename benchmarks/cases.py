@@ -0,0 +1,191 @@
+"""基准用例
+
+全部用例使用离线假模型（``model_provider="fake"``，零延迟），测量的是
+本项目代码本身的开销，不包含网络和真实模型的耗时。
+"""
+
+import asyncio
+import os
+import shutil
+import tempfile
+
+from agent import Configuration, create_agent_graph, run_agent
+from agent.graph import invalidate_graph_cache
+from agent.tools import _calculate_cached, _search_cached
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.graph import END, START, StateGraph
+from langchain_core.messages import AIMessage, HumanMessage
+from multiagent import MultiAgentManager
+
+from harness import SkipBenchmark, benchmark
+
+
+# 先调用计算器再回答的脚本，覆盖一次完整的工具循环
+TOOL_SCRIPT = [
+    {"tool_calls": [{"name": "calculate", "args": {"expression": "2**10 + 3*7"}}]},
+    "结果是1045",
+]
+
+
+def fake_config(**overrides) -> Configuration:
+    options = dict(enable_memory=False, model_provider="fake",
+                   fake_llm_options={"responses": TOOL_SCRIPT})
+    options.update(overrides)
+    return Configuration(**options)
+
+
+# -- 图形 -------------------------------------------------------------------
+
+@benchmark("graph.compile", group="graph", iterations=30)
+def bench_graph_compile(i):
+    create_agent_graph(fake_config())
+
+
+GRAPH_STEPS = 50
+
+
+def _step_graph():
+    workflow = StateGraph(dict)
+    previous = START
+    for n in range(GRAPH_STEPS):
+        name = f"n{n}"
+        workflow.add_node(name, lambda state: {"count": state.get("count", 0) + 1})
+        workflow.add_edge(previous, name)
+        previous = name
+    workflow.add_edge(previous, END)
+    return workflow.compile()
+
+
+@benchmark("graph.step_overhead", group="graph", setup=_step_graph, iterations=50,
+           ops=GRAPH_STEPS, unit="step")
+def bench_graph_step(app, i):
+    app.invoke({"count": 0}, {"recursion_limit": GRAPH_STEPS})
+
+
+# -- 代理 -------------------------------------------------------------------
+
+def _agent_setup():
+    invalidate_graph_cache()
+    config = fake_config()
+    run_agent("预热", config)
+    return config
+
+
+@benchmark("agent.run_agent", group="agent", setup=_agent_setup, iterations=100)
+def bench_run_agent(config, i):
+    answer = run_agent(f"问题{i}", config)
+    assert answer == "结果是1045", answer
+
+
+def _sqlite_setup():
+    directory = tempfile.mkdtemp(prefix="bench-ckpt-")
+    saver = SqliteSaver(os.path.join(directory, "checkpoints.sqlite"))
+    return directory, saver
+
+
+def _sqlite_teardown(context):
+    directory, saver = context
+    saver.close()
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+@benchmark("checkpoint.sqlite_turn", group="checkpoint", setup=_sqlite_setup,
+           teardown=_sqlite_teardown, iterations=200)
+def bench_sqlite_turn(context, i):
+    # 一轮对话：读取线程状态、追加两条消息并提交
+    _, saver = context
+    config = {"configurable": {"thread_id": f"t{i % 20}"}}
+    saver.get_tuple(config)
+    saver.put_writes(config, {"messages": [HumanMessage(content=f"问题{i}")]})
+    saver.put_writes(config, {"messages": [AIMessage(content=f"回答{i}")]})
+    saver.flush()
+
+
+# -- 工具 -------------------------------------------------------------------
+
+TOOL_BATCH = 200
+
+
+@benchmark("tools.calculate", group="tools", iterations=20, ops=TOOL_BATCH, unit="call")
+def bench_calculate(i):
+    # 绕过工具结果缓存直接计算，每次迭代的表达式都不同
+    for n in range(TOOL_BATCH):
+        _calculate_cached.__wrapped__(f"({i} + {n}) * 3.5 / 7 + sqrt({n})")
+
+
+@benchmark("tools.search_web", group="tools", iterations=20, ops=TOOL_BATCH, unit="call")
+def bench_search_web(i):
+    queries = ("Python 机器学习", "LangGraph 代理工作流", "人工智能 深度学习", "LangChain 框架")
+    # 绕过工具结果缓存直接检索
+    for n in range(TOOL_BATCH):
+        _search_cached.__wrapped__(queries[n % len(queries)], 3)
+
+
+# -- 多代理 -----------------------------------------------------------------
+
+def _multiagent_setup():
+    configs = {
+        "researcher": fake_config(fake_llm_options={"responses": ["研究结论"]},
+                                  enable_calculator_tool=False),
+        "critic": fake_config(fake_llm_options={"responses": ["评审意见"]},
+                              enable_search_tool=False),
+    }
+    return configs
+
+
+@benchmark("multiagent.relay", group="multiagent", setup=_multiagent_setup, iterations=50,
+           ops=10, unit="relay")
+def bench_relay(configs, i):
+    manager = MultiAgentManager(configs)
+    message = "开始讨论"
+    for n in range(10):
+        sender, receiver = ("researcher", "critic") if n % 2 == 0 else ("critic", "researcher")
+        message = manager.relay_message(sender, receiver, message)
+
+
+# -- HTTP -------------------------------------------------------------------
+
+HTTP_REQUESTS = 200
+HTTP_CONCURRENCY = 32
+
+
+def _http_setup():
+    try:
+        import httpx
+        import main
+    except ImportError as e:
+        raise SkipBenchmark(f"缺少依赖: {e}")
+    invalidate_graph_cache()
+    transport = httpx.ASGITransport(app=main.app)
+    config = {"model_provider": "fake", "enable_memory": False,
+              "fake_llm_options": {"responses": TOOL_SCRIPT}}
+    return httpx, transport, config
+
+
+def _post_queries(context, queries):
+    httpx, transport, config = context
+
+    async def run():
+        semaphore = asyncio.Semaphore(HTTP_CONCURRENCY)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def one(query):
+                async with semaphore:
+                    response = await client.post("/query", json={"query": query, "config": config})
+                    response.raise_for_status()
+            await asyncio.gather(*(one(query) for query in queries))
+
+    asyncio.run(run())
+
+
+@benchmark("http.query", group="http", setup=_http_setup, iterations=5, warmup=1,
+           ops=HTTP_REQUESTS, unit="request")
+def bench_http_query(context, i):
+    # 每个请求的查询都不同，请求合并不起作用，测的是每个请求各自完整运行一次
+    _post_queries(context, [f"计算{n}" for n in range(HTTP_REQUESTS)])
+
+
+@benchmark("http.query_coalesced", group="http", setup=_http_setup, iterations=5, warmup=1,
+           ops=HTTP_REQUESTS, unit="request")
+def bench_http_query_coalesced(context, i):
+    # 全部请求相同，并发到达的请求合并为一次运行，测的是请求合并的效果
+    _post_queries(context, ["计算"] * HTTP_REQUESTS)
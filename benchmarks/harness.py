@@ -0,0 +1,174 @@
+"""基准测试框架
+
+提供基准注册、计时统计、JSON结果输出以及与基线结果的比较。
+"""
+
+import gc
+import json
+import math
+import platform
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+class SkipBenchmark(Exception):
+    """当前环境无法运行该基准（例如缺少可选依赖）"""
+
+
+class Benchmark:
+    """一个已注册的基准
+
+    ``func`` 接收迭代序号并执行一次被测操作；``setup`` 返回的对象（若有）
+    作为 ``func`` 的第一个参数传入。``ops`` 是每次迭代包含的操作数，
+    用于把迭代耗时换算为单次操作耗时和吞吐量。
+    """
+
+    def __init__(self, name: str, func: Callable, setup: Optional[Callable] = None,
+                 teardown: Optional[Callable] = None, iterations: int = 20,
+                 warmup: int = 2, ops: int = 1, unit: str = "op", group: str = ""):
+        self.name = name
+        self.func = func
+        self.setup = setup
+        self.teardown = teardown
+        self.iterations = iterations
+        self.warmup = warmup
+        self.ops = ops
+        self.unit = unit
+        self.group = group
+
+
+_REGISTRY: Dict[str, Benchmark] = {}
+
+
+def benchmark(name: str, **options):
+    """注册基准的装饰器，参数见 ``Benchmark``"""
+    def decorator(func):
+        _REGISTRY[name] = Benchmark(name, func, **options)
+        return func
+    return decorator
+
+
+def registered() -> Dict[str, Benchmark]:
+    return dict(_REGISTRY)
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    rank = max(1, math.ceil(len(sorted_values) * q / 100))
+    return sorted_values[rank - 1]
+
+
+def summarize(durations: List[float], ops: int = 1) -> Dict[str, float]:
+    """把每次迭代的耗时（秒）汇总为单次操作的统计值"""
+    per_op = sorted(d / ops for d in durations)
+    median = statistics.median(per_op)
+    return {
+        "iterations": len(per_op),
+        "mean": statistics.fmean(per_op),
+        "median": median,
+        "p95": _percentile(per_op, 95),
+        "min": per_op[0],
+        "max": per_op[-1],
+        "stdev": statistics.stdev(per_op) if len(per_op) > 1 else 0.0,
+        "ops_per_sec": (1.0 / median) if median > 0 else float("inf"),
+    }
+
+
+def run_benchmark(bench: Benchmark, iterations: Optional[int] = None) -> Dict[str, Any]:
+    """运行单个基准并返回结果字典（``status`` 为 ok、skipped 或 error）"""
+    iterations = iterations or bench.iterations
+    result: Dict[str, Any] = {"name": bench.name, "group": bench.group, "unit": bench.unit,
+                              "ops": bench.ops}
+    try:
+        context = bench.setup() if bench.setup else None
+    except SkipBenchmark as e:
+        return dict(result, status="skipped", reason=str(e))
+    args = () if bench.setup is None else (context,)
+    try:
+        for i in range(bench.warmup):
+            bench.func(*args, -1 - i)
+        durations = []
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for i in range(iterations):
+                started = time.perf_counter()
+                bench.func(*args, i)
+                durations.append(time.perf_counter() - started)
+        finally:
+            if gc_enabled:
+                gc.enable()
+    except SkipBenchmark as e:
+        return dict(result, status="skipped", reason=str(e))
+    except Exception as e:
+        return dict(result, status="error", reason=f"{type(e).__name__}: {e}")
+    finally:
+        if bench.teardown:
+            bench.teardown(context)
+    result.update(status="ok", **summarize(durations, bench.ops))
+    return result
+
+
+def environment() -> Dict[str, str]:
+    """记录结果时附带的运行环境信息"""
+    return {
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+    }
+
+
+def write_results(path: str, results: List[Dict[str, Any]]) -> None:
+    payload = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": environment(),
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+
+
+def load_results(path: str) -> Dict[str, Dict[str, Any]]:
+    """读取结果文件，按基准名索引"""
+    with open(path, "r", encoding="utf-8") as f:
+        payload = json.load(f)
+    return {item["name"]: item for item in payload["results"]}
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+            tolerance: float = 0.2) -> List[Dict[str, Any]]:
+    """与基线比较中位数耗时
+
+    Args:
+        results: 本次运行结果
+        baseline: 基线结果（按基准名索引）
+        tolerance: 允许的相对变慢比例，超过即视为回退
+
+    Returns:
+        每个可比较基准的比较记录，``regression`` 为True表示回退
+    """
+    comparisons = []
+    for result in results:
+        base = baseline.get(result["name"])
+        if result.get("status") != "ok" or not base or base.get("status") != "ok":
+            continue
+        ratio = result["median"] / base["median"] if base["median"] > 0 else float("inf")
+        comparisons.append({
+            "name": result["name"],
+            "baseline": base["median"],
+            "current": result["median"],
+            "ratio": ratio,
+            "regression": ratio > 1 + tolerance,
+            "improvement": ratio < 1 - tolerance,
+        })
+    return comparisons
+
+
+def format_duration(seconds: float) -> str:
+    if seconds >= 1:
+        return f"{seconds:.3f}s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.3f}ms"
+    return f"{seconds * 1e6:.2f}µs"
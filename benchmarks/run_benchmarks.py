@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""运行性能基准
+
+示例::
+
+    python benchmarks/run_benchmarks.py                          # 运行全部基准
+    python benchmarks/run_benchmarks.py -k graph -k tools        # 只运行名称包含关键字的基准
+    python benchmarks/run_benchmarks.py --output results.json    # 输出JSON结果
+    python benchmarks/run_benchmarks.py --save-baseline          # 把结果保存为基线
+    python benchmarks/run_benchmarks.py --tolerance 0.3          # 与基线比较，变慢超过30%视为回退
+
+存在基线文件时自动比较，发现回退时以退出码1结束，便于在CI中使用。
+"""
+
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "..", "src"))
+
+import cases  # noqa: F401  注册全部基准
+from harness import (
+    compare, format_duration, load_results, registered, run_benchmark, write_results
+)
+
+DEFAULT_BASELINE = os.path.join(ROOT, "baseline.json")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="LangGraph代理性能基准")
+    parser.add_argument("-k", "--filter", action="append", default=[],
+                        help="只运行名称包含该关键字的基准，可重复指定")
+    parser.add_argument("--iterations", type=int, default=None, help="覆盖每个基准的迭代次数")
+    parser.add_argument("--output", type=str, default=None, help="JSON结果输出路径")
+    parser.add_argument("--baseline", type=str, default=DEFAULT_BASELINE, help="基线结果文件")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基线")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="允许的相对变慢比例（默认0.2，即20%%）")
+    parser.add_argument("--list", action="store_true", help="列出全部基准")
+    args = parser.parse_args(argv)
+
+    benches = [
+        bench for name, bench in sorted(registered().items())
+        if not args.filter or any(keyword in name for keyword in args.filter)
+    ]
+    if args.list:
+        for bench in benches:
+            print(bench.name)
+        return 0
+
+    results = []
+    for bench in benches:
+        result = run_benchmark(bench, args.iterations)
+        results.append(result)
+        if result["status"] == "ok":
+            print(f"{bench.name:<28} {format_duration(result['median']):>12}/{bench.unit}"
+                  f"  p95 {format_duration(result['p95']):>12}"
+                  f"  {result['ops_per_sec']:>12.1f} {bench.unit}/s")
+        else:
+            print(f"{bench.name:<28} {result['status']}: {result['reason']}")
+
+    if args.output:
+        write_results(args.output, results)
+    if args.save_baseline:
+        write_results(args.baseline, results)
+        print(f"\n基线已保存到 {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        return 0
+    comparisons = compare(results, load_results(args.baseline), args.tolerance)
+    regressions = [c for c in comparisons if c["regression"]]
+    print(f"\n与基线比较（容忍 {args.tolerance:.0%}）:")
+    for c in comparisons:
+        mark = "回退" if c["regression"] else ("提升" if c["improvement"] else "持平")
+        print(f"  {c['name']:<28} {c['ratio']:>6.2f}x  {mark}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,7 +11,7 @@ from dotenv import load_dotenv
 # 添加src目录到Python路径
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
 
-from agent import create_agent_graph, run_agent, arun_agent, Configuration
+from agent import create_agent_graph, run_agent, arun_agent, arun_agent_batch, Configuration
 
 # 加载环境变量
 load_dotenv()
@@ -166,17 +166,18 @@ async def example_async_usage():
         "如何构建一个聊天机器人？"
     ]
     
-    # 并发执行多个查询
-    tasks = []
-    for i, query in enumerate(queries):
-        task = arun_agent(query, config, f"async_thread_{i}")
-        tasks.append(task)
-    
-    results = await asyncio.gather(*tasks)
+    # 并发执行多个查询（最多同时执行2个）
+    results = await arun_agent_batch(
+        queries,
+        config,
+        thread_ids=[f"async_thread_{i}" for i in range(len(queries))],
+        max_concurrency=2
+    )
     
-    for query, answer in zip(queries, results):
-        print(f"查询: {query}")
-        print(f"回答: {answer}")
+    for result in results:
+        print(f"查询: {result['query']}")
+        print(f"回答: {result['answer'] or result['error']}")
+        print(f"耗时: {result['elapsed']:.2f}秒")
         print()
 
 
@@ -5,15 +5,29 @@
 
 from .graph import (
     create_agent_graph,
+    get_agent_graph,
+    invalidate_graph_cache,
+    get_graph_cache_stats,
+    get_node_latency_stats,
+    flush_trace_exports,
     AgentState,
     run_agent,
     arun_agent,
+    run_agent_batch,
+    arun_agent_batch,
+    stream_agent,
+    astream_agent,
 )
 from .config import Configuration
 from .tools import get_weather, search_web, calculate
 
 __all__ = [
     "create_agent_graph",
+    "get_agent_graph",
+    "invalidate_graph_cache",
+    "get_graph_cache_stats",
+    "get_node_latency_stats",
+    "flush_trace_exports",
     "AgentState",
     "Configuration",
     "get_weather",
@@ -21,4 +35,8 @@ __all__ = [
     "calculate",
     "run_agent",
     "arun_agent",
+    "run_agent_batch",
+    "arun_agent_batch",
+    "stream_agent",
+    "astream_agent",
 ]
\ No newline at end of file
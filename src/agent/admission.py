@@ -0,0 +1,245 @@
+"""准入控制模块
+
+限制同时执行的代理运行数，超出的请求进入有界的优先级等待队列：
+
+* 并发上限：最多 ``max_in_flight`` 个请求同时执行；
+* 优先级：``interactive`` 先于 ``batch`` 出队，同一优先级先到先出；
+  队列已满时，高优先级请求会挤掉队列中最低优先级的请求；
+* 排队期限：等待超过 ``queue_timeout`` 的请求被拒绝，而不是无限期地等下去；
+* 优先级提升：多个调用者共享一次执行时，用 ``AdmissionTicket`` 排队，
+  ``promote`` 把排队中的执行提升到等待者中最高的优先级；
+* 快速拒绝：队列已满返回429，排队超时返回503，都附带根据近期执行耗时估算的
+  ``Retry-After``。
+
+过载时超出容量的请求很快被拒绝，已接纳的请求仍按正常速度完成，
+而不是所有请求一起变慢直至超时。控制器只能在一个事件循环中使用。
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from . import metrics
+
+# 优先级名称到排序值，数值越小越先出队
+PRIORITIES: Dict[str, int] = {"interactive": 0, "batch": 1}
+
+
+class AdmissionRejected(Exception):
+    """请求未被接纳
+
+    Attributes:
+        status_code: 建议返回的HTTP状态码
+        retry_after: 建议客户端重试前等待的秒数
+    """
+
+    status_code = 503
+    reason = "rejected"
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFull(AdmissionRejected):
+    """等待队列已满（或被更高优先级的请求挤出）"""
+
+    status_code = 429
+    reason = "queue_full"
+
+
+class QueueTimeout(AdmissionRejected):
+    """排队时间超过期限"""
+
+    status_code = 503
+    reason = "queue_timeout"
+
+
+class AdmissionTicket:
+    """可以在排队期间提升优先级的准入请求
+
+    Args:
+        priority: 初始优先级名称
+    """
+
+    __slots__ = ("priority", "_entry")
+
+    def __init__(self, priority: str = "interactive"):
+        if priority not in PRIORITIES:
+            raise ValueError(f"未知的优先级: {priority}")
+        self.priority = priority
+        # 排队时对应的堆条目
+        self._entry: Optional[list] = None
+
+
+class AdmissionController:
+    """带优先级等待队列的并发准入控制器
+
+    Args:
+        max_in_flight: 同时执行的最大请求数
+        max_queue: 等待队列的最大长度，为0时超出并发上限的请求立即被拒绝
+        queue_timeout: 默认的最长排队时间（秒），为None时不限制
+    """
+
+    def __init__(self, max_in_flight: int = 32, max_queue: int = 64,
+                 queue_timeout: Optional[float] = 10.0):
+        if max_in_flight <= 0:
+            raise ValueError("max_in_flight必须大于0")
+        if max_queue < 0:
+            raise ValueError("max_queue不能小于0")
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        # 堆中的条目为 [优先级, 序号, future, 优先级名称]，被移除的条目延迟删除
+        self._heap: List[list] = []
+        self._queued: Dict[str, int] = dict.fromkeys(PRIORITIES, 0)
+        self._seq = itertools.count()
+        # 执行耗时的指数移动平均，用于估算Retry-After
+        self._service_time = 1.0
+
+    @property
+    def queued(self) -> int:
+        return sum(self._queued.values())
+
+    def retry_after(self) -> int:
+        """估算队列排空所需的秒数（至少1秒）"""
+        waves = (self.queued + self.in_flight) / self.max_in_flight
+        return max(1, math.ceil(self._service_time * max(waves, 1.0)))
+
+    def _set_depth(self, priority: str, delta: int) -> None:
+        self._queued[priority] += delta
+        metrics.ADMISSION_QUEUE_DEPTH.labels(priority).inc(delta)
+
+    def _reject(self, error: AdmissionRejected, priority: str) -> AdmissionRejected:
+        metrics.ADMISSION_REJECTED.labels(priority, error.reason).inc()
+        return error
+
+    def _evict_lowest(self, rank: int) -> bool:
+        """挤出队列中优先级低于 ``rank`` 的最后一个请求，成功时返回True"""
+        victim = None
+        for entry in self._heap:
+            if entry[2].done() or entry[0] <= rank:
+                continue
+            if victim is None or (entry[0], entry[1]) > (victim[0], victim[1]):
+                victim = entry
+        if victim is None:
+            return False
+        self._set_depth(victim[3], -1)
+        victim[2].set_exception(self._reject(
+            QueueFull("请求被更高优先级的请求挤出队列", self.retry_after()), victim[3]
+        ))
+        return True
+
+    async def acquire(self, priority: str = "interactive", timeout: Optional[float] = None,
+                      ticket: Optional[AdmissionTicket] = None) -> None:
+        """获取执行名额，必要时排队；未被接纳时抛出 ``AdmissionRejected``
+
+        Args:
+            priority: 优先级名称（``interactive`` 或 ``batch``）
+            timeout: 最长排队时间（秒），为None时使用 ``queue_timeout``
+            ticket: 准入票据，给出时使用票据的优先级，排队期间可以用 ``promote`` 提升
+        """
+        if ticket is not None:
+            priority = ticket.priority
+        if priority not in PRIORITIES:
+            raise ValueError(f"未知的优先级: {priority}")
+        if self.in_flight < self.max_in_flight and not self.queued:
+            self.in_flight += 1
+            metrics.ADMISSION_IN_FLIGHT.inc()
+            metrics.ADMISSION_WAIT.labels(priority).observe(0.0)
+            return
+        rank = PRIORITIES[priority]
+        if self.queued >= self.max_queue and not self._evict_lowest(rank):
+            raise self._reject(QueueFull("等待队列已满", self.retry_after()), priority)
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [rank, next(self._seq), future, priority]
+        heapq.heappush(self._heap, entry)
+        self._set_depth(priority, 1)
+        if ticket is not None:
+            ticket._entry = entry
+        started = time.monotonic()
+        timeout = self.queue_timeout if timeout is None else timeout
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # 超时的同时拿到了名额
+                return
+            # 排队期间可能被提升过优先级，以条目中的为准
+            self._abandon(future, entry[3])
+            raise self._reject(QueueTimeout("排队超时", self.retry_after()), entry[3]) from None
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release()
+            else:
+                self._abandon(future, entry[3])
+            raise
+        finally:
+            if ticket is not None:
+                ticket._entry = None
+            metrics.ADMISSION_WAIT.labels(priority).observe(time.monotonic() - started)
+
+    def promote(self, ticket: AdmissionTicket, priority: str) -> None:
+        """把票据提升到 ``priority``（不会降低）；票据正在排队时立即调整它在队列中的位置"""
+        if priority not in PRIORITIES:
+            raise ValueError(f"未知的优先级: {priority}")
+        if PRIORITIES[priority] >= PRIORITIES[ticket.priority]:
+            return
+        ticket.priority = priority
+        entry = ticket._entry
+        if entry is None or entry[2].done():
+            return
+        self._set_depth(entry[3], -1)
+        self._set_depth(priority, 1)
+        entry[0], entry[3] = PRIORITIES[priority], priority
+        # 队列长度有上限，直接重建堆即可
+        heapq.heapify(self._heap)
+
+    def _abandon(self, future: "asyncio.Future", priority: str) -> None:
+        if not future.done():
+            future.cancel()
+            self._set_depth(priority, -1)
+
+    def release(self, service_time: Optional[float] = None) -> None:
+        """归还执行名额，名额直接交给队列中优先级最高的请求
+
+        Args:
+            service_time: 本次执行的耗时（秒），用于估算Retry-After
+        """
+        if service_time is not None:
+            self._service_time = 0.8 * self._service_time + 0.2 * service_time
+        while self._heap:
+            _, _, future, priority = heapq.heappop(self._heap)
+            if future.done():
+                continue
+            self._set_depth(priority, -1)
+            future.set_result(None)
+            return
+        self.in_flight -= 1
+        metrics.ADMISSION_IN_FLIGHT.dec()
+
+    @asynccontextmanager
+    async def admit(self, priority: str = "interactive", timeout: Optional[float] = None,
+                    ticket: Optional[AdmissionTicket] = None):
+        """``async with`` 形式的 ``acquire``/``release``"""
+        await self.acquire(priority, timeout, ticket)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": dict(self._queued),
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "service_time": self._service_time,
+        }
@@ -0,0 +1,351 @@
+"""离线批量处理模块
+
+从JSONL文件流式读取查询，用固定数量的工作协程并发运行代理，并把结果
+逐条追加到输出JSONL文件。处理进度定期写入进度文件，进程中断后重新运行
+同一命令即可从中断处继续；内存占用只与并发数有关，与文件大小无关。
+
+输入文件每行一个JSON对象，至少包含 ``query`` 字段，可选 ``id`` 和
+``thread_id``（也可以直接是一个JSON字符串）。输出按完成顺序写入，每行
+包含输入行号 ``line``，可据此与输入对应。
+"""
+
+import asyncio
+import json
+import math
+import os
+import time
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from .config import Configuration
+from .graph import _ainvoke_agent, get_agent_graph
+
+
+class LatencyHistogram:
+    """固定内存的延迟直方图
+
+    使用按比例增长的对数分桶，百分位数的相对误差不超过 ``growth - 1``。
+    """
+
+    def __init__(self, min_value: float = 0.001, growth: float = 1.05):
+        self.min_value = min_value
+        self.growth = growth
+        self._log_growth = math.log(growth)
+        self._buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value: float) -> None:
+        """记录一个观测值（秒）"""
+        if value <= self.min_value:
+            index = 0
+        else:
+            index = int(math.log(value / self.min_value) / self._log_growth) + 1
+        self._buckets[index] = self._buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q: float) -> float:
+        """返回第q百分位数（0-100）的估计值，没有观测值时返回0"""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * q / 100))
+        seen = 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                if index == 0:
+                    return self.min_value
+                # 取桶的上界，且不超过实际最大值
+                return min(self.min_value * self.growth ** index, self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class BatchProgress:
+    """批量任务的断点进度
+
+    ``watermark`` 之前的输入行都已处理完成；``done`` 是水位线之后已提前
+    完成的行号（数量不超过 ``BatchRunner`` 的 ``max_ahead``）；``input_offset`` 是水位线所在行在输入
+    文件中的字节偏移，恢复时直接从这里开始读取；``output_offset`` 是保存进度
+    时输出文件的长度，之后写入的结果在恢复时重新扫描。
+    """
+
+    def __init__(self, watermark: int = 0, input_offset: int = 0, output_offset: int = 0,
+                 done: Optional[Set[int]] = None):
+        self.watermark = watermark
+        self.input_offset = input_offset
+        self.output_offset = output_offset
+        self.done: Set[int] = set(done or ())
+
+    @classmethod
+    def load(cls, path: str) -> "BatchProgress":
+        """读取进度文件，文件不存在时返回初始进度"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls()
+        return cls(
+            watermark=data["watermark"],
+            input_offset=data["input_offset"],
+            output_offset=data["output_offset"],
+            done=set(data.get("done", ())),
+        )
+
+    def save(self, path: str) -> None:
+        """原子地写入进度文件"""
+        data = {
+            "watermark": self.watermark,
+            "input_offset": self.input_offset,
+            "output_offset": self.output_offset,
+            "done": sorted(self.done),
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+
+def _parse_line(raw: bytes) -> Dict[str, Any]:
+    item = json.loads(raw)
+    if isinstance(item, str):
+        item = {"query": item}
+    if not isinstance(item, dict) or not isinstance(item.get("query"), str):
+        raise ValueError("每行必须是包含query字段的JSON对象")
+    return item
+
+
+class BatchRunner:
+    """可断点续跑的JSONL批量处理器
+
+    Args:
+        input_path: 输入JSONL文件路径
+        output_path: 输出JSONL文件路径（追加写入）
+        config: 配置对象
+        concurrency: 并发工作协程数，默认取 ``config.batch_concurrency``
+        progress_path: 进度文件路径，默认为 ``<output_path>.progress``
+        resume: 为False时忽略已有进度并清空输出文件
+        checkpoint_interval: 保存进度的最小间隔（秒）
+        report_interval: 输出统计信息的间隔（秒），为0时不输出
+        report: 输出统计信息的函数
+        max_ahead: 水位线之后最多读入的行数，默认为并发数的64倍；某一行处理得很慢时
+            暂停读取新行，进度文件和内存占用因此保持有界
+    """
+
+    def __init__(
+        self,
+        input_path: str,
+        output_path: str,
+        config: Optional[Configuration] = None,
+        concurrency: Optional[int] = None,
+        progress_path: Optional[str] = None,
+        resume: bool = True,
+        checkpoint_interval: float = 5.0,
+        report_interval: float = 10.0,
+        report: Callable[[str], None] = print,
+        max_ahead: Optional[int] = None,
+    ):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.config = config or Configuration()
+        self.concurrency = concurrency or self.config.batch_concurrency
+        if self.concurrency <= 0:
+            raise ValueError("concurrency必须大于0")
+        self.progress_path = progress_path or f"{output_path}.progress"
+        self.resume = resume
+        self.checkpoint_interval = checkpoint_interval
+        self.report_interval = report_interval
+        self.report = report
+        self.max_ahead = max_ahead or self.concurrency * 64
+        if self.max_ahead < self.concurrency:
+            raise ValueError("max_ahead不能小于concurrency")
+
+        self.latency = LatencyHistogram()
+        self.completed = 0
+        self.errors = 0
+        self.skipped = 0
+
+    # -- 进度 -------------------------------------------------------------
+
+    def _recover(self, output) -> BatchProgress:
+        """加载进度，并补上最后一次保存进度之后已写入输出的结果"""
+        progress = BatchProgress.load(self.progress_path)
+        offset = min(progress.output_offset, output.seek(0, os.SEEK_END))
+        output.seek(offset)
+        for raw in output:
+            if not raw.endswith(b"\n"):
+                # 中断时写了一半的记录，丢弃后重新处理
+                break
+            try:
+                line = json.loads(raw)["line"]
+            except (ValueError, KeyError, TypeError):
+                break
+            if line >= progress.watermark:
+                progress.done.add(line)
+            offset += len(raw)
+        output.seek(offset)
+        output.truncate()
+        progress.output_offset = offset
+        return progress
+
+    def _advance(self, progress: BatchProgress, offsets: Dict[int, int],
+                 next_line: int, next_offset: int) -> None:
+        # 水位线不能越过尚未读到的行，否则无法确定它对应的输入偏移
+        while progress.watermark < next_line and progress.watermark in progress.done:
+            progress.done.discard(progress.watermark)
+            offsets.pop(progress.watermark, None)
+            progress.watermark += 1
+        if progress.watermark in offsets:
+            progress.input_offset = offsets[progress.watermark]
+        elif progress.watermark == next_line:
+            progress.input_offset = next_offset
+
+    # -- 统计 -------------------------------------------------------------
+
+    def stats(self, elapsed: float) -> Dict[str, Any]:
+        """返回当前的吞吐量和延迟统计"""
+        return {
+            "completed": self.completed,
+            "errors": self.errors,
+            "skipped": self.skipped,
+            "elapsed": elapsed,
+            "throughput": self.completed / elapsed if elapsed > 0 else 0.0,
+            "latency_mean": self.latency.mean,
+            "latency_p50": self.latency.percentile(50),
+            "latency_p90": self.latency.percentile(90),
+            "latency_p99": self.latency.percentile(99),
+            "latency_max": self.latency.max,
+        }
+
+    def _format_stats(self, stats: Dict[str, Any]) -> str:
+        return (
+            f"已完成 {stats['completed']} 条（失败 {stats['errors']}，跳过 {stats['skipped']}）"
+            f" | 吞吐 {stats['throughput']:.2f} 条/秒"
+            f" | 延迟 p50 {stats['latency_p50']:.2f}s"
+            f" p90 {stats['latency_p90']:.2f}s"
+            f" p99 {stats['latency_p99']:.2f}s"
+        )
+
+    # -- 执行 -------------------------------------------------------------
+
+    async def run(self) -> Dict[str, Any]:
+        """处理整个输入文件，返回最终统计信息"""
+        if not self.resume:
+            for path in (self.output_path, self.progress_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        app = get_agent_graph(self.config)
+        started = time.perf_counter()
+        queue: "asyncio.Queue[Optional[Tuple[int, bytes]]]" = asyncio.Queue(
+            maxsize=self.concurrency * 2
+        )
+        # 已读入但水位线尚未越过的行的字节偏移，数量不超过max_ahead
+        offsets: Dict[int, int] = {}
+        # 水位线推进、offsets低于上限时通知读取协程继续
+        room = asyncio.Event()
+
+        with open(self.output_path, "a+b") as output:
+            progress = self._recover(output)
+            reader_state = {"line": progress.watermark, "offset": progress.input_offset}
+            self.skipped = progress.watermark + len(progress.done)
+            last_checkpoint = time.monotonic()
+            last_report = time.monotonic()
+
+            def checkpoint() -> None:
+                self._advance(progress, offsets, reader_state["line"], reader_state["offset"])
+                output.flush()
+                os.fsync(output.fileno())
+                progress.output_offset = output.tell()
+                progress.save(self.progress_path)
+
+            def complete(line: int, record: Optional[Dict[str, Any]]) -> None:
+                nonlocal last_checkpoint, last_report
+                if record is not None:
+                    output.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+                progress.done.add(line)
+                self._advance(progress, offsets, reader_state["line"], reader_state["offset"])
+                if len(offsets) < self.max_ahead:
+                    room.set()
+                now = time.monotonic()
+                if now - last_checkpoint >= self.checkpoint_interval:
+                    checkpoint()
+                    last_checkpoint = now
+                if self.report_interval and now - last_report >= self.report_interval:
+                    self.report(self._format_stats(self.stats(time.perf_counter() - started)))
+                    last_report = now
+
+            async def read_input() -> None:
+                with open(self.input_path, "rb") as f:
+                    f.seek(progress.input_offset)
+                    line, offset = progress.watermark, progress.input_offset
+                    for raw in f:
+                        # 背压：水位线停在一个慢的行上时，不再无限制地读入后面的行；
+                        # 在更新reader_state之前等待，水位线才能推进到当前读到的位置
+                        while len(offsets) >= self.max_ahead:
+                            room.clear()
+                            await room.wait()
+                        current, line, offset = line, line + 1, offset + len(raw)
+                        reader_state["line"], reader_state["offset"] = line, offset
+                        if current in progress.done:
+                            continue
+                        offsets[current] = offset - len(raw)
+                        if not raw.strip():
+                            complete(current, None)
+                            continue
+                        await queue.put((current, raw))
+                for _ in range(self.concurrency):
+                    await queue.put(None)
+
+            async def worker() -> None:
+                while True:
+                    item = await queue.get()
+                    if item is None:
+                        return
+                    line, raw = item
+                    record: Dict[str, Any] = {"line": line}
+                    item_started = time.perf_counter()
+                    try:
+                        data = _parse_line(raw)
+                        record.update(id=data.get("id"), query=data["query"])
+                        record["answer"] = await _ainvoke_agent(
+                            app, data["query"], self.config, data.get("thread_id")
+                        )
+                        record["error"] = None
+                    except Exception as e:
+                        record["answer"] = None
+                        record["error"] = f"{type(e).__name__}: {e}"
+                        self.errors += 1
+                    elapsed = time.perf_counter() - item_started
+                    record["elapsed"] = elapsed
+                    self.latency.record(elapsed)
+                    self.completed += 1
+                    complete(line, record)
+
+            try:
+                await asyncio.gather(read_input(), *(worker() for _ in range(self.concurrency)))
+            finally:
+                checkpoint()
+
+        stats = self.stats(time.perf_counter() - started)
+        if self.report_interval:
+            self.report(self._format_stats(stats))
+        return stats
+
+
+def run_batch_file(input_path: str, output_path: str, config: Optional[Configuration] = None,
+                   **kwargs) -> Dict[str, Any]:
+    """同步处理JSONL批量文件，参数见 ``BatchRunner``
+
+    Returns:
+        最终统计信息（完成数、失败数、吞吐量和延迟百分位数）
+    """
+    runner = BatchRunner(input_path, output_path, config=config, **kwargs)
+    return asyncio.run(runner.run())
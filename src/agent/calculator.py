@@ -0,0 +1,380 @@
+"""安全的数学表达式求值模块
+
+把表达式解析为AST并编译成闭包，按归一化后的表达式缓存，避免每次调用
+都重新解析和 ``eval``。求值过程中限制整数操作数的大小和幂指数，
+防止 ``pow(10, 10**8)`` 之类的表达式长时间占用CPU。
+
+批量求值时，结构相同、仅数字常量不同的表达式会在NumPy可用时向量化计算。
+"""
+
+import ast
+import math
+import operator
+import re
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - NumPy是可选依赖
+    np = None
+
+
+# 整数运算结果允许的最大位数（约1233位十进制数）
+MAX_INT_BITS = 4096
+# 幂运算允许的最大指数绝对值
+MAX_EXPONENT = 10000
+# 表达式最大长度，避免解析超长输入
+MAX_EXPRESSION_LENGTH = 1000
+# 语法树的最大嵌套深度（编译和求值都是递归的）
+MAX_EXPRESSION_DEPTH = 200
+# round允许的最大保留位数绝对值（round的耗时随位数增长）
+MAX_ROUND_DIGITS = 100
+
+
+class CalculationError(ValueError):
+    """表达式不合法或超出计算限制"""
+
+
+def _check_result(value: Any) -> Any:
+    if isinstance(value, int) and not isinstance(value, bool):
+        if value.bit_length() > MAX_INT_BITS:
+            raise CalculationError(f"数值超出允许范围（最多{MAX_INT_BITS}位）")
+    elif isinstance(value, complex):
+        raise CalculationError("结果为复数，只支持实数运算")
+    return value
+
+
+def _safe_pow(base, exponent, modulus=None):
+    if modulus is not None:
+        return pow(base, exponent, modulus)
+    if isinstance(exponent, (int, float)) and abs(exponent) > MAX_EXPONENT:
+        raise CalculationError(f"指数超出允许范围（最大{MAX_EXPONENT}）")
+    if isinstance(base, int) and isinstance(exponent, int) and exponent > 0:
+        if max(base.bit_length(), 1) * exponent > MAX_INT_BITS + 64:
+            raise CalculationError(f"数值超出允许范围（最多{MAX_INT_BITS}位）")
+    return _check_result(pow(base, exponent))
+
+
+def _safe_round(number, ndigits=None):
+    if ndigits is not None:
+        if isinstance(ndigits, bool) or not isinstance(ndigits, int):
+            raise CalculationError("round的保留位数必须是整数")
+        if abs(ndigits) > MAX_ROUND_DIGITS:
+            raise CalculationError(f"保留位数超出允许范围（最大{MAX_ROUND_DIGITS}）")
+    return _check_result(round(number, ndigits))
+
+
+def _safe_mul(left, right):
+    if isinstance(left, int) and isinstance(right, int):
+        if left.bit_length() + right.bit_length() > MAX_INT_BITS + 1:
+            raise CalculationError(f"数值超出允许范围（最多{MAX_INT_BITS}位）")
+    return left * right
+
+
+_BIN_OPS: Dict[type, Callable[[Any, Any], Any]] = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: _safe_mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: _safe_pow,
+}
+
+_UNARY_OPS: Dict[type, Callable[[Any], Any]] = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+FUNCTIONS: Dict[str, Callable[..., Any]] = {
+    "abs": abs,
+    "round": _safe_round,
+    "min": min,
+    "max": max,
+    "sum": sum,
+    "pow": _safe_pow,
+    "sqrt": math.sqrt,
+    "sin": math.sin,
+    "cos": math.cos,
+    "tan": math.tan,
+    "log": math.log,
+    "log10": math.log10,
+    "exp": math.exp,
+}
+
+CONSTANTS: Dict[str, float] = {
+    "pi": math.pi,
+    "e": math.e,
+}
+
+
+def normalize_expression(expression: str) -> str:
+    """去除首尾空白并把连续空白合并为一个空格
+
+    不能删除全部空白：``"1 2"`` 是语法错误，而 ``"12"`` 是合法的数字。
+    """
+    return " ".join(expression.split())
+
+
+def _check_depth(tree: ast.AST) -> None:
+    # 迭代遍历，避免对过深的语法树本身发生递归
+    stack = [(tree, 1)]
+    while stack:
+        node, depth = stack.pop()
+        if depth > MAX_EXPRESSION_DEPTH:
+            raise CalculationError(f"表达式嵌套过深（最多{MAX_EXPRESSION_DEPTH}层）")
+        stack.extend((child, depth + 1) for child in ast.iter_child_nodes(node))
+
+
+def _parse(expression: str) -> ast.Expression:
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        raise CalculationError(f"表达式过长（最多{MAX_EXPRESSION_LENGTH}个字符）")
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError as e:
+        raise CalculationError(f"语法错误：{e.msg}") from None
+    except (RecursionError, MemoryError):
+        raise CalculationError("表达式嵌套过深") from None
+    _check_depth(tree)
+    return tree
+
+
+class _Compiler:
+    """把AST编译为无参闭包"""
+
+    def compile(self, node: ast.AST) -> Callable[[], Any]:
+        method = getattr(self, f"_compile_{type(node).__name__}", None)
+        if method is None:
+            raise CalculationError(f"不支持的语法：{type(node).__name__}")
+        return method(node)
+
+    def _compile_Expression(self, node):
+        return self.compile(node.body)
+
+    def _compile_Constant(self, node):
+        value = node.value
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise CalculationError(f"不支持的常量：{value!r}")
+        _check_result(value)
+        return lambda: value
+
+    def _compile_Name(self, node):
+        if node.id not in CONSTANTS:
+            raise CalculationError(f"不支持的名称：{node.id}")
+        value = CONSTANTS[node.id]
+        return lambda: value
+
+    def _compile_BinOp(self, node):
+        op = _BIN_OPS.get(type(node.op))
+        if op is None:
+            raise CalculationError(f"不支持的运算符：{type(node.op).__name__}")
+        left, right = self.compile(node.left), self.compile(node.right)
+        return lambda: _check_result(op(left(), right()))
+
+    def _compile_UnaryOp(self, node):
+        op = _UNARY_OPS.get(type(node.op))
+        if op is None:
+            raise CalculationError(f"不支持的运算符：{type(node.op).__name__}")
+        operand = self.compile(node.operand)
+        return lambda: op(operand())
+
+    def _compile_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+            name = getattr(node.func, "id", type(node.func).__name__)
+            raise CalculationError(f"不支持的函数：{name}")
+        if node.keywords:
+            raise CalculationError("不支持关键字参数")
+        func = FUNCTIONS[node.func.id]
+        args = [self.compile(arg) for arg in node.args]
+        return lambda: _check_result(func(*(arg() for arg in args)))
+
+    def _compile_List(self, node):
+        items = [self.compile(elt) for elt in node.elts]
+        return lambda: [item() for item in items]
+
+    _compile_Tuple = _compile_List
+
+
+@lru_cache(maxsize=4096)
+def compile_expression(expression: str) -> Callable[[], Any]:
+    """把（已归一化的）表达式编译为闭包，结果按表达式字符串缓存"""
+    return _Compiler().compile(_parse(expression))
+
+
+def evaluate(expression: str) -> Any:
+    """安全地计算单个表达式
+
+    Raises:
+        CalculationError: 表达式不合法或超出计算限制
+        ArithmeticError: 除零、溢出等运算错误
+    """
+    return compile_expression(normalize_expression(expression))()
+
+
+# ---------------------------------------------------------------------------
+# 批量求值
+# ---------------------------------------------------------------------------
+
+# 产生浮点结果、可以安全地用float64向量化的函数
+_VECTOR_FUNCTIONS = {
+    "sqrt": "sqrt",
+    "sin": "sin",
+    "cos": "cos",
+    "tan": "tan",
+    "log10": "log10",
+    "exp": "exp",
+    "abs": "abs",
+}
+
+
+# 数字字面量（不匹配标识符中的数字，如 log10）
+_NUMBER = re.compile(
+    r"(?<![\w.])(?:\d+\.\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?|\d+(?:[eE][+-]?\d+)?)(?![\w.])"
+)
+
+
+def _split_shape(expression: str) -> Tuple[str, List[Any]]:
+    """把数字常量替换为占位符，返回（形状字符串, 常量列表）"""
+    constants: List[Any] = []
+
+    def placeholder(match):
+        text = match.group(0)
+        constants.append(float(text) if any(c in text for c in ".eE") else int(text))
+        return f"__c{len(constants) - 1}"
+
+    return _NUMBER.sub(placeholder, expression), constants
+
+
+def _is_vectorizable(tree: ast.AST) -> bool:
+    """只有结果本来就是浮点数的表达式才向量化，避免改变整数运算语义"""
+    produces_float = False
+    callees = {id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)}
+    for node in ast.walk(tree):
+        if id(node) in callees:
+            continue
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in _VECTOR_FUNCTIONS:
+                return False
+            if node.keywords or len(node.args) != 1:
+                return False
+            if node.func.id != "abs":
+                produces_float = True
+        elif isinstance(node, ast.BinOp):
+            if type(node.op) not in (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow):
+                return False
+            if isinstance(node.op, ast.Div):
+                produces_float = True
+        elif isinstance(node, ast.Name):
+            if node.id in CONSTANTS:
+                produces_float = True
+            elif not node.id.startswith("__c"):
+                return False
+        elif not isinstance(node, (ast.Expression, ast.UnaryOp, ast.Load,
+                                   ast.operator, ast.unaryop)):
+            return False
+    return produces_float
+
+
+class _VectorCompiler:
+    """把形状模板编译成对NumPy数组逐元素计算的函数"""
+
+    _OPS = {
+        ast.Add: "add",
+        ast.Sub: "subtract",
+        ast.Mult: "multiply",
+        ast.Div: "true_divide",
+        ast.Pow: "power",
+    }
+
+    def compile(self, node):
+        if isinstance(node, ast.Expression):
+            return self.compile(node.body)
+        if isinstance(node, ast.Name):
+            if node.id in CONSTANTS:
+                value = CONSTANTS[node.id]
+                return lambda columns: value
+            index = int(node.id[3:])
+            return lambda columns: columns[index]
+        if isinstance(node, ast.BinOp):
+            op = getattr(np, self._OPS[type(node.op)])
+            left, right = self.compile(node.left), self.compile(node.right)
+            return lambda columns: op(left(columns), right(columns))
+        if isinstance(node, ast.UnaryOp):
+            operand = self.compile(node.operand)
+            if isinstance(node.op, ast.USub):
+                return lambda columns: np.negative(operand(columns))
+            return operand
+        if isinstance(node, ast.Call):
+            func = getattr(np, _VECTOR_FUNCTIONS[node.func.id])
+            arg = self.compile(node.args[0])
+            return lambda columns: func(arg(columns))
+        raise CalculationError(f"不支持的语法：{type(node).__name__}")
+
+
+@lru_cache(maxsize=1024)
+def _compile_shape(shape: str):
+    """编译形状模板；不可向量化（或NumPy不可用）时返回None"""
+    if np is None:
+        return None
+    try:
+        tree = _parse(shape)
+    except CalculationError:
+        return None
+    if not _is_vectorizable(tree):
+        return None
+    return _VectorCompiler().compile(tree)
+
+
+def evaluate_batch(expressions: List[str]) -> List[Any]:
+    """批量计算表达式
+
+    结构相同的浮点表达式在NumPy可用时向量化计算，其余逐个计算。
+    每个位置返回计算结果，或在失败时返回对应的异常对象。
+
+    Args:
+        expressions: 表达式列表
+
+    Returns:
+        与输入顺序一致的结果列表
+    """
+    results: List[Any] = [None] * len(expressions)
+    groups: Dict[str, List[Tuple[int, List[Any]]]] = {}
+    scalar: List[int] = []
+
+    for i, expression in enumerate(expressions):
+        if np is None or len(expression) > MAX_EXPRESSION_LENGTH:
+            scalar.append(i)
+            continue
+        shape, constants = _split_shape(normalize_expression(expression))
+        groups.setdefault(shape, []).append((i, constants))
+
+    for shape, members in groups.items():
+        func = _compile_shape(shape) if len(members) > 1 else None
+        if func is None:
+            scalar.extend(i for i, _ in members)
+            continue
+        try:
+            columns = [
+                np.array(column, dtype=np.float64)
+                for column in zip(*(constants for _, constants in members))
+            ]
+        except OverflowError:
+            scalar.extend(i for i, _ in members)
+            continue
+        with np.errstate(all="ignore"):
+            values = np.broadcast_to(func(columns), (len(members),))
+        finite = np.isfinite(values).tolist()
+        for (i, _), value, ok in zip(members, values.tolist(), finite):
+            if ok:
+                results[i] = value
+            else:
+                # 除零、溢出等情况交给标量路径给出与单个计算一致的错误
+                scalar.append(i)
+
+    for i in scalar:
+        try:
+            results[i] = evaluate(expressions[i])
+        except Exception as e:
+            results[i] = e
+    return results
@@ -0,0 +1,450 @@
+"""LLM HTTP客户端模块
+
+进程级的HTTP客户端注册表，按（提供商、API密钥、基础URL）共享连接池，
+所有图形和代理复用同一批keep-alive连接，不必为每个模型实例重新建立TCP/TLS连接：
+
+* 安装了httpx时使用 ``httpx.Client``/``httpx.AsyncClient``，按配置限制连接数和空闲连接数，
+  安装了h2时启用HTTP/2（同一连接上多路复用并发请求）；
+* 没有httpx时使用基于 ``http.client`` 的 ``KeepAlivePool``（HTTP/1.1）。
+
+``get_http_client_stats()`` 返回各连接池的请求数、新建和复用的连接数、
+正在使用和空闲的连接数以及利用率。在事件循环中使用 ``aclose_http_clients()`` 关闭连接池。
+"""
+
+import asyncio
+import hashlib
+import http.client
+import threading
+import time
+import weakref
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+from urllib.parse import urlsplit
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - httpx是可选依赖
+    httpx = None
+
+try:
+    import h2  # noqa: F401
+except ImportError:  # pragma: no cover - h2是可选依赖
+    HTTP2_AVAILABLE = False
+else:  # pragma: no cover
+    HTTP2_AVAILABLE = True
+
+
+class PoolTimeout(TimeoutError):
+    """等待空闲连接超时"""
+
+
+class PooledResponse:
+    """``KeepAlivePool`` 的响应：状态码、响应头和完整的响应体"""
+
+    __slots__ = ("status", "headers", "content")
+
+    def __init__(self, status: int, headers: Dict[str, str], content: bytes):
+        self.status = status
+        self.headers = headers
+        self.content = content
+
+    @property
+    def status_code(self) -> int:
+        return self.status
+
+    def text(self, encoding: str = "utf-8") -> str:
+        return self.content.decode(encoding)
+
+
+# 复用的空闲连接可能已被服务端关闭，这些错误在发送请求时出现则换新连接重试一次
+_STALE_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError,
+                 http.client.CannotSendRequest)
+
+
+class KeepAlivePool:
+    """基于 ``http.client`` 的keep-alive连接池
+
+    Args:
+        base_url: 基础URL（``http://`` 或 ``https://``）
+        max_connections: 最大连接数，超出时请求等待空闲连接
+        max_keepalive: 最多保留的空闲连接数
+        keepalive_expiry: 空闲连接的保留时间（秒）
+        timeout: 连接和读取超时（秒）
+        pool_timeout: 等待空闲连接的最长时间（秒），为None时一直等待
+    """
+
+    def __init__(self, base_url: str, max_connections: int = 20, max_keepalive: int = 10,
+                 keepalive_expiry: float = 30.0, timeout: Optional[float] = None,
+                 pool_timeout: Optional[float] = None):
+        if max_connections <= 0:
+            raise ValueError("max_connections必须大于0")
+        parts = urlsplit(base_url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"不支持的URL: {base_url}")
+        self.base_url = base_url.rstrip("/")
+        self._scheme = parts.scheme
+        self._host = parts.hostname
+        self._port = parts.port
+        self._prefix = parts.path.rstrip("/")
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self.pool_timeout = pool_timeout
+        # 空闲连接栈（后进先出，最近用过的连接最不可能已被服务端关闭）
+        self._idle: List[Tuple[float, http.client.HTTPConnection]] = []
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stats = dict.fromkeys(
+            ("requests", "connections_opened", "connections_reused", "in_use", "peak_in_use"), 0
+        )
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        cls = http.client.HTTPSConnection if self._scheme == "https" else http.client.HTTPConnection
+        with self._lock:
+            self._stats["connections_opened"] += 1
+        return cls(self._host, self._port, timeout=self.timeout)
+
+    def _acquire(self) -> Tuple[http.client.HTTPConnection, bool]:
+        if not self._slots.acquire(timeout=self.pool_timeout):
+            raise PoolTimeout("等待空闲连接超时")
+        now = time.monotonic()
+        conn = None
+        with self._lock:
+            self._stats["in_use"] += 1
+            self._stats["peak_in_use"] = max(self._stats["peak_in_use"], self._stats["in_use"])
+            while self._idle:
+                idle_since, candidate = self._idle.pop()
+                if now - idle_since < self.keepalive_expiry:
+                    conn = candidate
+                    self._stats["connections_reused"] += 1
+                    break
+                candidate.close()
+        if conn is not None:
+            return conn, True
+        return self._new_connection(), False
+
+    def _release(self, conn: http.client.HTTPConnection, reusable: bool) -> None:
+        with self._lock:
+            self._stats["in_use"] -= 1
+            if reusable and not self._closed and len(self._idle) < self.max_keepalive:
+                self._idle.append((time.monotonic(), conn))
+                conn = None
+        if conn is not None:
+            conn.close()
+        self._slots.release()
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None,
+                headers: Optional[Mapping[str, str]] = None) -> PooledResponse:
+        """发送请求并读取完整响应，连接用完后放回连接池"""
+        if self._closed:
+            raise RuntimeError("连接池已关闭")
+        with self._lock:
+            self._stats["requests"] += 1
+        url = self._prefix + path
+        conn, reused = self._acquire()
+        reusable = False
+        try:
+            try:
+                conn.request(method, url, body=body, headers=dict(headers or {}))
+                response = conn.getresponse()
+            except _STALE_ERRORS:
+                if not reused:
+                    raise
+                conn.close()
+                conn = self._new_connection()
+                conn.request(method, url, body=body, headers=dict(headers or {}))
+                response = conn.getresponse()
+            content = response.read()
+            reusable = not response.will_close
+            return PooledResponse(response.status, dict(response.getheaders()), content)
+        finally:
+            self._release(conn, reusable)
+
+    async def arequest(self, method: str, path: str, body: Optional[bytes] = None,
+                       headers: Optional[Mapping[str, str]] = None) -> PooledResponse:
+        """``request`` 的异步版本，在默认线程池中执行"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.request, method, path, body, headers)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["idle"] = len(self._idle)
+        stats["max_connections"] = self.max_connections
+        stats["utilization"] = stats["in_use"] / self.max_connections
+        stats["http2"] = False
+        return stats
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for _, conn in idle:
+            conn.close()
+
+    async def aclose(self) -> None:
+        """与 ``HTTPXPool.aclose`` 接口一致；关闭空闲连接不会阻塞"""
+        self.close()
+
+
+# 没有安装httpx时传输层包装类不会被实例化，基类退化为object
+_BaseTransport = httpx.BaseTransport if httpx is not None else object
+_AsyncBaseTransport = httpx.AsyncBaseTransport if httpx is not None else object
+
+
+class _CountingTransport(_BaseTransport):
+    """统计正在等待响应头的请求数；请求失败（连接错误、超时、取消）时同样计数归还"""
+
+    def __init__(self, transport, pool: "HTTPXPool"):
+        self.transport = transport
+        self._pool = pool
+
+    def handle_request(self, request):
+        self._pool._started()
+        try:
+            return self.transport.handle_request(request)
+        finally:
+            self._pool._finished()
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class _AsyncCountingTransport(_AsyncBaseTransport):
+    """``_CountingTransport`` 的异步版本"""
+
+    def __init__(self, transport, pool: "HTTPXPool"):
+        self.transport = transport
+        self._pool = pool
+
+    async def handle_async_request(self, request):
+        self._pool._started()
+        try:
+            return await self.transport.handle_async_request(request)
+        finally:
+            self._pool._finished()
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class _LoopTransports(_AsyncBaseTransport):
+    """每个事件循环使用各自的异步传输层
+
+    httpx的异步连接只能在创建它的事件循环中使用，而 ``run_agent_batch`` 等同步入口
+    每次都用 ``asyncio.run`` 新建事件循环，所以共享的 ``AsyncClient`` 按当前事件循环
+    分派到各自的连接池。已关闭的事件循环的传输层被丢弃，连接随之回收。
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._transports = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def transports(self) -> List[Any]:
+        with self._lock:
+            return list(self._transports.values())
+
+    def _current(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            for closed in [other for other in self._transports if other.is_closed()]:
+                del self._transports[closed]
+            transport = self._transports.get(loop)
+            if transport is None:
+                transport = self._transports[loop] = self._factory()
+            return transport
+
+    async def handle_async_request(self, request):
+        return await self._current().handle_async_request(request)
+
+    async def aclose(self) -> None:
+        """关闭全部传输层：当前事件循环的直接关闭，其他仍在运行的事件循环中的交给它们自己关闭"""
+        try:
+            current = asyncio.get_running_loop()
+        except RuntimeError:
+            current = None
+        with self._lock:
+            transports = list(self._transports.items())
+            self._transports.clear()
+        for loop, transport in transports:
+            if loop is current:
+                await transport.aclose()
+            elif loop.is_running() and not loop.is_closed():
+                asyncio.run_coroutine_threadsafe(transport.aclose(), loop)
+
+
+class HTTPXPool:
+    """共享的httpx同步和异步客户端（需要安装httpx）
+
+    参数与 ``KeepAlivePool`` 相同；``http2`` 为True且安装了h2时启用HTTP/2。
+    ``client`` 和 ``async_client`` 可以直接传给模型SDK；``async_client`` 可以在多个
+    事件循环中使用，每个事件循环有自己的连接池。
+    """
+
+    def __init__(self, base_url: str, max_connections: int = 20, max_keepalive: int = 10,
+                 keepalive_expiry: float = 30.0, timeout: Optional[float] = None,
+                 pool_timeout: Optional[float] = None, http2: bool = True):
+        if httpx is None:
+            raise RuntimeError("HTTPXPool需要安装httpx")
+        self.base_url = base_url.rstrip("/")
+        self.max_connections = max_connections
+        self.http2 = http2 and HTTP2_AVAILABLE
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        timeouts = httpx.Timeout(timeout, pool=pool_timeout)
+        self._stats = dict.fromkeys(("requests", "in_use", "peak_in_use"), 0)
+        self._lock = threading.Lock()
+        # 在传输层计数：无论请求成功还是失败，计数都在 finally 中归还
+        self._transport = httpx.HTTPTransport(limits=limits, http2=self.http2)
+        self._async_transports = _LoopTransports(
+            lambda: httpx.AsyncHTTPTransport(limits=limits, http2=self.http2))
+        self.client = httpx.Client(
+            timeout=timeouts, transport=_CountingTransport(self._transport, self))
+        self.async_client = httpx.AsyncClient(
+            timeout=timeouts, transport=_AsyncCountingTransport(self._async_transports, self))
+
+    def _started(self) -> None:
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["in_use"] += 1
+            self._stats["peak_in_use"] = max(self._stats["peak_in_use"], self._stats["in_use"])
+
+    def _finished(self) -> None:
+        with self._lock:
+            self._stats["in_use"] -= 1
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None,
+                headers: Optional[Mapping[str, str]] = None):
+        return self.client.request(method, self.base_url + path, content=body, headers=headers)
+
+    async def arequest(self, method: str, path: str, body: Optional[bytes] = None,
+                       headers: Optional[Mapping[str, str]] = None):
+        return await self.async_client.request(
+            method, self.base_url + path, content=body, headers=headers)
+
+    @staticmethod
+    def _connections(transport) -> List[Any]:
+        # httpx不公开连接复用情况，连接数从底层连接池读取
+        pool = getattr(transport, "_pool", None)
+        return list(getattr(pool, "connections", ()))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+        connections = self._connections(self._transport)
+        for transport in self._async_transports.transports():
+            connections += self._connections(transport)
+        stats["connections"] = len(connections)
+        stats["idle"] = sum(1 for conn in connections if conn.is_idle())
+        stats["max_connections"] = self.max_connections
+        stats["utilization"] = stats["in_use"] / self.max_connections
+        stats["http2"] = self.http2
+        return stats
+
+    def close(self) -> None:
+        """关闭两个客户端；在事件循环中请使用 ``aclose()``"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError("在事件循环中请使用 await aclose() 关闭连接池")
+        self.client.close()
+        # 新的事件循环中没有连接；其他事件循环的连接由 _LoopTransports 交给各自的事件循环关闭
+        asyncio.run(self.async_client.aclose())
+
+    async def aclose(self) -> None:
+        """在事件循环中关闭两个客户端"""
+        self.client.close()
+        await self.async_client.aclose()
+
+
+# 各提供商的默认基础URL
+DEFAULT_BASE_URLS = {
+    "openai": "https://api.openai.com/v1",
+    "anthropic": "https://api.anthropic.com",
+}
+
+# 进程级连接池，按（提供商、API密钥摘要、基础URL）共享
+_CLIENTS: Dict[tuple, Any] = {}
+_clients_lock = threading.Lock()
+
+
+def _key_digest(api_key: Optional[str]) -> str:
+    # 注册表中只保存密钥的摘要
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+
+def get_http_client(provider: str, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                    max_connections: int = 20, max_keepalive: int = 10,
+                    keepalive_expiry: float = 30.0, timeout: Optional[float] = None,
+                    http2: bool = True):
+    """获取共享的HTTP连接池，相同的提供商、API密钥和基础URL返回同一个实例
+
+    连接池参数只在首次创建时生效。安装了httpx时返回 ``HTTPXPool``，否则返回 ``KeepAlivePool``。
+    """
+    provider = provider.lower()
+    base_url = (base_url or DEFAULT_BASE_URLS.get(provider, "")).rstrip("/")
+    if not base_url:
+        raise ValueError(f"提供商 {provider} 需要指定base_url")
+    key = (provider, _key_digest(api_key), base_url)
+    with _clients_lock:
+        client = _CLIENTS.get(key)
+        if client is None:
+            options = dict(max_connections=max_connections, max_keepalive=max_keepalive,
+                           keepalive_expiry=keepalive_expiry, timeout=timeout)
+            if httpx is not None:
+                client = HTTPXPool(base_url, http2=http2, **options)
+            else:
+                client = KeepAlivePool(base_url, **options)
+            _CLIENTS[key] = client
+        return client
+
+
+def sdk_http_clients(provider: str, api_key: Optional[str] = None,
+                     base_url: Optional[str] = None, **options) -> Dict[str, Any]:
+    """返回传给模型SDK的共享客户端参数（``http_client``、``http_async_client``）
+
+    没有安装httpx时返回空字典，SDK使用自己的客户端。
+    """
+    if httpx is None:
+        return {}
+    pool = get_http_client(provider, api_key, base_url, **options)
+    return {"http_client": pool.client, "http_async_client": pool.async_client}
+
+
+def get_http_client_stats() -> Dict[str, Dict[str, Any]]:
+    """获取所有连接池的统计信息，按 ``提供商 基础URL`` 索引（同一地址的多个密钥加序号区分）"""
+    with _clients_lock:
+        items = list(_CLIENTS.items())
+    stats: Dict[str, Dict[str, Any]] = {}
+    for (provider, _, base_url), client in items:
+        name = f"{provider} {base_url}"
+        if name in stats:
+            name = f"{name}#{len(stats)}"
+        stats[name] = client.stats()
+    return stats
+
+
+def _take_clients() -> List[Any]:
+    with _clients_lock:
+        clients = list(_CLIENTS.values())
+        _CLIENTS.clear()
+    return clients
+
+
+def close_http_clients() -> None:
+    """关闭并移除所有连接池（不能在事件循环中调用，请使用 ``aclose_http_clients``）"""
+    for client in _take_clients():
+        client.close()
+
+
+async def aclose_http_clients() -> None:
+    """在事件循环中关闭并移除所有连接池"""
+    for client in _take_clients():
+        await client.aclose()
@@ -0,0 +1,90 @@
+"""请求合并模块
+
+在同一个事件循环内合并相同的并发调用（single-flight）：第一个调用启动实际执行，
+执行期间到达的相同调用直接等待同一个结果。执行结束后条目立即移除，
+因此这里只合并并发的调用，不缓存结果。
+
+* 结果和异常会分发给所有等待者；
+* 单个等待者被取消（例如客户端断开连接）只会让它自己退出，
+  所有等待者都退出后才取消实际执行；
+* 发起执行时可以附带 ``context``，后到的等待者通过 ``on_join`` 拿到它，
+  把自己的要求（例如准入优先级）传给共享的执行。
+"""
+
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from . import metrics
+from .graph_cache import config_fingerprint
+
+
+def query_key(query: str, config, timeout: Optional[float] = None) -> str:
+    """无状态查询的合并键：合并空白后的查询、配置指纹和超时"""
+    payload = {
+        "query": " ".join(query.split()),
+        "config": config_fingerprint(config),
+        "timeout": timeout,
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("task", "waiters", "context")
+
+    def __init__(self, task: "asyncio.Future", context: Any = None):
+        self.task = task
+        self.waiters = 0
+        self.context = context
+
+
+class SingleFlight:
+    """异步的single-flight调用合并器（只能在一个事件循环中使用）
+
+    Args:
+        name: 指标中的名称（``agent_coalesced_calls_total{name}``）
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._saved = metrics.COALESCED_CALLS.labels(name)
+        self.saved = 0
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def _forget(self, key: Hashable, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]],
+                 context: Any = None, on_join: Optional[Callable[[Any], None]] = None) -> Any:
+        """执行 ``factory()``；相同键已有执行在进行时等待它的结果
+
+        Args:
+            key: 合并键
+            factory: 启动实际执行的协程函数
+            context: 由本次调用发起执行时，与执行一起保存的对象
+            on_join: 合并到进行中的执行时调用，参数是发起者的 ``context``
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = _Call(asyncio.ensure_future(factory()), context)
+            call.task.add_done_callback(lambda task: self._forget(key, call))
+        else:
+            self.saved += 1
+            self._saved.inc()
+            if on_join is not None:
+                on_join(call.context)
+        call.waiters += 1
+        try:
+            # shield：取消单个等待者不会取消共享的执行
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                self._forget(key, call)
+                call.task.cancel()
@@ -17,7 +17,7 @@ class Configuration(BaseModel):
     # 模型配置
     model_provider: str = Field(
         default="openai",
-        description="LLM提供商 (openai, anthropic)"
+        description="LLM提供商 (openai, anthropic, fake)"
     )
     model_name: str = Field(
         default="gpt-4o-mini",
@@ -34,6 +34,91 @@ class Configuration(BaseModel):
         gt=0,
         description="最大输出token数"
     )
+    fake_llm_options: Optional[dict] = Field(
+        default=None,
+        description="fake提供商的选项（脚本回答、种子、延迟分布、流式速率、错误率等）"
+    )
+    llm_timeout: Optional[float] = Field(
+        default=None,
+        description="单次模型调用的超时时间（秒），为None时只受运行时间限制约束"
+    )
+    fallback_models: Optional[List[dict]] = Field(
+        default=None,
+        description="备用模型列表，每项是覆盖主模型配置的字段（如model_provider、model_name），"
+                    "按顺序用于对冲请求和出错降级"
+    )
+    enable_hedging: bool = Field(
+        default=True,
+        description="主模型响应慢时是否向备用模型发送对冲请求，为False时只在出错时降级"
+    )
+    hedge_delay: Optional[float] = Field(
+        default=None,
+        description="固定的对冲延迟（秒），为None时取主模型近期延迟的hedge_percentile百分位数"
+    )
+    hedge_percentile: float = Field(
+        default=95.0,
+        gt=0,
+        le=100,
+        description="计算对冲延迟时使用的主模型延迟百分位数"
+    )
+    llm_rpm: Optional[int] = Field(
+        default=None,
+        description="每分钟最多发起的模型请求数（按提供商和模型限流），为None时不限制"
+    )
+    llm_tpm: Optional[int] = Field(
+        default=None,
+        description="每分钟最多使用的token数（调用前按消息长度和max_tokens估算），为None时不限制"
+    )
+    rate_limit_path: Optional[str] = Field(
+        default=None,
+        description="限流状态的SQLite文件路径，多个工作进程使用同一个文件时共享配额，"
+                    "为None时只在进程内限流"
+    )
+    llm_base_url: Optional[str] = Field(
+        default=None,
+        description="模型API的基础URL（如代理或兼容OpenAI的服务），为None时使用提供商的默认地址"
+    )
+    llm_max_connections: int = Field(
+        default=20,
+        gt=0,
+        description="每个（提供商、API密钥、基础URL）共享的HTTP连接池的最大连接数"
+    )
+    llm_max_keepalive_connections: int = Field(
+        default=10,
+        ge=0,
+        description="连接池中最多保留的空闲keep-alive连接数"
+    )
+    llm_keepalive_expiry: float = Field(
+        default=30.0,
+        gt=0,
+        description="空闲连接的保留时间（秒）"
+    )
+    llm_http2: bool = Field(
+        default=True,
+        description="安装了h2时是否对模型API使用HTTP/2"
+    )
+    enable_llm_cache: bool = Field(
+        default=False,
+        description="是否缓存模型回答（按模型参数、工具定义和归一化的消息列表匹配）"
+    )
+    llm_cache_path: Optional[str] = Field(
+        default=None,
+        description="模型回答缓存的SQLite文件路径，为None时只使用进程内存缓存"
+    )
+    llm_cache_ttl: float = Field(
+        default=3600.0,
+        gt=0,
+        description="模型回答缓存的有效期（秒）"
+    )
+    llm_cache_maxsize: int = Field(
+        default=1024,
+        gt=0,
+        description="内存中最多缓存的模型回答数"
+    )
+    llm_cache_nonzero_temperature: bool = Field(
+        default=False,
+        description="温度大于0时是否也使用模型回答缓存"
+    )
     
     # 系统配置
     system_prompt: str = Field(
@@ -54,12 +139,45 @@ class Configuration(BaseModel):
         default=True,
         description="是否启用计算器工具"
     )
+    tool_timeout: float = Field(
+        default=30.0,
+        gt=0,
+        description="单次工具调用的超时时间（秒）"
+    )
+    max_tool_concurrency: int = Field(
+        default=16,
+        gt=0,
+        description="工具节点同时执行的最大工具调用数"
+    )
     
     # 执行配置
     max_iterations: int = Field(
         default=10,
         gt=0,
-        description="最大迭代次数"
+        description="最大迭代次数（单次运行中模型调用的最大次数），超出时返回部分结果"
+    )
+    run_timeout: Optional[float] = Field(
+        default=None,
+        description="单次运行的最长时间（秒），模型和工具调用只能使用剩余的时间，"
+                    "超出时停止并返回部分结果，为None时不限制"
+    )
+    max_context_tokens: Optional[int] = Field(
+        default=None,
+        description="发送给模型的上下文token上限（含系统提示和max_tokens），超出时只发送最近的消息，"
+                    "为None时发送完整对话"
+    )
+    context_keep_first_message: bool = Field(
+        default=False,
+        description="截断上下文时是否固定保留对话的第一条消息"
+    )
+    batch_concurrency: int = Field(
+        default=8,
+        gt=0,
+        description="批量运行时同时执行的最大查询数"
+    )
+    enable_request_coalescing: bool = Field(
+        default=True,
+        description="是否让相同的并发无状态查询（不使用对话记忆）共享同一次代理运行"
     )
     enable_human_in_loop: bool = Field(
         default=False,
@@ -75,6 +193,29 @@ class Configuration(BaseModel):
         default="chat_history",
         description="内存存储的键名"
     )
+    checkpoint_backend: str = Field(
+        default="memory",
+        description="对话检查点存储后端 (memory, sqlite)"
+    )
+    checkpoint_path: str = Field(
+        default="checkpoints.sqlite",
+        description="SQLite检查点数据库路径（仅sqlite后端使用）"
+    )
+    memory_max_threads: Optional[int] = Field(
+        default=1024,
+        gt=0,
+        description="内存检查点最多保留的对话线程数，超出时淘汰最久未使用的线程（仅memory后端使用）"
+    )
+    memory_ttl: Optional[float] = Field(
+        default=None,
+        description="内存检查点中空闲线程的保留时间（秒），为None时只受线程数限制（仅memory后端使用）"
+    )
+    
+    # 可观测性配置
+    trace_export_path: Optional[str] = Field(
+        default=None,
+        description="以OTLP/JSON格式追加写入运行和节点追踪span的文件路径，为None时不导出"
+    )
     
     class Config:
         """Pydantic配置"""
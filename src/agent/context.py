@@ -0,0 +1,192 @@
+"""上下文窗口管理模块
+
+把发送给模型的消息控制在token预算内，长对话不会越来越慢、越来越贵，直至超出上下文窗口：
+
+* 每条消息的token数只估算一次：状态中的 ``token_totals`` 保存消息token数的前缀和，
+  随检查点持久化，每轮只需计算新增的消息；
+* 超出预算时保留最近的消息，截断位置通过对前缀和二分查找确定，
+  因此每轮的计算量与新增消息数成正比，而不是与对话长度成正比；
+* 固定保留：系统提示（通过预算扣除）、最近一条用户消息、最近一轮工具调用及其结果，
+  以及可选的第一条消息；截断后不会以缺少对应工具调用的工具结果开头。
+"""
+
+import bisect
+import json
+import math
+from typing import Any, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+
+# 每条消息的格式开销（角色、分隔符等）
+MESSAGE_OVERHEAD = 4
+
+
+def text_tokens(text: str) -> int:
+    """估算文本的token数：非ASCII字符（如汉字）大致每字一个token，ASCII文本大致每4个字符一个"""
+    wide = sum(1 for ch in text if ord(ch) > 0x7F)
+    return wide + math.ceil((len(text) - wide) / 4)
+
+
+def message_tokens(message: Any) -> int:
+    """估算一条消息的token数（内容、工具调用的名称和参数，加上格式开销）"""
+    if isinstance(message, BaseMessage):
+        content = message.content
+        text = content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+        for call in message.tool_calls or ():
+            text += call.get("name") or ""
+            text += json.dumps(call.get("args", {}), ensure_ascii=False)
+    else:
+        text = str(message)
+    return text_tokens(text) + MESSAGE_OVERHEAD
+
+
+def extend_totals(messages: Sequence[Any], totals: Sequence[int]) -> List[int]:
+    """返回 ``messages`` 中尚未计数的消息对应的新前缀和（只计算新增的消息）"""
+    running = totals[-1] if totals else 0
+    new = []
+    for message in messages[len(totals):]:
+        running += message_tokens(message)
+        new.append(running)
+    return new
+
+
+class PrefixSums(Sequence[int]):
+    """已保存的前缀和后接新增前缀和的只读视图，长度截到 ``length``
+
+    每轮只为新增的消息计数，不必为拼接复制整段前缀和。
+    """
+
+    __slots__ = ("_saved", "_new", "_split", "_length")
+
+    def __init__(self, saved: Sequence[int], new: Sequence[int], length: int):
+        self._saved = saved
+        self._new = new
+        self._split = min(len(saved), length)
+        self._length = min(self._split + len(new), length)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(index)
+        if index < self._split:
+            return self._saved[index]
+        return self._new[index - self._split]
+
+
+def _span(totals: Sequence[int], start: int, end: int) -> int:
+    # messages[start:end] 的token数
+    if end <= start:
+        return 0
+    return totals[end - 1] - (totals[start - 1] if start > 0 else 0)
+
+
+def _pinned_start(messages: Sequence[Any]) -> Tuple[int, Optional[int]]:
+    """返回（最近一轮工具调用的起点，最近一条用户消息的位置）
+
+    从末尾向前只扫描到最近的用户消息或工具调用为止。
+    """
+    start = len(messages)
+    for index in range(len(messages) - 1, -1, -1):
+        message = messages[index]
+        if isinstance(message, ToolMessage):
+            continue
+        if isinstance(message, AIMessage) and message.tool_calls:
+            start = index
+            break
+        if isinstance(message, HumanMessage):
+            return min(start, index), index
+        start = index
+        break
+    for index in range(start - 1, -1, -1):
+        if isinstance(messages[index], HumanMessage):
+            return start, index
+    return start, None
+
+
+class ContextWindow:
+    """上下文窗口的token预算策略
+
+    Args:
+        max_tokens: 发送给模型的全部内容的token上限（模型的上下文窗口）
+        reserved: 预先扣除的token数（系统提示、输出预留等）
+        keep_first: 是否固定保留第一条消息（通常是最初的任务描述）
+    """
+
+    def __init__(self, max_tokens: int, reserved: int = 0, keep_first: bool = False):
+        if max_tokens <= 0:
+            raise ValueError("max_tokens必须大于0")
+        self.max_tokens = max_tokens
+        self.reserved = reserved
+        self.keep_first = keep_first
+
+    @classmethod
+    def from_config(cls, config) -> Optional["ContextWindow"]:
+        """按配置创建，未设置 ``max_context_tokens`` 时返回None"""
+        if not config.max_context_tokens:
+            return None
+        reserved = text_tokens(config.system_prompt) + MESSAGE_OVERHEAD + (config.max_tokens or 0)
+        return cls(config.max_context_tokens, reserved, config.context_keep_first_message)
+
+    @property
+    def budget(self) -> int:
+        """留给对话消息的token数"""
+        return max(0, self.max_tokens - self.reserved)
+
+    def cut(self, messages: Sequence[Any], totals: Sequence[int]) -> Tuple[int, List[int]]:
+        """计算截断位置
+
+        Returns:
+            （保留的最近消息的起点，起点之前另外固定保留的消息位置）
+        """
+        count = len(messages)
+        if not count or totals[count - 1] <= self.budget:
+            return 0, []
+        pinned_start, human = _pinned_start(messages)
+        extras = []
+        if self.keep_first:
+            extras.append(0)
+        # 最近的用户消息在固定区间内时已包含在保留的消息中
+        if human is not None and human < pinned_start and human not in extras:
+            extras.append(human)
+        available = self.budget - sum(_span(totals, i, i + 1) for i in extras)
+        # 最小的start，使 messages[start:] 的token数不超过 available
+        target = totals[count - 1] - available
+        start = 0 if target <= 0 else bisect.bisect_left(totals, target, 0, count) + 1
+        start = min(start, pinned_start)
+        # 不以工具结果开头：它对应的工具调用已被截掉
+        while start < pinned_start and isinstance(messages[start], ToolMessage):
+            start += 1
+        return start, [i for i in extras if i < start]
+
+    def trim(self, messages: Sequence[Any], totals: Sequence[int]) -> List[Any]:
+        """返回预算内要发送给模型的消息（保持原有顺序）
+
+        Args:
+            messages: 完整的消息列表
+            totals: 与 ``messages`` 等长的token前缀和
+        """
+        start, extras = self.cut(messages, totals)
+        if not start:
+            return list(messages)
+        return [messages[i] for i in sorted(extras)] + list(messages[start:])
+
+    def compact(self, messages: Sequence[Any], totals: Sequence[int]) -> Tuple[List[Any], List[int]]:
+        """把保存的历史缩减为预算内的消息，返回（消息，对应的前缀和）
+
+        被丢弃的消息以后也不会再发送给模型；新的前缀和由原有的计数推出，不重新估算。
+        """
+        start, extras = self.cut(messages, totals)
+        if not start:
+            return list(messages), list(totals)
+        kept = sorted(extras) + list(range(start, len(messages)))
+        new_totals, running = [], 0
+        for i in kept:
+            running += _span(totals, i, i + 1)
+            new_totals.append(running)
+        return [messages[i] for i in kept], new_totals
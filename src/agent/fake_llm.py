@@ -0,0 +1,273 @@
+"""离线假模型模块
+
+提供不访问网络的确定性聊天模型，用于在没有API密钥的机器上压测
+``/query``、工具调用循环和多代理协作。通过 ``model_provider="fake"`` 启用，
+``fake_llm_options`` 中的键对应 ``FakeChatModel`` 的构造参数。
+
+两种回答方式：
+
+* 脚本：``responses`` 列表中的第i项作为一次用户提问后的第i次模型回答
+  （超出时重复最后一项），每项是字符串或 ``{"content": ..., "tool_calls": [...]}``；
+  回答按对话位置而不是调用次数选取，因此并发请求之间互不干扰。
+* 种子：根据 ``seed`` 和用户提问确定性地生成回答，首轮以 ``tool_call_rate``
+  的概率调用一个已绑定的工具。
+"""
+
+import asyncio
+import hashlib
+import inspect
+import random
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+
+
+class FakeLLMError(RuntimeError):
+    """按 ``error_rate`` 注入的模拟调用失败"""
+
+
+# 生成回答时使用的词表
+_WORDS = (
+    "代理", "工具", "结果", "分析", "数据", "模型", "查询", "回答", "信息", "步骤",
+    "首先", "然后", "因此", "根据", "需要", "可以", "我们", "这个", "问题", "方法",
+)
+
+# 流式输出时的切分单位：单个汉字，或连同前导空白的一个词/标点
+_TOKEN_PATTERN = re.compile(r"\s*(?:[\u4e00-\u9fff]|[^\s\u4e00-\u9fff]+)")
+
+
+def make_sampler(spec: Union[None, float, Dict[str, Any]]) -> Callable[[random.Random], float]:
+    """把延迟配置转换为采样函数（单位：秒，结果不小于0）
+
+    Args:
+        spec: 常数秒数，或 ``{"distribution": ..., ...}``，支持
+            ``constant(value)``、``uniform(low, high)``、``normal(mean, stddev)``、
+            ``lognormal(median, sigma)``、``exponential(mean)``
+
+    Returns:
+        接收随机数生成器、返回采样值的函数
+    """
+    if spec is None:
+        return lambda rng: 0.0
+    if isinstance(spec, (int, float)):
+        value = float(spec)
+        return lambda rng: value
+    spec = dict(spec)
+    distribution = spec.pop("distribution", "constant")
+    if distribution == "constant":
+        value = float(spec.get("value", 0.0))
+        return lambda rng: value
+    if distribution == "uniform":
+        low, high = float(spec["low"]), float(spec["high"])
+        return lambda rng: rng.uniform(low, high)
+    if distribution == "normal":
+        mean, stddev = float(spec["mean"]), float(spec["stddev"])
+        return lambda rng: max(0.0, rng.gauss(mean, stddev))
+    if distribution == "lognormal":
+        median, sigma = float(spec["median"]), float(spec["sigma"])
+        return lambda rng: median * rng.lognormvariate(0.0, sigma)
+    if distribution == "exponential":
+        mean = float(spec["mean"])
+        return lambda rng: rng.expovariate(1.0 / mean) if mean > 0 else 0.0
+    raise ValueError(f"不支持的延迟分布: {distribution}")
+
+
+def split_tokens(text: str) -> List[str]:
+    """把回答切分为模拟的流式token"""
+    return _TOKEN_PATTERN.findall(text or "")
+
+
+def _tool_name(tool) -> str:
+    return getattr(tool, "name", None) or tool.__name__
+
+
+def _last_human(messages) -> str:
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            return message.content or ""
+    return ""
+
+
+def _turn(messages) -> int:
+    """最后一条用户消息之后模型已经回答的次数"""
+    turn = 0
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            break
+        if isinstance(message, AIMessage):
+            turn += 1
+    return turn
+
+
+class FakeChatModel:
+    """确定性的离线聊天模型，接口与 ``ChatOpenAI`` 一致
+
+    Args:
+        responses: 脚本回答列表，为None时使用种子生成回答
+        seed: 随机种子，决定生成的回答、工具调用以及延迟和错误的采样序列
+        latency: 首个token之前的延迟，常数秒数或分布配置（见 ``make_sampler``）
+        tokens_per_second: 流式输出速率，为None时不模拟逐token耗时
+        error_rate: 每次调用失败（抛出 ``FakeLLMError``）的概率
+        tool_call_rate: 种子模式下首轮回答调用工具的概率
+        tool_args: 工具名到调用参数的映射，未指定的工具根据参数签名生成
+        response_tokens: 种子模式下回答的词数范围 ``(最少, 最多)``
+    """
+
+    def __init__(
+        self,
+        responses: Optional[List[Union[str, Dict[str, Any]]]] = None,
+        seed: int = 0,
+        latency: Union[None, float, Dict[str, Any]] = None,
+        tokens_per_second: Optional[float] = None,
+        error_rate: float = 0.0,
+        tool_call_rate: float = 0.5,
+        tool_args: Optional[Dict[str, Dict[str, Any]]] = None,
+        response_tokens: tuple = (8, 32),
+        **kwargs,
+    ):
+        if not 0.0 <= error_rate <= 1.0:
+            raise ValueError("error_rate必须在0到1之间")
+        if tokens_per_second is not None and tokens_per_second <= 0:
+            raise ValueError("tokens_per_second必须大于0")
+        self.responses = list(responses) if responses is not None else None
+        self.seed = seed
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.tool_call_rate = tool_call_rate
+        self.tool_args = dict(tool_args or {})
+        self.response_tokens = tuple(response_tokens)
+        # 其余参数（model、temperature等）只做记录，与真实客户端保持相同的构造方式
+        self.kwargs = kwargs
+        self.tools: List[Any] = []
+        self._sample_latency = make_sampler(latency)
+        self._interval = 1.0 / tokens_per_second if tokens_per_second else 0.0
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self.calls = 0
+
+    def bind_tools(self, tools):
+        """返回绑定了工具的副本，与原模型共享随机状态和调用计数"""
+        bound = object.__new__(type(self))
+        bound.__dict__.update(self.__dict__)
+        bound.tools = list(tools)
+        bound._parent = self
+        return bound
+
+    # -- 生成回答 ---------------------------------------------------------
+
+    def _sample(self):
+        """采样本次调用的延迟和是否失败"""
+        root = getattr(self, "_parent", self)
+        with root._rng_lock:
+            root.calls += 1
+            latency = self._sample_latency(root._rng)
+            failed = root._rng.random() < self.error_rate
+        return latency, failed
+
+    def _respond(self, inputs) -> AIMessage:
+        messages = inputs.get("messages", []) if isinstance(inputs, dict) else inputs
+        turn = _turn(messages)
+        if self.responses is not None:
+            return self._scripted(self.responses[min(turn, len(self.responses) - 1)], turn)
+        return self._generated(_last_human(messages), turn)
+
+    def _scripted(self, item, turn) -> AIMessage:
+        if isinstance(item, str):
+            return AIMessage(content=item)
+        tool_calls = [
+            {
+                "name": call["name"],
+                "args": dict(call.get("args") or {}),
+                "id": call.get("id") or f"call_{turn}_{i}",
+            }
+            for i, call in enumerate(item.get("tool_calls") or [])
+        ]
+        return AIMessage(content=item.get("content", ""), tool_calls=tool_calls)
+
+    def _generated(self, query: str, turn: int) -> AIMessage:
+        digest = hashlib.sha256(f"{self.seed}:{turn}:{query}".encode("utf-8")).digest()
+        rng = random.Random(digest)
+        if turn == 0 and self.tools and rng.random() < self.tool_call_rate:
+            tool = rng.choice(self.tools)
+            name = _tool_name(tool)
+            return AIMessage(content="", tool_calls=[{
+                "name": name,
+                "args": self._args_for(tool, name, query, rng),
+                "id": f"call_{digest[:6].hex()}",
+            }])
+        low, high = self.response_tokens
+        words = [rng.choice(_WORDS) for _ in range(rng.randint(low, high))]
+        return AIMessage(content=f"关于「{query}」：" + "".join(words) + "。")
+
+    def _args_for(self, tool, name: str, query: str, rng: random.Random) -> Dict[str, Any]:
+        if name in self.tool_args:
+            return dict(self.tool_args[name])
+        args = {}
+        for param in inspect.signature(tool).parameters.values():
+            if param.default is not inspect.Parameter.empty:
+                continue
+            annotation = param.annotation
+            if annotation is int:
+                args[param.name] = rng.randint(1, 100)
+            elif annotation is float:
+                args[param.name] = round(rng.uniform(1, 100), 2)
+            elif getattr(annotation, "__origin__", None) in (list, List):
+                args[param.name] = [query]
+            else:
+                args[param.name] = query
+        return args
+
+    def _chunks(self, message: AIMessage) -> List[AIMessageChunk]:
+        if message.tool_calls:
+            return [AIMessageChunk(content=message.content, tool_calls=message.tool_calls)]
+        return [AIMessageChunk(content=token) for token in split_tokens(message.content)]
+
+    # -- 调用接口 ---------------------------------------------------------
+
+    def _duration(self, message: AIMessage, latency: float) -> float:
+        # 非流式调用的耗时与流式输出完全部token的耗时相同
+        return latency + self._interval * max(0, len(self._chunks(message)) - 1)
+
+    def invoke(self, inputs) -> AIMessage:
+        message = self._respond(inputs)
+        latency, failed = self._sample()
+        if failed:
+            time.sleep(latency)
+            raise FakeLLMError("模拟的模型调用失败")
+        time.sleep(self._duration(message, latency))
+        return message
+
+    async def ainvoke(self, inputs) -> AIMessage:
+        message = self._respond(inputs)
+        latency, failed = self._sample()
+        if failed:
+            await asyncio.sleep(latency)
+            raise FakeLLMError("模拟的模型调用失败")
+        await asyncio.sleep(self._duration(message, latency))
+        return message
+
+    def stream(self, inputs):
+        message = self._respond(inputs)
+        latency, failed = self._sample()
+        time.sleep(latency)
+        if failed:
+            raise FakeLLMError("模拟的模型调用失败")
+        for i, chunk in enumerate(self._chunks(message)):
+            if i and self._interval:
+                time.sleep(self._interval)
+            yield chunk
+
+    async def astream(self, inputs):
+        message = self._respond(inputs)
+        latency, failed = self._sample()
+        await asyncio.sleep(latency)
+        if failed:
+            raise FakeLLMError("模拟的模型调用失败")
+        for i, chunk in enumerate(self._chunks(message)):
+            if i and self._interval:
+                await asyncio.sleep(self._interval)
+            yield chunk
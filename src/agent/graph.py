@@ -3,22 +3,55 @@
 这个模块定义了代理的核心逻辑和工作流程。
 """
 
+import asyncio
 import os
-from typing import Dict, Any, List, Optional, Annotated
+import threading
+import time
+from typing import Dict, Any, AsyncContextManager, AsyncIterator, Callable, Iterator, List, Optional, Annotated
 from typing_extensions import TypedDict
 
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage
+from langchain_core.messages import (
+    BaseMessage, HumanMessage, AIMessage, AIMessageChunk, ToolMessage
+)
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_openai import ChatOpenAI
 from langchain_anthropic import ChatAnthropic
 
 from langgraph.graph import StateGraph, START, END
-from langgraph.graph.message import add_messages
+from langgraph.graph.message import extend_in_place
 from langgraph.prebuilt import ToolNode
 from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.config import get_message_writer, get_time_budget
+from langgraph.errors import GraphRunLimitError, GraphTimeoutError
+from langgraph.tracing import FileSpanExporter, NodeLatencyCollector, SpanTracer
 
+from .clients import sdk_http_clients
 from .config import Configuration
+from .context import ContextWindow, PrefixSums, extend_totals
+from .fake_llm import FakeChatModel
+from .hedging import HedgedChatModel
+from .llm_cache import CachedChatModel, get_llm_cache
+from .rate_limit import RateLimitedChatModel, get_rate_limiter
 from .tools import get_enabled_tools
+from .graph_cache import GraphCache
+from . import metrics
+
+
+# 进程级已编译图形缓存，相同配置的请求复用同一个图形和LLM客户端
+_graph_cache = GraphCache(max_size=int(os.getenv("AGENT_GRAPH_CACHE_SIZE", "32")))
+
+# 进程级检查点存储，按(后端, 路径)共享，使不同图形看到同一份线程记忆
+_checkpointers: Dict[tuple, Any] = {}
+_checkpointers_lock = threading.Lock()
+
+# 进程级节点耗时统计和运行指标，挂载到所有代理图形上
+_node_latency = NodeLatencyCollector()
+_metrics_callback = metrics.MetricsCallback()
+
+# 追踪文件导出器，按路径共享
+_span_exporters: Dict[str, FileSpanExporter] = {}
+_span_exporters_lock = threading.Lock()
 
 
 class AgentState(TypedDict):
@@ -26,7 +59,10 @@ class AgentState(TypedDict):
     
     定义了在图形节点之间传递的状态结构。
     """
-    messages: Annotated[List[BaseMessage], add_messages]
+    # 列表原地追加，每步的开销与新增的条目数成正比，而不是与对话长度成正比
+    messages: Annotated[List[BaseMessage], extend_in_place]
+    # messages的token数前缀和（只在设置了max_context_tokens时维护），每条消息只计数一次
+    token_totals: Annotated[List[int], extend_in_place]
     iteration_count: int
     user_input: str
     final_answer: Optional[str]
@@ -35,30 +71,174 @@ class AgentState(TypedDict):
 def create_llm(config: Configuration):
     """根据配置创建LLM实例
     
+    配置了 ``llm_rpm`` 或 ``llm_tpm`` 时每个模型包装为 ``RateLimitedChatModel``；
+    配置了 ``fallback_models`` 时返回 ``HedgedChatModel``，主模型响应慢或出错时
+    使用备用模型；启用 ``enable_llm_cache`` 时外层再包装 ``CachedChatModel``，
+    命中缓存的提问不占用限流配额。
+    
     Args:
         config: 配置对象
         
     Returns:
         配置好的LLM实例
     """
+    llm = _create_rate_limited_llm(config)
+    if config.fallback_models:
+        models = [(_llm_label(config), llm)]
+        for overrides in config.fallback_models:
+            fallback = Configuration(**{**vars(config), **overrides, "fallback_models": None})
+            models.append((_llm_label(fallback), _create_rate_limited_llm(fallback)))
+        llm = HedgedChatModel(
+            models,
+            hedge=config.enable_hedging,
+            delay=config.hedge_delay,
+            percentile=config.hedge_percentile,
+        )
+    if _use_llm_cache(config):
+        cache = get_llm_cache(config.llm_cache_path, config.llm_cache_maxsize, config.llm_cache_ttl)
+        llm = CachedChatModel(llm, cache, {
+            "provider": config.model_provider.lower(),
+            "model": config.model_name,
+            "temperature": config.temperature,
+            "max_tokens": config.max_tokens,
+            "system_prompt": config.system_prompt,
+        })
+    return llm
+
+
+def _use_llm_cache(config: Configuration) -> bool:
+    # 温度大于0时同一提问本应得到不同回答，除非显式允许，否则不缓存
+    return config.enable_llm_cache and (
+        config.temperature == 0 or config.llm_cache_nonzero_temperature
+    )
+
+
+def _llm_label(config: Configuration) -> str:
+    return f"{config.model_provider.lower()}:{config.model_name}"
+
+
+def _create_rate_limited_llm(config: Configuration):
+    llm = _create_single_llm(config)
+    if config.llm_rpm is None and config.llm_tpm is None:
+        return llm
+    limiter = get_rate_limiter(
+        _llm_label(config), config.llm_rpm, config.llm_tpm, config.rate_limit_path
+    )
+    return RateLimitedChatModel(llm, limiter, config.max_tokens)
+
+
+def _create_single_llm(config: Configuration):
     if config.model_provider.lower() == "openai":
+        api_key = os.getenv("OPENAI_API_KEY")
+        # 同一API密钥和基础URL的所有模型实例共享一个连接池
+        http_clients = sdk_http_clients(
+            "openai", api_key, config.llm_base_url,
+            max_connections=config.llm_max_connections,
+            max_keepalive=config.llm_max_keepalive_connections,
+            keepalive_expiry=config.llm_keepalive_expiry,
+            http2=config.llm_http2,
+        )
         return ChatOpenAI(
             model=config.model_name,
             temperature=config.temperature,
             max_tokens=config.max_tokens,
-            api_key=os.getenv("OPENAI_API_KEY")
+            api_key=api_key,
+            timeout=config.llm_timeout,
+            base_url=config.llm_base_url,
+            **http_clients
         )
     elif config.model_provider.lower() == "anthropic":
+        # ChatAnthropic不接受外部传入的httpx客户端，不使用这里的共享连接池；
+        # Anthropic SDK按基础URL在进程内共享自己的httpx客户端
+        extra = {"base_url": config.llm_base_url} if config.llm_base_url else {}
         return ChatAnthropic(
             model=config.model_name,
             temperature=config.temperature,
             max_tokens=config.max_tokens,
-            api_key=os.getenv("ANTHROPIC_API_KEY")
+            api_key=os.getenv("ANTHROPIC_API_KEY"),
+            timeout=config.llm_timeout,
+            **extra
+        )
+    elif config.model_provider.lower() == "fake":
+        # 离线假模型，用于无网络环境下的压测
+        return FakeChatModel(
+            model=config.model_name,
+            temperature=config.temperature,
+            max_tokens=config.max_tokens,
+            **(config.fake_llm_options or {})
         )
     else:
         raise ValueError(f"不支持的模型提供商: {config.model_provider}")
 
 
+def get_checkpointer(config: Configuration):
+    """根据配置获取共享的检查点存储
+    
+    Args:
+        config: 配置对象
+        
+    Returns:
+        检查点存储实例，同一后端和路径返回同一个实例
+    """
+    backend = config.checkpoint_backend.lower()
+    if backend == "memory":
+        key = (backend, (config.memory_max_threads, config.memory_ttl))
+    elif backend == "sqlite":
+        key = (backend, os.path.abspath(config.checkpoint_path))
+    else:
+        raise ValueError(f"不支持的检查点后端: {config.checkpoint_backend}")
+    
+    with _checkpointers_lock:
+        checkpointer = _checkpointers.get(key)
+        if checkpointer is None:
+            if backend == "memory":
+                checkpointer = MemorySaver(config.memory_max_threads, config.memory_ttl)
+            else:
+                checkpointer = SqliteSaver(key[1])
+            # 记录读写耗时
+            checkpointer = metrics.InstrumentedCheckpointer(checkpointer, backend)
+            _checkpointers[key] = checkpointer
+        return checkpointer
+
+
+def get_graph_callbacks(config: Configuration) -> List[Any]:
+    """返回代理图形使用的回调：节点耗时统计，以及按配置启用的追踪导出"""
+    callbacks: List[Any] = [_node_latency, _metrics_callback]
+    if config.trace_export_path:
+        path = os.path.abspath(config.trace_export_path)
+        with _span_exporters_lock:
+            exporter = _span_exporters.get(path)
+            if exporter is None:
+                exporter = _span_exporters[path] = FileSpanExporter(path)
+        callbacks.append(SpanTracer(exporter, service_name="langgraph-agent", graph_name="agent"))
+    return callbacks
+
+
+def flush_trace_exports() -> None:
+    """等待已结束的运行的追踪数据写入文件（导出在后台线程中进行）"""
+    with _span_exporters_lock:
+        exporters = list(_span_exporters.values())
+    for exporter in exporters:
+        exporter.flush()
+
+
+def get_node_latency_stats() -> Dict[str, Dict[str, Any]]:
+    """获取各节点的耗时统计（次数、总耗时、百分位数、错误数和直方图分桶）"""
+    return _node_latency.stats()
+
+
+def _merge_chunks(chunks: List[Any]):
+    """把流式输出的消息片段合并为完整的AI消息"""
+    if not chunks:
+        return AIMessage(content="")
+    merged = chunks[0]
+    for chunk in chunks[1:]:
+        merged = merged + chunk
+    if isinstance(merged, AIMessageChunk):
+        return merged.to_message()
+    return merged
+
+
 def create_agent_node(config: Configuration):
     """创建代理节点
     
@@ -86,27 +266,136 @@ def create_agent_node(config: Configuration):
     # 创建链
     chain = prompt | llm_with_tools
     
+    # LLM调用指标（预先取出子指标，避免每次调用查找标签）
+    llm_labels = (config.model_provider.lower(), config.model_name)
+    llm_latency = metrics.LLM_LATENCY.labels(*llm_labels)
+    llm_success = metrics.LLM_CALLS.labels(*llm_labels, "success")
+    llm_failure = metrics.LLM_CALLS.labels(*llm_labels, "error")
+    llm_timeout = metrics.LLM_CALLS.labels(*llm_labels, "timeout")
+    
+    def _on_response(state: AgentState, response, started: float) -> Dict[str, Any]:
+        llm_latency.observe(time.perf_counter() - started)
+        llm_success.inc()
+        
+        # 更新迭代计数
+        iteration_count = state.get("iteration_count", 0) + 1
+        
+        return {
+            "messages": [response],
+            "iteration_count": iteration_count
+        }
+    
+    def _on_error(state: AgentState, e: Exception, started: float) -> Dict[str, Any]:
+        llm_latency.observe(time.perf_counter() - started)
+        llm_failure.inc()
+        error_message = AIMessage(content=f"抱歉，处理您的请求时出现错误：{str(e)}")
+        return {
+            "messages": [error_message],
+            "iteration_count": state.get("iteration_count", 0) + 1
+        }
+    
+    def _on_timeout(state: AgentState, started: float) -> Dict[str, Any]:
+        llm_latency.observe(time.perf_counter() - started)
+        llm_timeout.inc()
+        if get_time_budget() == 0:
+            # 整次运行的时间已用尽，交给图形引擎停止运行并返回部分结果
+            raise TimeoutError("模型调用超出运行时间限制")
+        error_message = AIMessage(content=f"抱歉，模型调用超时（{config.llm_timeout}秒）")
+        return {
+            "messages": [error_message],
+            "iteration_count": state.get("iteration_count", 0) + 1
+        }
+    
+    # 上下文窗口：超出token预算时只发送最近的消息
+    window = ContextWindow.from_config(config)
+    
+    def _context(state: AgentState):
+        """返回模型输入和新增消息的token前缀和（未启用上下文窗口时为None）"""
+        messages = state["messages"]
+        if window is None:
+            return {"messages": messages}, None
+        saved = state.get("token_totals") or ()
+        new_totals = extend_totals(messages, saved)
+        trimmed = window.trim(messages, PrefixSums(saved, new_totals, len(messages)))
+        if len(trimmed) < len(messages):
+            metrics.CONTEXT_TRIMMED.inc(len(messages) - len(trimmed))
+        return {"messages": trimmed}, new_totals
+    
+    def _with_totals(update: Dict[str, Any], new_totals) -> Dict[str, Any]:
+        if new_totals:
+            update["token_totals"] = new_totals
+        return update
+    
     def agent_node(state: AgentState) -> Dict[str, Any]:
-        """代理节点执行函数"""
+        """代理节点执行函数
+        
+        同步调用无法中途取消：非流式调用的超时由LLM客户端的 ``timeout`` 负责，
+        流式调用在每个片段之间检查剩余时间。
+        """
+        inputs, new_totals = _context(state)
+        return _with_totals(_call_sync(state, inputs), new_totals)
+    
+    def _call_sync(state: AgentState, inputs) -> Dict[str, Any]:
+        started = time.perf_counter()
         try:
-            # 调用LLM
-            response = chain.invoke({
-                "messages": state["messages"]
-            })
-            
-            # 更新迭代计数
-            iteration_count = state.get("iteration_count", 0) + 1
-            
-            return {
-                "messages": [response],
-                "iteration_count": iteration_count
-            }
+            writer = get_message_writer()
+            if writer is None:
+                # 调用LLM
+                response = chain.invoke(inputs)
+            else:
+                # 流式执行时逐个转发LLM输出的片段
+                budget = get_time_budget(config.llm_timeout)
+                deadline = time.monotonic() + budget if budget is not None else None
+                chunks = []
+                stream = chain.stream(inputs)
+                try:
+                    for chunk in stream:
+                        if deadline is not None and time.monotonic() >= deadline:
+                            raise asyncio.TimeoutError()
+                        writer(chunk)
+                        chunks.append(chunk)
+                finally:
+                    if hasattr(stream, "close"):
+                        stream.close()
+                response = _merge_chunks(chunks)
+            return _on_response(state, response, started)
+        except asyncio.TimeoutError:
+            return _on_timeout(state, started)
         except Exception as e:
-            error_message = AIMessage(content=f"抱歉，处理您的请求时出现错误：{str(e)}")
-            return {
-                "messages": [error_message],
-                "iteration_count": state.get("iteration_count", 0) + 1
-            }
+            return _on_error(state, e, started)
+    
+    async def _astream_response(inputs, writer):
+        chunks = []
+        async for chunk in chain.astream(inputs):
+            writer(chunk)
+            chunks.append(chunk)
+        return _merge_chunks(chunks)
+    
+    async def aagent_node(state: AgentState) -> Dict[str, Any]:
+        """代理节点的异步执行函数，LLM调用不会阻塞事件循环
+        
+        每次调用最多使用 ``llm_timeout`` 与运行剩余时间中较短的一个，到期时取消调用。
+        """
+        inputs, new_totals = _context(state)
+        return _with_totals(await _call_async(state, inputs), new_totals)
+    
+    async def _call_async(state: AgentState, inputs) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            writer = get_message_writer()
+            if writer is None:
+                call = chain.ainvoke(inputs)
+            else:
+                call = _astream_response(inputs, writer)
+            response = await asyncio.wait_for(call, get_time_budget(config.llm_timeout))
+            return _on_response(state, response, started)
+        except asyncio.TimeoutError:
+            return _on_timeout(state, started)
+        except Exception as e:
+            return _on_error(state, e, started)
+    
+    # 异步图形执行时使用的版本
+    agent_node.afunc = aagent_node
     
     return agent_node
 
@@ -155,7 +444,11 @@ def create_agent_graph(config: Configuration = None) -> StateGraph:
     
     if tools:
         # 如果有工具，添加工具节点
-        tool_node = ToolNode(tools)
+        tool_node = ToolNode(
+            tools,
+            timeout=config.tool_timeout,
+            max_concurrency=config.max_tool_concurrency
+        )
         workflow.add_node("tools", tool_node)
         
         # 添加边
@@ -177,64 +470,163 @@ def create_agent_graph(config: Configuration = None) -> StateGraph:
     # 添加内存检查点（如果启用）
     checkpointer = None
     if config.enable_memory:
-        checkpointer = MemorySaver()
+        checkpointer = get_checkpointer(config)
     
     # 编译图形
-    app = workflow.compile(checkpointer=checkpointer)
+    app = workflow.compile(checkpointer=checkpointer, callbacks=get_graph_callbacks(config))
     
     return app
 
 
-def run_agent(query: str, config: Configuration = None, thread_id: str = "default") -> str:
-    """运行代理并返回结果
-    
+def get_agent_graph(config: Configuration = None):
+    """获取（必要时创建）与配置对应的缓存图形
+
     Args:
-        query: 用户查询
-        config: 配置对象
-        thread_id: 线程ID，用于内存管理
-        
+        config: 配置对象，如果为None则使用默认配置
+
     Returns:
-        代理的回答
+        编译好的LangGraph图形，相同配置的调用返回同一个实例
     """
     if config is None:
         config = Configuration()
-    
-    # 创建图形
-    app = create_agent_graph(config)
-    
-    # 准备输入
-    initial_state = {
+    return _graph_cache.get_or_create(config, lambda: create_agent_graph(config))
+
+
+def invalidate_graph_cache(config: Configuration = None) -> int:
+    """使已编译图形缓存失效
+
+    Args:
+        config: 要失效的配置，为None时清空全部缓存
+
+    Returns:
+        被移除的条目数量
+    """
+    return _graph_cache.invalidate(config)
+
+
+def get_graph_cache_stats() -> Dict[str, Any]:
+    """获取已编译图形缓存的统计信息（命中、未命中、淘汰等）"""
+    return _graph_cache.stats()
+
+
+metrics.REGISTRY.register(metrics.GaugeCollector(
+    "agent_graph_cache", "已编译图形缓存统计（累计值）",
+    lambda: (({"stat": key}, value) for key, value in get_graph_cache_stats().items())
+))
+
+
+def _initial_state(query: str) -> Dict[str, Any]:
+    return {
         "messages": [HumanMessage(content=query)],
         "iteration_count": 0,
         "user_input": query,
         "final_answer": None
     }
+
+
+def _run_config(config: Configuration, thread_id: Optional[str],
+                timeout: Optional[float] = None) -> Dict[str, Any]:
+    # 代理和工具节点交替执行，max_iterations 次模型调用最多需要 2n-1 步；
+    # 第n次模型调用后仍要调用工具时，图形会因步数用尽而停止
+    run_config: Dict[str, Any] = {"recursion_limit": 2 * config.max_iterations - 1}
+    timeout = _run_timeout(config, timeout)
+    if timeout is not None:
+        run_config["timeout"] = timeout
+    if config.enable_memory and thread_id is not None:
+        run_config["configurable"] = {"thread_id": thread_id}
+    return run_config
+
+
+def _run_timeout(config: Configuration, timeout: Optional[float]) -> Optional[float]:
+    # 单次请求指定的超时优先于配置中的run_timeout
+    return config.run_timeout if timeout is None else timeout
+
+
+def _extract_answer(result: Dict[str, Any]) -> str:
+    # 提取最后的AI消息
+    messages = result["messages"]
+    for message in reversed(messages):
+        if isinstance(message, AIMessage) or hasattr(message, "content"):
+            return message.content
     
-    # 运行图形
-    thread_config = {"configurable": {"thread_id": thread_id}} if config.enable_memory else None
+    return "抱歉，没有找到有效的回答。"
+
+
+def _stop_reason(error: GraphRunLimitError) -> str:
+    return "timeout" if isinstance(error, GraphTimeoutError) else "max_iterations"
+
+
+def _partial_answer(error: GraphRunLimitError, config: Configuration,
+                    timeout: Optional[float] = None) -> str:
+    """运行因迭代次数或时间限制而停止时，用已有的中间结果组成回答"""
+    if isinstance(error, GraphTimeoutError):
+        note = f"已超过运行时间限制（{_run_timeout(config, timeout)}秒）"
+    else:
+        note = f"已达到最大迭代次数（{config.max_iterations}）"
+    partial = None
+    for message in reversed((error.state or {}).get("messages", [])):
+        if isinstance(message, HumanMessage):
+            break
+        if message.content:
+            partial = message.content
+            break
+    if partial:
+        return f"{note}，以下是目前的部分结果：\n{partial}"
+    return f"{note}，未能得到完整的回答。"
+
+
+async def _ainvoke_agent(app, query: str, config: Configuration,
+                         thread_id: Optional[str], timeout: Optional[float] = None) -> str:
+    """用已编译的图形异步运行代理并返回回答，出错时直接抛出异常
     
+    超出迭代次数或时间限制时不抛出异常，而是返回部分结果。
+    """
     try:
-        result = app.invoke(initial_state, config=thread_config)
-        
-        # 提取最后的AI消息
-        messages = result["messages"]
-        for message in reversed(messages):
-            if isinstance(message, AIMessage) or hasattr(message, "content"):
-                return message.content
+        result = await app.ainvoke(_initial_state(query),
+                                   config=_run_config(config, thread_id, timeout))
+    except GraphRunLimitError as e:
+        return _partial_answer(e, config, timeout)
+    return _extract_answer(result)
+
+
+def run_agent(query: str, config: Configuration = None, thread_id: Optional[str] = None,
+              timeout: Optional[float] = None) -> str:
+    """运行代理并返回结果
+    
+    Args:
+        query: 用户查询
+        config: 配置对象
+        thread_id: 线程ID，用于内存管理；为None时是无状态运行，不读写对话记忆
+        timeout: 本次运行的最长时间（秒），为None时使用 ``config.run_timeout``
         
-        return "抱歉，没有找到有效的回答。"
+    Returns:
+        代理的回答
+    """
+    if config is None:
+        config = Configuration()
+    
+    # 获取（缓存的）图形
+    app = get_agent_graph(config)
+    
+    try:
+        result = app.invoke(_initial_state(query), config=_run_config(config, thread_id, timeout))
+        return _extract_answer(result)
         
+    except GraphRunLimitError as e:
+        return _partial_answer(e, config, timeout)
     except Exception as e:
         return f"运行代理时出现错误：{str(e)}"
 
 
-async def arun_agent(query: str, config: Configuration = None, thread_id: str = "default") -> str:
+async def arun_agent(query: str, config: Configuration = None, thread_id: Optional[str] = None,
+                     timeout: Optional[float] = None) -> str:
     """异步运行代理并返回结果
     
     Args:
         query: 用户查询
         config: 配置对象
-        thread_id: 线程ID，用于内存管理
+        thread_id: 线程ID，用于内存管理；为None时是无状态运行，不读写对话记忆
+        timeout: 本次运行的最长时间（秒），为None时使用 ``config.run_timeout``
         
     Returns:
         代理的回答
@@ -242,30 +634,221 @@ async def arun_agent(query: str, config: Configuration = None, thread_id: str =
     if config is None:
         config = Configuration()
     
-    # 创建图形
-    app = create_agent_graph(config)
+    # 获取（缓存的）图形
+    app = get_agent_graph(config)
     
-    # 准备输入
-    initial_state = {
-        "messages": [HumanMessage(content=query)],
-        "iteration_count": 0,
-        "user_input": query,
-        "final_answer": None
-    }
+    try:
+        return await _ainvoke_agent(app, query, config, thread_id, timeout)
+    except Exception as e:
+        return f"运行代理时出现错误：{str(e)}"
+
+
+class BatchItemResult(TypedDict):
+    """批量运行中单个查询的结果"""
+    index: int
+    query: str
+    thread_id: Optional[str]
+    answer: Optional[str]
+    error: Optional[str]
+    elapsed: float
+
+
+async def arun_agent_batch(
+    queries: List[str],
+    config: Configuration = None,
+    thread_ids: Optional[List[Optional[str]]] = None,
+    max_concurrency: Optional[int] = None,
+    admit: Optional[Callable[[], AsyncContextManager[Any]]] = None,
+) -> List[BatchItemResult]:
+    """并发运行一批查询，按输入顺序返回结果
     
-    # 运行图形
-    thread_config = {"configurable": {"thread_id": thread_id}} if config.enable_memory else None
+    所有查询共享同一个缓存的图形；同时执行的查询数不超过
+    ``max_concurrency``（默认取 ``config.batch_concurrency``）。
+    单个查询失败不会影响其他查询，错误记录在对应结果的 ``error`` 字段中。
     
-    try:
-        result = await app.ainvoke(initial_state, config=thread_config)
+    Args:
+        queries: 用户查询列表
+        config: 配置对象
+        thread_ids: 与查询一一对应的线程ID；为None（或某项为None）时该查询不使用对话记忆
+        max_concurrency: 最大并发数
+        admit: 返回异步上下文管理器的函数，每个查询在其中执行（例如准入控制），
+            进入时抛出的异常记为该查询的错误
         
-        # 提取最后的AI消息
-        messages = result["messages"]
-        for message in reversed(messages):
-            if isinstance(message, AIMessage) or hasattr(message, "content"):
-                return message.content
+    Returns:
+        与输入顺序一致的结果列表，包含回答、错误信息和耗时（秒）
+    """
+    if config is None:
+        config = Configuration()
+    if thread_ids is None:
+        thread_ids = [None] * len(queries)
+    elif len(thread_ids) != len(queries):
+        raise ValueError("thread_ids的数量必须与queries一致")
+    if max_concurrency is None:
+        max_concurrency = config.batch_concurrency
+    if max_concurrency <= 0:
+        raise ValueError("max_concurrency必须大于0")
+    
+    app = get_agent_graph(config)
+    results: List[Optional[BatchItemResult]] = [None] * len(queries)
+    pending = iter(range(len(queries)))
+    
+    async def worker():
+        # 固定数量的工作协程依次领取查询，避免一次创建全部任务
+        for index in pending:
+            query, thread_id = queries[index], thread_ids[index]
+            started = time.perf_counter()
+            answer, error = None, None
+            try:
+                if admit is None:
+                    answer = await _ainvoke_agent(app, query, config, thread_id)
+                else:
+                    async with admit():
+                        answer = await _ainvoke_agent(app, query, config, thread_id)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            results[index] = {
+                "index": index,
+                "query": query,
+                "thread_id": thread_id,
+                "answer": answer,
+                "error": error,
+                "elapsed": time.perf_counter() - started,
+            }
+    
+    await asyncio.gather(*(worker() for _ in range(min(max_concurrency, len(queries)))))
+    return results
+
+
+def run_agent_batch(
+    queries: List[str],
+    config: Configuration = None,
+    thread_ids: Optional[List[Optional[str]]] = None,
+    max_concurrency: Optional[int] = None,
+) -> List[BatchItemResult]:
+    """``arun_agent_batch`` 的同步版本，不能在运行中的事件循环里调用"""
+    return asyncio.run(arun_agent_batch(queries, config, thread_ids, max_concurrency))
+
+
+class _StreamEvents:
+    """把图形的流式输出转换为代理事件"""
+
+    def __init__(self):
+        self.answer = None
+
+    def convert(self, mode: str, payload: Any) -> List[Dict[str, Any]]:
+        if mode == "messages":
+            chunk, metadata = payload
+            if not chunk.content:
+                return []
+            return [{
+                "type": "token",
+                "content": chunk.content,
+                "node": metadata.get("langgraph_node"),
+            }]
         
-        return "抱歉，没有找到有效的回答。"
+        events = []
+        for node, update in payload.items():
+            for message in (update or {}).get("messages", []):
+                if isinstance(message, ToolMessage):
+                    events.append({
+                        "type": "tool_result",
+                        "name": message.name,
+                        "tool_call_id": message.tool_call_id,
+                        "content": message.content,
+                        "status": message.status,
+                    })
+                    continue
+                for call in getattr(message, "tool_calls", None) or []:
+                    events.append({
+                        "type": "tool_call",
+                        "name": call.get("name"),
+                        "args": call.get("args"),
+                        "id": call.get("id"),
+                    })
+                if hasattr(message, "content"):
+                    self.answer = message.content
+            events.append({"type": "node", "node": node})
+        return events
+
+    def final(self) -> Dict[str, Any]:
+        answer = self.answer if self.answer is not None else "抱歉，没有找到有效的回答。"
+        return {"type": "final", "answer": answer}
+
+    def stopped(self, error: GraphRunLimitError, config: Configuration,
+                timeout: Optional[float] = None) -> Dict[str, Any]:
+        return {
+            "type": "final",
+            "answer": _partial_answer(error, config, timeout),
+            "stopped": _stop_reason(error),
+        }
+
+
+def stream_agent(query: str, config: Configuration = None, thread_id: Optional[str] = None,
+                 timeout: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+    """流式运行代理，逐个产生执行事件
+    
+    事件是带 ``type`` 字段的字典：``token``（LLM输出片段）、``tool_call``、
+    ``tool_result``、``node``（节点执行完毕）、``final``（最终回答），
+    出错时产生 ``error`` 事件并结束。超出迭代次数或时间限制时，``final``
+    事件带有 ``stopped`` 字段（``max_iterations`` 或 ``timeout``），回答为部分结果。
+    
+    Args:
+        query: 用户查询
+        config: 配置对象
+        thread_id: 线程ID，用于内存管理；为None时是无状态运行，不读写对话记忆
+        timeout: 本次运行的最长时间（秒），为None时使用 ``config.run_timeout``
         
+    Yields:
+        执行事件
+    """
+    if config is None:
+        config = Configuration()
+    
+    run_config = _run_config(config, thread_id, timeout)
+    events = _StreamEvents()
+    
+    try:
+        app = get_agent_graph(config)
+        for mode, payload in app.stream(_initial_state(query), config=run_config,
+                                        stream_mode=["messages", "updates"]):
+            yield from events.convert(mode, payload)
+    except GraphRunLimitError as e:
+        yield events.stopped(e, config, timeout)
+        return
     except Exception as e:
-        return f"运行代理时出现错误：{str(e)}"
\ No newline at end of file
+        yield {"type": "error", "error": f"运行代理时出现错误：{str(e)}"}
+        return
+    
+    yield events.final()
+
+
+async def astream_agent(query: str, config: Configuration = None, thread_id: Optional[str] = None,
+                        timeout: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+    """异步流式运行代理，事件格式与 ``stream_agent`` 相同
+    
+    提前关闭生成器会取消正在执行的图形。
+    """
+    if config is None:
+        config = Configuration()
+    
+    run_config = _run_config(config, thread_id, timeout)
+    events = _StreamEvents()
+    
+    try:
+        app = get_agent_graph(config)
+        stream = app.astream(_initial_state(query), config=run_config,
+                             stream_mode=["messages", "updates"])
+        try:
+            async for mode, payload in stream:
+                for event in events.convert(mode, payload):
+                    yield event
+        finally:
+            await stream.aclose()
+    except GraphRunLimitError as e:
+        yield events.stopped(e, config, timeout)
+        return
+    except Exception as e:
+        yield {"type": "error", "error": f"运行代理时出现错误：{str(e)}"}
+        return
+    
+    yield events.final()
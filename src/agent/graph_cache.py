@@ -0,0 +1,151 @@
+"""已编译图形缓存模块
+
+提供进程级的LRU缓存，按配置指纹复用已编译的代理图形，
+避免每次请求都重新创建LLM客户端、绑定工具和编译工作流。
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+
+def config_fingerprint(config) -> str:
+    """计算配置对象的稳定指纹
+
+    Args:
+        config: Configuration对象
+
+    Returns:
+        由配置类名和全部字段值计算出的SHA-256十六进制摘要
+    """
+    payload = {
+        "__class__": type(config).__qualname__,
+        "fields": dict(vars(config)),
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=repr)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class GraphCache:
+    """线程安全的已编译图形LRU缓存
+
+    相同指纹的并发请求只会触发一次构建，其余请求等待并复用结果。
+    """
+
+    def __init__(self, max_size: int = 32):
+        if max_size <= 0:
+            raise ValueError("max_size必须大于0")
+        self._max_size = max_size
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_locks: Dict[str, threading.Lock] = {}
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size
+
+    def get(self, config) -> Optional[Any]:
+        """查找缓存的图形，未命中时返回None（不计入统计）"""
+        key = config_fingerprint(config)
+        with self._lock:
+            app = self._entries.get(key)
+            if app is not None:
+                self._entries.move_to_end(key)
+            return app
+
+    def get_or_create(self, config, factory: Callable[[], Any]) -> Any:
+        """获取缓存的图形，未命中时调用factory构建并缓存
+
+        Args:
+            config: Configuration对象
+            factory: 无参构建函数，返回编译好的图形
+
+        Returns:
+            编译好的图形
+        """
+        key = config_fingerprint(config)
+        with self._lock:
+            app = self._entries.get(key)
+            if app is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return app
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+
+        with build_lock:
+            # 可能在等待期间已被其他线程构建完成
+            with self._lock:
+                app = self._entries.get(key)
+                if app is not None:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return app
+                self._misses += 1
+
+            try:
+                app = factory()
+                with self._lock:
+                    self._entries[key] = app
+                    self._entries.move_to_end(key)
+                    self._evict_locked()
+                return app
+            finally:
+                with self._lock:
+                    self._build_locks.pop(key, None)
+
+    def invalidate(self, config=None) -> int:
+        """使缓存失效
+
+        Args:
+            config: 要失效的配置，为None时清空全部缓存
+
+        Returns:
+            被移除的条目数量
+        """
+        with self._lock:
+            if config is None:
+                removed = len(self._entries)
+                self._entries.clear()
+                return removed
+            key = config_fingerprint(config)
+            return 1 if self._entries.pop(key, None) is not None else 0
+
+    def resize(self, max_size: int) -> None:
+        """调整缓存容量，必要时立即淘汰最久未使用的条目"""
+        if max_size <= 0:
+            raise ValueError("max_size必须大于0")
+        with self._lock:
+            self._max_size = max_size
+            self._evict_locked()
+
+    def reset_stats(self) -> None:
+        """重置命中/未命中计数"""
+        with self._lock:
+            self._hits = self._misses = self._evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "max_size": self._max_size,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_rate": (self._hits / lookups) if lookups else 0.0,
+            }
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _evict_locked(self) -> None:
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+            self._evictions += 1
@@ -0,0 +1,344 @@
+"""LLM对冲请求模块
+
+把多个聊天模型组合为一个，接口与单个模型相同：
+
+* 对冲：主模型在对冲延迟内没有返回时，把相同的请求发给下一个模型，
+  取最先成功的结果并取消其余请求。对冲延迟默认取主模型近期延迟的高百分位数
+  （如p95），因此只有最慢的少量请求会触发对冲，额外的调用量也大致是这个比例。
+* 降级：某个模型出错且没有其他请求在进行时，立即改用下一个模型。
+
+流式调用按首个片段的到达时间对冲，一旦某个模型开始输出就只使用它的输出。
+同步调用在线程池中执行，被取消的同步请求无法中断，只是丢弃其结果。
+"""
+
+import asyncio
+import contextvars
+import inspect
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from . import metrics
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_hedge_executor() -> ThreadPoolExecutor:
+    """返回执行同步对冲请求的共享线程池"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                max_workers = int(os.getenv("AGENT_HEDGE_WORKERS", "32"))
+                _executor = ThreadPoolExecutor(
+                    max_workers=max_workers, thread_name_prefix="agent-hedge"
+                )
+    return _executor
+
+
+class LatencyWindow:
+    """最近若干次延迟的滑动窗口
+
+    百分位数每记录 ``refresh_every`` 个样本才重新排序计算一次，
+    样本数不足 ``min_samples`` 时 ``value()`` 返回None。
+    """
+
+    def __init__(self, size: int = 200, percentile: float = 95.0,
+                 min_samples: int = 20, refresh_every: int = 10):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.refresh_every = refresh_every
+        self._samples = deque(maxlen=size)
+        self._pending = 0
+        self._value: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+            self._pending += 1
+            if len(self._samples) < self.min_samples:
+                return
+            if self._value is None or self._pending >= self.refresh_every:
+                ordered = sorted(self._samples)
+                rank = math.ceil(len(ordered) * self.percentile / 100)
+                self._value = ordered[min(len(ordered), max(1, rank)) - 1]
+                self._pending = 0
+
+    def value(self) -> Optional[float]:
+        return self._value
+
+
+def _consume(task: "asyncio.Future") -> None:
+    # 取出被放弃任务的异常，避免事件循环记录"exception was never retrieved"
+    if not task.cancelled():
+        task.exception()
+
+
+async def _aiter_model(model, inputs):
+    if inspect.isasyncgenfunction(getattr(model, "astream", None)):
+        async for chunk in model.astream(inputs):
+            yield chunk
+    else:
+        yield await model.ainvoke(inputs)
+
+
+def _iter_model(model, inputs):
+    if inspect.isgeneratorfunction(getattr(model, "stream", None)):
+        yield from model.stream(inputs)
+    else:
+        yield model.invoke(inputs)
+
+
+class _Race:
+    """一次对冲请求的簿记：已发出的请求、发出原因和主模型延迟"""
+
+    def __init__(self, owner: "HedgedChatModel"):
+        self.owner = owner
+        self.started = time.monotonic()
+        self.launched = 0
+        self.reasons: List[str] = []
+        self.errors: List[BaseException] = []
+
+    def next_reason(self, reason: str) -> int:
+        index = self.launched
+        self.launched += 1
+        self.reasons.append(reason)
+        if reason != "primary":
+            self.owner._count(reason)
+        return index
+
+    def can_launch(self) -> bool:
+        return self.launched < len(self.owner.models)
+
+    def won(self, index: int) -> None:
+        if index == 0:
+            self.owner.latency.record(time.monotonic() - self.started)
+        elif self.reasons[index] == "hedged":
+            self.owner._count("hedge_won")
+
+    def abandoned(self, index: int) -> None:
+        # 主模型被取消时，已等待的时间是其延迟的下界，仍计入窗口以免低估
+        if index == 0:
+            self.owner.latency.record(time.monotonic() - self.started)
+
+    def fail(self) -> BaseException:
+        self.owner._count("failed")
+        return self.errors[-1]
+
+
+class HedgedChatModel:
+    """带对冲和降级的多模型包装器，接口与 ``ChatOpenAI`` 一致
+
+    Args:
+        models: ``(标签, 模型)`` 列表，第一个是主模型，其余按顺序用于对冲和降级
+        hedge: 为False时只在出错时降级，不发送对冲请求
+        delay: 固定的对冲延迟（秒），为None时取主模型近期延迟的 ``percentile`` 百分位数
+        percentile: 计算对冲延迟的百分位数
+        default_delay: 主模型延迟样本不足时使用的对冲延迟（秒）
+        window: 计算百分位数的最近样本数
+        min_samples: 开始使用百分位数所需的最少样本数
+    """
+
+    def __init__(
+        self,
+        models: Sequence[Tuple[str, Any]],
+        hedge: bool = True,
+        delay: Optional[float] = None,
+        percentile: float = 95.0,
+        default_delay: float = 1.0,
+        window: int = 200,
+        min_samples: int = 20,
+    ):
+        if not models:
+            raise ValueError("至少需要一个模型")
+        self.models = list(models)
+        self.hedge = hedge
+        self.delay = delay
+        self.default_delay = default_delay
+        self.latency = LatencyWindow(window, percentile, min_samples)
+        label = self.models[0][0]
+        self._events = {
+            event: metrics.LLM_HEDGE_EVENTS.labels(label, event)
+            for event in ("hedged", "hedge_won", "fallback", "failed")
+        }
+        self._stats = dict.fromkeys(("requests", "hedged", "hedge_won", "fallback", "failed"), 0)
+        self._stats_lock = threading.Lock()
+
+    def bind_tools(self, tools):
+        """返回每个模型都绑定了工具的副本，与原包装器共享延迟窗口和统计"""
+        bound = object.__new__(type(self))
+        bound.__dict__.update(self.__dict__)
+        bound.models = [(label, model.bind_tools(tools)) for label, model in self.models]
+        return bound
+
+    # -- 统计 -------------------------------------------------------------
+
+    def _count(self, event: str) -> None:
+        with self._stats_lock:
+            self._stats[event] += 1
+        if event in self._events:
+            self._events[event].inc()
+
+    def hedge_delay(self) -> Optional[float]:
+        """当前的对冲延迟（秒），不对冲时返回None"""
+        if not self.hedge or len(self.models) < 2:
+            return None
+        if self.delay is not None:
+            return self.delay
+        value = self.latency.value()
+        return self.default_delay if value is None else value
+
+    def get_stats(self) -> Dict[str, Any]:
+        """返回请求数、对冲次数、对冲胜出次数、降级次数、失败次数及比例"""
+        with self._stats_lock:
+            stats: Dict[str, Any] = dict(self._stats)
+        stats["hedge_rate"] = stats["hedged"] / stats["requests"] if stats["requests"] else 0.0
+        stats["hedge_win_rate"] = stats["hedge_won"] / stats["hedged"] if stats["hedged"] else 0.0
+        stats["hedge_delay"] = self.hedge_delay()
+        return stats
+
+    # -- 异步 -------------------------------------------------------------
+
+    async def _arace(self, start: Callable[[Any], Any], discard: Optional[Callable] = None):
+        """并发执行 ``start(model)``，返回最先成功的结果"""
+        self._count("requests")
+        race = _Race(self)
+        delay = self.hedge_delay()
+        tasks: Dict["asyncio.Future", int] = {}
+
+        def launch(reason: str) -> None:
+            index = race.next_reason(reason)
+            task = asyncio.ensure_future(start(self.models[index][1]))
+            task.add_done_callback(_consume)
+            tasks[task] = index
+
+        launch("primary")
+        try:
+            while tasks:
+                hedging = delay is not None and race.can_launch()
+                done, _ = await asyncio.wait(
+                    tasks, timeout=delay if hedging else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    launch("hedged")
+                    continue
+                for task in done:
+                    index = tasks.pop(task)
+                    if task.exception() is None:
+                        race.won(index)
+                        return task.result()
+                    race.errors.append(task.exception())
+                if not tasks and race.can_launch():
+                    launch("fallback")
+            raise race.fail()
+        finally:
+            for task, index in tasks.items():
+                race.abandoned(index)
+                task.cancel()
+                if discard is not None:
+                    task.add_done_callback(
+                        lambda t: discard(t.result()) if not t.cancelled() and t.exception() is None else None
+                    )
+
+    async def ainvoke(self, inputs):
+        if len(self.models) == 1:
+            return await self.models[0][1].ainvoke(inputs)
+        return await self._arace(lambda model: model.ainvoke(inputs))
+
+    async def astream(self, inputs):
+        async def first(model):
+            stream = _aiter_model(model, inputs)
+            try:
+                return stream, await stream.__anext__()
+            except StopAsyncIteration:
+                return stream, None
+            except BaseException:
+                await stream.aclose()
+                raise
+
+        def discard(result):
+            asyncio.ensure_future(result[0].aclose())
+
+        stream, chunk = await self._arace(first, discard)
+        try:
+            if chunk is None:
+                return
+            yield chunk
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    # -- 同步 -------------------------------------------------------------
+
+    def _race(self, start: Callable[[Any], Any], discard: Optional[Callable] = None):
+        """``_arace`` 的同步版本，请求在共享线程池中执行"""
+        self._count("requests")
+        race = _Race(self)
+        delay = self.hedge_delay()
+        executor = get_hedge_executor()
+        futures: Dict[Any, int] = {}
+
+        def launch(reason: str) -> None:
+            index = race.next_reason(reason)
+            # 每个请求复制一份上下文，使模型调用也能读取运行截止时间等上下文变量
+            context = contextvars.copy_context()
+            futures[executor.submit(context.run, start, self.models[index][1])] = index
+
+        launch("primary")
+        try:
+            while futures:
+                hedging = delay is not None and race.can_launch()
+                done, _ = wait(futures, timeout=delay if hedging else None,
+                               return_when=FIRST_COMPLETED)
+                if not done:
+                    launch("hedged")
+                    continue
+                for future in done:
+                    index = futures.pop(future)
+                    if future.exception() is None:
+                        race.won(index)
+                        return future.result()
+                    race.errors.append(future.exception())
+                if not futures and race.can_launch():
+                    launch("fallback")
+            raise race.fail()
+        finally:
+            for future, index in futures.items():
+                race.abandoned(index)
+                if not future.cancel() and discard is not None:
+                    future.add_done_callback(
+                        lambda f: discard(f.result()) if f.exception() is None else None
+                    )
+
+    def invoke(self, inputs):
+        if len(self.models) == 1:
+            return self.models[0][1].invoke(inputs)
+        return self._race(lambda model: model.invoke(inputs))
+
+    def stream(self, inputs):
+        def first(model):
+            stream = _iter_model(model, inputs)
+            try:
+                return stream, next(stream)
+            except StopIteration:
+                return stream, None
+            except BaseException:
+                stream.close()
+                raise
+
+        stream, chunk = self._race(first, lambda result: result[0].close())
+        try:
+            if chunk is None:
+                return
+            yield chunk
+            yield from stream
+        finally:
+            stream.close()
@@ -0,0 +1,402 @@
+"""LLM响应缓存模块
+
+按模型、温度、系统提示、工具定义和归一化后的消息列表缓存模型回答，
+重复的提问直接返回缓存结果，不再调用模型。缓存分两层：
+
+* 内存层：进程内的LRU，命中耗时为微秒级；
+* 磁盘层（可选）：SQLite数据库（WAL模式），进程重启后和多个工作进程之间共享。
+
+两层都有TTL。消息归一化会合并空白，并忽略工具调用ID（每次调用都不同），
+因此只有措辞相同的对话才会命中。温度大于0的模型默认不使用缓存，
+因为同一提问本应得到不同的回答。
+"""
+
+import asyncio
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ToolMessage
+from langgraph.checkpoint.serde import JsonSerializer
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS llm_cache (
+        key TEXT PRIMARY KEY,
+        response TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS llm_cache_expires ON llm_cache (expires_at)",
+)
+
+
+def _normalize_text(value: Any) -> Any:
+    if isinstance(value, str):
+        return " ".join(value.split())
+    return value
+
+
+def normalize_messages(messages: Iterable[Any]) -> List[Any]:
+    """把消息列表转换为用于计算缓存键的归一化形式
+
+    保留消息类型、合并空白后的内容、工具调用的名称和参数以及工具结果的名称和状态，
+    忽略工具调用ID。
+    """
+    normalized = []
+    for message in messages:
+        if not isinstance(message, BaseMessage):
+            normalized.append(["raw", _normalize_text(str(message))])
+            continue
+        item = [type(message).__name__, _normalize_text(message.content)]
+        if message.tool_calls:
+            item.append([[call.get("name"), call.get("args")] for call in message.tool_calls])
+        if isinstance(message, ToolMessage):
+            item.extend([message.name, message.status])
+        normalized.append(item)
+    return normalized
+
+
+def tool_schema(tools: Iterable[Any]) -> List[Any]:
+    """工具定义的摘要：名称、说明和参数签名，工具改变时缓存键随之改变"""
+    schema = []
+    for tool in tools:
+        func = getattr(tool, "__wrapped__", tool)
+        try:
+            signature = str(inspect.signature(func))
+        except (TypeError, ValueError):
+            signature = ""
+        name = getattr(tool, "name", None) or getattr(tool, "__name__", repr(tool))
+        schema.append([name, inspect.getdoc(func) or "", signature])
+    return schema
+
+
+def cache_key(namespace: Dict[str, Any], messages: Iterable[Any]) -> str:
+    """计算缓存键（SHA-256十六进制摘要）"""
+    payload = {"namespace": namespace, "messages": normalize_messages(messages)}
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=repr)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """两层（内存LRU + 可选SQLite）的LLM响应缓存
+
+    Args:
+        maxsize: 内存层最多缓存的回答数
+        ttl: 缓存有效期（秒）
+        path: SQLite数据库路径，为None时只使用内存层
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600.0, path: Optional[str] = None):
+        if ttl <= 0:
+            raise ValueError("ttl必须大于0")
+        if maxsize <= 0:
+            raise ValueError("maxsize必须大于0")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.serde = JsonSerializer()
+        self._entries: "OrderedDict[str, Tuple[float, AIMessage]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = dict.fromkeys(
+            ("memory_hits", "disk_hits", "misses", "stores", "evictions", "expirations"), 0
+        )
+        if path is not None:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            conn = self._conn()
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _remember(self, key: str, expires_at: float, message: AIMessage) -> None:
+        # 调用方需持有 self._lock
+        self._entries[key] = (expires_at, message)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _memory_get(self, key: str) -> Optional[AIMessage]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, message = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return message
+                del self._entries[key]
+                self._stats["expirations"] += 1
+        return None
+
+    def get(self, key: str) -> Optional[AIMessage]:
+        """返回缓存的回答，未命中或已过期时返回None"""
+        message = self._memory_get(key)
+        if message is None and self.path is not None:
+            message = self._disk_get(key)
+        if message is None:
+            self._count("misses")
+        return message
+
+    async def aget(self, key: str) -> Optional[AIMessage]:
+        """``get`` 的异步版本：磁盘层在线程池中读取，不阻塞事件循环"""
+        message = self._memory_get(key)
+        if message is None and self.path is not None:
+            loop = asyncio.get_running_loop()
+            message = await loop.run_in_executor(None, self._disk_get, key)
+        if message is None:
+            self._count("misses")
+        return message
+
+    def _disk_get(self, key: str) -> Optional[AIMessage]:
+        row = self._conn().execute(
+            "SELECT response, expires_at FROM llm_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        response, expires_at = row
+        remaining = expires_at - time.time()
+        if remaining <= 0:
+            conn = self._conn()
+            conn.execute("DELETE FROM llm_cache WHERE key = ? AND expires_at = ?", (key, expires_at))
+            conn.commit()
+            self._count("expirations")
+            return None
+        message = self.serde.loads(response)
+        with self._lock:
+            # 提升到内存层，剩余有效期与磁盘记录一致
+            self._remember(key, time.monotonic() + remaining, message)
+            self._stats["disk_hits"] += 1
+        return message
+
+    def _memory_put(self, key: str, message: AIMessage) -> None:
+        with self._lock:
+            self._remember(key, time.monotonic() + self.ttl, message)
+            self._stats["stores"] += 1
+
+    def _disk_put(self, key: str, message: AIMessage) -> None:
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, response, created_at, expires_at) "
+            "VALUES (?, ?, ?, ?)",
+            (key, self.serde.dumps(message), now, now + self.ttl),
+        )
+        conn.commit()
+
+    def put(self, key: str, message: AIMessage) -> None:
+        """缓存一条回答（两层同时写入）"""
+        self._memory_put(key, message)
+        if self.path is not None:
+            self._disk_put(key, message)
+
+    async def aput(self, key: str, message: AIMessage) -> None:
+        """``put`` 的异步版本：磁盘层在线程池中写入，不阻塞事件循环"""
+        self._memory_put(key, message)
+        if self.path is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._disk_put, key, message)
+
+    def purge_expired(self) -> int:
+        """删除磁盘层中已过期的记录，返回删除的条数"""
+        if self.path is None:
+            return 0
+        conn = self._conn()
+        deleted = conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+        conn.commit()
+        return deleted
+
+    def clear(self) -> None:
+        """清空两层缓存（不影响统计）"""
+        with self._lock:
+            self._entries.clear()
+        if self.path is not None:
+            conn = self._conn()
+            conn.execute("DELETE FROM llm_cache")
+            conn.commit()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            for stat in self._stats:
+                self._stats[stat] = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息"""
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hits"] = stats["memory_hits"] + stats["disk_hits"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["maxsize"] = self.maxsize
+        stats["ttl"] = self.ttl
+        return stats
+
+
+class CachedChatModel:
+    """带响应缓存的模型包装器，接口与 ``ChatOpenAI`` 一致
+
+    Args:
+        model: 被包装的模型
+        cache: 响应缓存
+        namespace: 参与缓存键计算的模型参数（提供商、模型名、温度、系统提示等）
+    """
+
+    def __init__(self, model, cache: LLMResponseCache, namespace: Dict[str, Any]):
+        self.model = model
+        self.cache = cache
+        self.namespace = dict(namespace)
+
+    def bind_tools(self, tools):
+        tools = list(tools)
+        return CachedChatModel(
+            self.model.bind_tools(tools),
+            self.cache,
+            dict(self.namespace, tools=tool_schema(tools)),
+        )
+
+    def _key(self, inputs) -> str:
+        messages = inputs.get("messages", []) if isinstance(inputs, dict) else inputs
+        return cache_key(self.namespace, messages)
+
+    @staticmethod
+    def _cacheable(response) -> Optional[AIMessage]:
+        if isinstance(response, AIMessageChunk):
+            response = response.to_message()
+        return response if isinstance(response, AIMessage) else None
+
+    def _store(self, key: str, response) -> None:
+        message = self._cacheable(response)
+        if message is not None:
+            self.cache.put(key, message)
+
+    async def _astore(self, key: str, response) -> None:
+        message = self._cacheable(response)
+        if message is not None:
+            await self.cache.aput(key, message)
+
+    def invoke(self, inputs):
+        key = self._key(inputs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        response = self.model.invoke(inputs)
+        self._store(key, response)
+        return response
+
+    async def ainvoke(self, inputs):
+        key = self._key(inputs)
+        cached = await self.cache.aget(key)
+        if cached is not None:
+            return cached
+        return await self._ainvoke_model(key, inputs)
+
+    async def _ainvoke_model(self, key: str, inputs):
+        ainvoke = getattr(self.model, "ainvoke", None)
+        if inspect.iscoroutinefunction(ainvoke):
+            response = await ainvoke(inputs)
+        else:
+            response = self.model.invoke(inputs)
+        await self._astore(key, response)
+        return response
+
+    @staticmethod
+    def _as_chunk(message: AIMessage) -> AIMessageChunk:
+        return AIMessageChunk(content=message.content, tool_calls=list(message.tool_calls))
+
+    def stream(self, inputs):
+        key = self._key(inputs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield self._as_chunk(cached)
+            return
+        stream = getattr(self.model, "stream", None)
+        if not inspect.isgeneratorfunction(stream):
+            response = self.model.invoke(inputs)
+            self._store(key, response)
+            yield response
+            return
+        merged = None
+        for chunk in stream(inputs):
+            merged = chunk if merged is None else merged + chunk
+            yield chunk
+        # 只缓存完整输出的回答，中途停止的流不会写入缓存
+        if merged is not None:
+            self._store(key, merged)
+
+    async def astream(self, inputs):
+        key = self._key(inputs)
+        cached = await self.cache.aget(key)
+        if cached is not None:
+            yield self._as_chunk(cached)
+            return
+        astream = getattr(self.model, "astream", None)
+        if not inspect.isasyncgenfunction(astream):
+            yield await self._ainvoke_model(key, inputs)
+            return
+        merged = None
+        async for chunk in astream(inputs):
+            merged = chunk if merged is None else merged + chunk
+            yield chunk
+        if merged is not None:
+            await self._astore(key, merged)
+
+
+# 进程级缓存实例，按（路径、容量、TTL）共享
+_LLM_CACHES: Dict[tuple, LLMResponseCache] = {}
+_llm_caches_lock = threading.Lock()
+
+
+def get_llm_cache(path: Optional[str] = None, maxsize: int = 1024,
+                  ttl: float = 3600.0) -> LLMResponseCache:
+    """获取共享的LLM响应缓存，相同参数返回同一个实例"""
+    key = (os.path.abspath(path) if path else None, maxsize, ttl)
+    with _llm_caches_lock:
+        cache = _LLM_CACHES.get(key)
+        if cache is None:
+            cache = _LLM_CACHES[key] = LLMResponseCache(maxsize=maxsize, ttl=ttl, path=key[0])
+        return cache
+
+
+def get_llm_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """获取所有LLM响应缓存的统计信息，按SQLite路径索引（仅内存层的缓存为 ``memory``）"""
+    with _llm_caches_lock:
+        caches = list(_LLM_CACHES.values())
+    stats: Dict[str, Dict[str, Any]] = {}
+    for cache in caches:
+        name = cache.path or "memory"
+        if name in stats:
+            name = f"{name}#{len(stats)}"
+        stats[name] = cache.stats()
+    return stats
+
+
+def clear_llm_caches() -> None:
+    """清空所有LLM响应缓存"""
+    with _llm_caches_lock:
+        caches = list(_LLM_CACHES.values())
+    for cache in caches:
+        cache.clear()
@@ -0,0 +1,439 @@
+"""运行指标模块
+
+提供Prometheus文本格式的计数器、仪表和直方图。热路径上的更新不加锁：
+每个线程写自己的分片（``threading.local``），只有抓取指标时才汇总所有分片，
+因此在高并发下几乎不增加额外开销；线程结束后其分片被合并，内存占用有界。
+
+模块级的 ``REGISTRY`` 汇总了代理服务的全部指标，``render_metrics()`` 返回
+``/metrics`` 端点的响应内容。
+"""
+
+import bisect
+import math
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import ToolMessage
+from langgraph.tracing import DEFAULT_BUCKETS, GraphCallback
+
+
+class _CellOwner:
+    """线程分片的所有者，随线程的 ``threading.local`` 数据一起释放"""
+
+    __slots__ = ("__weakref__",)
+
+
+class _Sharded:
+    """按线程分片的数值单元，每个线程只写自己的分片
+
+    线程结束后其分片被并入 ``_retired``，分片数只与存活的线程数有关，
+    不会随创建过的线程总数（如每次流式请求启动的线程）无限增长。
+    """
+
+    def __init__(self, width: int):
+        self._width = width
+        self._local = threading.local()
+        self._cells: Dict[int, List[float]] = {}
+        self._retired = [0.0] * width
+        self._lock = threading.Lock()
+
+    def cell(self) -> List[float]:
+        cell = getattr(self._local, "cell", None)
+        if cell is None:
+            cell = [0.0] * self._width
+            owner = _CellOwner()
+            with self._lock:
+                self._cells[id(cell)] = cell
+            weakref.finalize(owner, self._retire, id(cell)).atexit = False
+            self._local.owner = owner
+            self._local.cell = cell
+        return cell
+
+    def _retire(self, key: int) -> None:
+        # 线程已结束，不会再写这个分片
+        with self._lock:
+            cell = self._cells.pop(key, None)
+            if cell is not None:
+                for i, value in enumerate(cell):
+                    self._retired[i] += value
+
+    def totals(self) -> List[float]:
+        with self._lock:
+            cells = list(self._cells.values())
+            totals = list(self._retired)
+        for cell in cells:
+            for i, value in enumerate(cell):
+                totals[i] += value
+        return totals
+
+
+class _CounterChild:
+    def __init__(self):
+        self._shards = _Sharded(1)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._shards.cell()[0] += amount
+
+    def value(self) -> float:
+        return self._shards.totals()[0]
+
+
+class _GaugeChild(_CounterChild):
+    def dec(self, amount: float = 1.0) -> None:
+        self._shards.cell()[0] -= amount
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._buckets = buckets
+        # 各分桶计数（最后一个为+Inf），然后是总和与总数
+        self._shards = _Sharded(len(buckets) + 3)
+
+    def observe(self, value: float) -> None:
+        cell = self._shards.cell()
+        cell[bisect.bisect_left(self._buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def time(self):
+        """上下文管理器：观测代码块的执行时间"""
+        return _Timer(self)
+
+    def snapshot(self) -> Tuple[List[float], float, float]:
+        totals = self._shards.totals()
+        return totals[:-2], totals[-2], totals[-1]
+
+
+class _Timer:
+    def __init__(self, histogram: _HistogramChild):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._started)
+        return False
+
+
+class _Metric:
+    kind = ""
+
+    @property
+    def family_name(self) -> str:
+        return self.name
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: Any):
+        """返回对应标签值的子指标；调用方可以缓存返回值以省去查找"""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _items(self):
+        with self._lock:
+            return list(self._children.items())
+
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+
+    kind = "counter"
+
+    @property
+    def family_name(self) -> str:
+        return f"{self.name}_total"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.inc(amount)
+
+    def samples(self):
+        for key, child in self._items():
+            yield f"{self.name}_total", dict(zip(self.labelnames, key)), child.value()
+
+
+class Gauge(_Metric):
+    """可增可减的仪表（用于进行中的请求数等）"""
+
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._default.dec(amount)
+
+    def samples(self):
+        for key, child in self._items():
+            yield self.name, dict(zip(self.labelnames, key)), child.value()
+
+
+class Histogram(_Metric):
+    """分桶直方图"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def samples(self):
+        for key, child in self._items():
+            labels = dict(zip(self.labelnames, key))
+            counts, total, count = child.snapshot()
+            cumulative = 0.0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", dict(labels, le=_format_value(bound)), cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class GaugeCollector:
+    """抓取时调用函数生成样本的仪表，适合导出已有的统计信息"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str,
+                 collect: Callable[[], Iterable[Tuple[Dict[str, str], float]]]):
+        self.name = name
+        self.documentation = documentation
+        self._collect = collect
+
+    def samples(self):
+        for labels, value in self._collect():
+            yield self.name, labels, value
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if float(value).is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Registry:
+    """指标注册表，负责生成Prometheus文本格式"""
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            name = getattr(metric, "family_name", metric.name)
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                if labels:
+                    rendered = ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+                    lines.append(f"{name}{{{rendered}}} {_format_value(value)}")
+                else:
+                    lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "agent_http_requests", "HTTP请求数", ["method", "path", "status"]))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    "agent_http_requests_in_flight", "正在处理的HTTP请求数"))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    "agent_http_request_duration_seconds", "HTTP请求端到端耗时（秒）", ["path"]))
+COALESCED_CALLS = REGISTRY.register(Counter(
+    "agent_coalesced_calls", "合并到进行中的相同调用、因而节省的执行次数", ["name"]))
+ADMISSION_IN_FLIGHT = REGISTRY.register(Gauge(
+    "agent_admission_in_flight", "已被接纳、正在执行的代理请求数"))
+ADMISSION_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "agent_admission_queue_depth", "等待准入的请求数", ["priority"]))
+ADMISSION_WAIT = REGISTRY.register(Histogram(
+    "agent_admission_wait_seconds", "请求在准入队列中的等待时间（秒）", ["priority"]))
+ADMISSION_REJECTED = REGISTRY.register(Counter(
+    "agent_admission_rejected", "未被接纳的请求数（queue_full、queue_timeout）",
+    ["priority", "reason"]))
+NODE_LATENCY = REGISTRY.register(Histogram(
+    "agent_node_duration_seconds", "图形节点执行耗时（秒）", ["node"]))
+NODE_ERRORS = REGISTRY.register(Counter(
+    "agent_node_errors", "图形节点抛出的异常数", ["node"]))
+LLM_CALLS = REGISTRY.register(Counter(
+    "agent_llm_calls", "LLM调用次数", ["provider", "model", "status"]))
+LLM_LATENCY = REGISTRY.register(Histogram(
+    "agent_llm_call_duration_seconds", "LLM调用耗时（秒）", ["provider", "model"]))
+LLM_HEDGE_EVENTS = REGISTRY.register(Counter(
+    "agent_llm_hedge_events", "LLM对冲（hedged、hedge_won）与降级（fallback、failed）事件数",
+    ["model", "event"]))
+LLM_RATE_LIMIT_WAIT = REGISTRY.register(Histogram(
+    "agent_llm_rate_limit_wait_seconds", "LLM调用前等待限流配额的时间（秒）", ["model"]))
+LLM_RATE_LIMITED = REGISTRY.register(Counter(
+    "agent_llm_rate_limited", "提供商返回429的次数", ["model"]))
+CONTEXT_TRIMMED = REGISTRY.register(Counter(
+    "agent_context_trimmed_messages", "因超出上下文token预算而未发送给模型的消息数"))
+TOOL_CALLS = REGISTRY.register(Counter(
+    "agent_tool_calls", "工具调用次数", ["tool", "status"]))
+CHECKPOINT_LATENCY = REGISTRY.register(Histogram(
+    "agent_checkpoint_operation_duration_seconds", "检查点读写耗时（秒）",
+    ["backend", "operation"],
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)))
+
+
+def _tool_cache_samples():
+    from .tool_cache import get_tool_cache_stats
+
+    for tool, stats in get_tool_cache_stats().items():
+        for key in ("hits", "misses", "coalesced", "evictions", "expirations", "size"):
+            yield {"tool": tool, "stat": key}, stats[key]
+
+
+def _tool_cache_hit_rate():
+    from .tool_cache import get_tool_cache_stats
+
+    for tool, stats in get_tool_cache_stats().items():
+        yield {"tool": tool}, stats["hit_rate"]
+
+
+def _llm_cache_samples():
+    from .llm_cache import get_llm_cache_stats
+
+    for cache, stats in get_llm_cache_stats().items():
+        for key in ("memory_hits", "disk_hits", "misses", "stores", "evictions",
+                    "expirations", "size"):
+            yield {"cache": cache, "stat": key}, stats[key]
+
+
+def _http_pool_samples():
+    from .clients import get_http_client_stats
+
+    for pool, stats in get_http_client_stats().items():
+        for key, value in stats.items():
+            if not isinstance(value, bool):
+                yield {"pool": pool, "stat": key}, value
+
+
+REGISTRY.register(GaugeCollector(
+    "agent_tool_cache", "工具结果缓存统计（累计值）", _tool_cache_samples))
+REGISTRY.register(GaugeCollector(
+    "agent_tool_cache_hit_rate", "工具结果缓存命中率", _tool_cache_hit_rate))
+REGISTRY.register(GaugeCollector(
+    "agent_llm_cache", "模型回答缓存统计（累计值）", _llm_cache_samples))
+REGISTRY.register(GaugeCollector(
+    "agent_http_pool", "模型API连接池统计（请求数、新建/复用连接数、使用中/空闲连接数、利用率）",
+    _http_pool_samples))
+
+
+def render_metrics() -> str:
+    """返回Prometheus文本格式（0.0.4）的全部指标"""
+    return REGISTRY.render()
+
+
+class MetricsCallback(GraphCallback):
+    """把节点耗时、节点异常和工具调用结果写入指标的图形回调"""
+
+    def on_node_end(self, event):
+        NODE_LATENCY.labels(event.node).observe(event.duration)
+        if event.error is not None:
+            NODE_ERRORS.labels(event.node).inc()
+        update = event.update
+        if isinstance(update, dict):
+            for message in update.get("messages") or ():
+                if isinstance(message, ToolMessage):
+                    TOOL_CALLS.labels(message.name, message.status).inc()
+
+
+class InstrumentedCheckpointer:
+    """记录读写耗时的检查点存储代理，其余属性透传给被包装的存储"""
+
+    def __init__(self, saver, backend: str):
+        self._saver = saver
+        self._timers = {
+            operation: CHECKPOINT_LATENCY.labels(backend, operation)
+            for operation in ("get_tuple", "put_writes", "put", "flush")
+        }
+
+    def __getattr__(self, name):
+        return getattr(self._saver, name)
+
+    def get_tuple(self, config):
+        with self._timers["get_tuple"].time():
+            return self._saver.get_tuple(config)
+
+    def put_writes(self, config, writes, metadata=None):
+        with self._timers["put_writes"].time():
+            return self._saver.put_writes(config, writes, metadata)
+
+    def put(self, config, values, metadata=None):
+        with self._timers["put"].time():
+            return self._saver.put(config, values, metadata)
+
+    def flush(self):
+        with self._timers["flush"].time():
+            return self._saver.flush()
+
+    async def aget_tuple(self, config):
+        with self._timers["get_tuple"].time():
+            return await self._saver.aget_tuple(config)
+
+    async def aput_writes(self, config, writes, metadata=None):
+        with self._timers["put_writes"].time():
+            return await self._saver.aput_writes(config, writes, metadata)
+
+    async def aput(self, config, values, metadata=None):
+        with self._timers["put"].time():
+            return await self._saver.aput(config, values, metadata)
+
+    async def aflush(self):
+        with self._timers["flush"].time():
+            return await self._saver.aflush()
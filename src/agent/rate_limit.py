@@ -0,0 +1,397 @@
+"""LLM调用限流模块
+
+按提供商和模型对请求数（RPM）和token数（TPM）做客户端限流，调用前预约配额：
+
+* 令牌桶：两个桶分别按每分钟配额匀速补充，容量为 ``burst`` 秒的配额；
+  预约允许余额为负，调用方等待到余额回到0为止，因此并发的调用按到达顺序排队；
+* token估算：调用前按消息长度估算输入token，加上 ``max_tokens`` 作为输出预留，
+  调用返回实际用量时多退少补；
+* 跨进程共享：指定路径时桶状态保存在SQLite文件中，每次预约在一个
+  ``BEGIN IMMEDIATE`` 事务内读改写，多个工作进程共享同一份配额；
+* 自适应：收到429时速率减半（最低为配置的10%），并在 ``Retry-After`` 期间暂停发送；
+  之后每次成功调用恢复5%，直到回到配置的速率。
+"""
+
+import asyncio
+import functools
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from langgraph.config import get_time_budget
+
+from . import metrics
+from .context import message_tokens
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS rate_limits (
+        key TEXT PRIMARY KEY,
+        state TEXT NOT NULL
+    )
+"""
+
+# 未设置max_tokens时为输出预留的token数
+DEFAULT_COMPLETION_TOKENS = 256
+_MIN_SCALE = 0.1
+_RECOVERY = 0.05
+
+
+class RateLimitTimeout(asyncio.TimeoutError):
+    """等待配额的时间超出了剩余的运行时间"""
+
+    def __init__(self, wait: float):
+        super().__init__(f"等待限流配额需要{wait:.2f}秒，超出了剩余时间")
+        self.wait = wait
+
+
+def estimate_tokens(messages: Iterable[Any], max_tokens: Optional[int] = None) -> int:
+    """估算一次调用的token数：输入消息（含工具调用）加上输出预留"""
+    return sum(message_tokens(message) for message in messages) + (
+        max_tokens or DEFAULT_COMPLETION_TOKENS
+    )
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """判断异常是否表示提供商返回了429"""
+    response = getattr(error, "response", None)
+    for status in (getattr(error, "status_code", None), getattr(response, "status_code", None)):
+        if status == 429:
+            return True
+    return "RateLimit" in type(error).__name__
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """读取429响应中的 ``Retry-After``（秒），没有时返回None"""
+    value = getattr(error, "retry_after", None)
+    if value is None:
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class _MemoryStore:
+    """进程内的桶状态"""
+
+    def __init__(self):
+        self._states: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def transact(self, key: str, update: Callable[[Optional[Dict[str, float]]], Any]):
+        with self._lock:
+            state = self._states.get(key)
+            state = dict(state) if state is not None else None
+            new_state, result = update(state)
+            if new_state is not None:
+                self._states[key] = new_state
+            return result
+
+
+class _SqliteStore:
+    """保存在SQLite文件中、多个进程共享的桶状态"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # 自动提交模式，事务由transact显式开始
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None,
+                                   check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def transact(self, key: str, update: Callable[[Optional[Dict[str, float]]], Any]):
+        conn = self._conn()
+        # 立即获取写锁，其他进程的读改写在此之后串行执行
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT state FROM rate_limits WHERE key = ?", (key,)).fetchone()
+            new_state, result = update(json.loads(row[0]) if row else None)
+            if new_state is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_limits (key, state) VALUES (?, ?)",
+                    (key, json.dumps(new_state)),
+                )
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+class RateLimiter:
+    """单个提供商/模型的RPM和TPM令牌桶
+
+    Args:
+        key: 限流键（``提供商:模型``）
+        rpm: 每分钟请求数上限，为None时不限制请求数
+        tpm: 每分钟token数上限，为None时不限制token数
+        path: SQLite文件路径，为None时状态只保存在进程内
+        burst: 桶容量，以秒计的配额
+    """
+
+    def __init__(self, key: str, rpm: Optional[int] = None, tpm: Optional[int] = None,
+                 path: Optional[str] = None, burst: float = 10.0):
+        if rpm is not None and rpm <= 0:
+            raise ValueError("rpm必须大于0")
+        if tpm is not None and tpm <= 0:
+            raise ValueError("tpm必须大于0")
+        self.key = key
+        self.rates = {"requests": rpm / 60 if rpm else None, "tokens": tpm / 60 if tpm else None}
+        self.burst = burst
+        self.path = path
+        self._store = _SqliteStore(path) if path else _MemoryStore()
+        # 最近一次读到的速率比例，为1时成功的调用不需要再写入状态
+        self._scale = 1.0
+        self._wait = metrics.LLM_RATE_LIMIT_WAIT.labels(key)
+        self._limited = metrics.LLM_RATE_LIMITED.labels(key)
+
+    def _refill(self, state: Optional[Dict[str, float]], now: float) -> Dict[str, float]:
+        if state is None:
+            state = {"scale": 1.0, "blocked_until": 0.0, "updated": now}
+            for bucket, rate in self.rates.items():
+                if rate:
+                    state[bucket] = rate * self.burst
+        elapsed = max(0.0, now - state["updated"])
+        scale = state["scale"]
+        for bucket, rate in self.rates.items():
+            if rate:
+                capacity = max(1.0, rate * self.burst * scale)
+                state[bucket] = min(capacity, state.get(bucket, capacity) + elapsed * rate * scale)
+        state["updated"] = now
+        return state
+
+    def reserve(self, tokens: int, max_wait: Optional[float] = None) -> float:
+        """预约一次请求和 ``tokens`` 个token，返回调用前需要等待的秒数
+
+        等待时间超过 ``max_wait`` 时不预约，抛出 ``RateLimitTimeout``。
+        """
+        amounts = {"requests": 1.0, "tokens": float(tokens)}
+
+        def update(state):
+            now = time.time()
+            state = self._refill(state, now)
+            scale = state["scale"]
+            wait = max(0.0, state["blocked_until"] - now)
+            for bucket, rate in self.rates.items():
+                if rate:
+                    wait = max(wait, (amounts[bucket] - state[bucket]) / (rate * scale))
+            if max_wait is not None and wait > max_wait:
+                return None, (scale, wait, False)
+            for bucket, rate in self.rates.items():
+                if rate:
+                    state[bucket] -= amounts[bucket]
+            return state, (scale, wait, True)
+
+        self._scale, wait, reserved = self._store.transact(self.key, update)
+        if not reserved:
+            raise RateLimitTimeout(wait)
+        self._wait.observe(wait)
+        return wait
+
+    def settle(self, reserved: int, used: int) -> None:
+        """按实际token用量修正预约：多预约的退回，少预约的补扣"""
+        if not self.rates["tokens"] or used == reserved:
+            return
+
+        def update(state):
+            state = self._refill(state, time.time())
+            state["tokens"] += reserved - used
+            return state, None
+
+        self._store.transact(self.key, update)
+
+    def penalize(self, retry_after: Optional[float] = None) -> None:
+        """收到429：速率减半，清空余额，并在 ``retry_after`` 秒内暂停发送"""
+        self._limited.inc()
+
+        def update(state):
+            now = time.time()
+            state = self._refill(state, now)
+            state["scale"] = max(_MIN_SCALE, state["scale"] / 2)
+            pause = retry_after
+            if pause is None:
+                rate = self.rates["requests"] or 1.0
+                pause = 1.0 / (rate * state["scale"])
+            state["blocked_until"] = max(state["blocked_until"], now + pause)
+            for bucket, rate in self.rates.items():
+                if rate:
+                    state[bucket] = min(state[bucket], 0.0)
+            return state, state["scale"]
+
+        self._scale = self._store.transact(self.key, update)
+
+    def succeeded(self) -> None:
+        """调用成功：逐步恢复被429降低的速率"""
+        if self._scale >= 1.0:
+            return
+
+        def update(state):
+            state = self._refill(state, time.time())
+            state["scale"] = min(1.0, state["scale"] + _RECOVERY)
+            return state, state["scale"]
+
+        self._scale = self._store.transact(self.key, update)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回当前的速率比例、暂停剩余时间和各桶余额"""
+        def update(state):
+            now = time.time()
+            state = self._refill(state, now)
+            stats = {bucket: state[bucket] for bucket, rate in self.rates.items() if rate}
+            stats["scale"] = state["scale"]
+            stats["blocked_for"] = max(0.0, state["blocked_until"] - now)
+            return state, stats
+
+        return self._store.transact(self.key, update)
+
+
+def _used_tokens(response) -> Optional[int]:
+    usage = getattr(response, "usage_metadata", None)
+    if isinstance(usage, dict) and usage.get("total_tokens"):
+        return int(usage["total_tokens"])
+    return None
+
+
+class RateLimitedChatModel:
+    """调用前预约限流配额的模型包装器，接口与 ``ChatOpenAI`` 一致
+
+    等待配额的时间计入调用时间：超出运行剩余时间时抛出 ``RateLimitTimeout``
+    （``asyncio.TimeoutError`` 的子类）。
+
+    Args:
+        model: 被包装的模型
+        limiter: 该模型的限流器
+        max_tokens: 估算token时的输出预留
+    """
+
+    def __init__(self, model, limiter: RateLimiter, max_tokens: Optional[int] = None):
+        self.model = model
+        self.limiter = limiter
+        self.max_tokens = max_tokens
+
+    def bind_tools(self, tools):
+        return RateLimitedChatModel(self.model.bind_tools(tools), self.limiter, self.max_tokens)
+
+    def _estimate(self, inputs) -> int:
+        messages = inputs.get("messages", []) if isinstance(inputs, dict) else inputs
+        return estimate_tokens(messages, self.max_tokens)
+
+    def _reserve(self, inputs):
+        tokens = self._estimate(inputs)
+        return tokens, self.limiter.reserve(tokens, max_wait=get_time_budget())
+
+    def _finish(self, tokens: int, response) -> None:
+        self.limiter.succeeded()
+        used = _used_tokens(response)
+        if used is not None:
+            self.limiter.settle(tokens, used)
+
+    def _failed(self, error: BaseException) -> None:
+        if is_rate_limit_error(error):
+            self.limiter.penalize(retry_after(error))
+
+    async def _offload(self, func, *args):
+        # SQLite存储的事务（BEGIN IMMEDIATE可能等待其他进程释放锁）在线程池中执行，不阻塞事件循环
+        if self.limiter.path is None:
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args))
+
+    async def _areserve(self, inputs):
+        tokens = self._estimate(inputs)
+        # 剩余时间来自上下文变量，需在切换到线程池之前读取
+        return tokens, await self._offload(self.limiter.reserve, tokens, get_time_budget())
+
+    def invoke(self, inputs):
+        tokens, wait = self._reserve(inputs)
+        if wait:
+            time.sleep(wait)
+        try:
+            response = self.model.invoke(inputs)
+        except Exception as e:
+            self._failed(e)
+            raise
+        self._finish(tokens, response)
+        return response
+
+    async def ainvoke(self, inputs):
+        tokens, wait = await self._areserve(inputs)
+        if wait:
+            await asyncio.sleep(wait)
+        try:
+            ainvoke = getattr(self.model, "ainvoke", None)
+            if inspect.iscoroutinefunction(ainvoke):
+                response = await ainvoke(inputs)
+            else:
+                response = self.model.invoke(inputs)
+        except Exception as e:
+            await self._offload(self._failed, e)
+            raise
+        await self._offload(self._finish, tokens, response)
+        return response
+
+    def stream(self, inputs):
+        stream = getattr(self.model, "stream", None)
+        if not inspect.isgeneratorfunction(stream):
+            yield self.invoke(inputs)
+            return
+        tokens, wait = self._reserve(inputs)
+        if wait:
+            time.sleep(wait)
+        merged = None
+        try:
+            for chunk in stream(inputs):
+                merged = chunk if merged is None else merged + chunk
+                yield chunk
+        except Exception as e:
+            self._failed(e)
+            raise
+        self._finish(tokens, merged)
+
+    async def astream(self, inputs):
+        astream = getattr(self.model, "astream", None)
+        if not inspect.isasyncgenfunction(astream):
+            yield await self.ainvoke(inputs)
+            return
+        tokens, wait = await self._areserve(inputs)
+        if wait:
+            await asyncio.sleep(wait)
+        merged = None
+        try:
+            async for chunk in astream(inputs):
+                merged = chunk if merged is None else merged + chunk
+                yield chunk
+        except Exception as e:
+            await self._offload(self._failed, e)
+            raise
+        await self._offload(self._finish, tokens, merged)
+
+
+# 进程级限流器，按（键、RPM、TPM、路径）共享
+_LIMITERS: Dict[tuple, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(key: str, rpm: Optional[int] = None, tpm: Optional[int] = None,
+                     path: Optional[str] = None) -> RateLimiter:
+    """获取共享的限流器，相同参数返回同一个实例"""
+    cache_key = (key, rpm, tpm, os.path.abspath(path) if path else None)
+    with _limiters_lock:
+        limiter = _LIMITERS.get(cache_key)
+        if limiter is None:
+            limiter = _LIMITERS[cache_key] = RateLimiter(key, rpm, tpm, cache_key[3])
+        return limiter
@@ -0,0 +1,260 @@
+"""搜索后端模块
+
+为 ``search_web`` 工具提供可替换的搜索后端。默认实现是基于倒排索引和
+BM25打分的本地检索，分词对中日韩文字使用二元组（bigram），对拉丁字母和
+数字按词切分，适合以中文为主的查询。
+
+语料从JSONL文件加载（每行一个 ``{"text": ...}`` 对象），可以选择内存映射
+方式只在索引中保存行偏移量，命中后再按需读取原文。
+"""
+
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import threading
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+_TOKEN_PATTERN = re.compile(
+    r"([\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af]+)"
+    r"|([0-9a-z]+)"
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """把文本切分为检索词
+
+    中日韩文字连续片段切分为相邻二元组（单字片段保留单字），
+    拉丁字母和数字按连续字符切分并统一小写。
+
+    Args:
+        text: 待切分文本
+
+    Returns:
+        检索词列表（保留重复，用于计算词频）
+    """
+    tokens: List[str] = []
+    for cjk, word in _TOKEN_PATTERN.findall(text.casefold()):
+        if word:
+            tokens.append(word)
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+    return tokens
+
+
+class SearchBackend:
+    """搜索后端接口"""
+
+    def search(self, query: str, num_results: int = 3) -> List[str]:
+        """返回与查询最相关的文本片段，按相关度从高到低排序"""
+        raise NotImplementedError
+
+
+class _MemoryStore:
+    """在内存中保存文档原文"""
+
+    def __init__(self):
+        self._texts: List[str] = []
+
+    def add(self, text: str) -> None:
+        self._texts.append(text)
+
+    def get(self, doc_id: int) -> str:
+        return self._texts[doc_id]
+
+
+class _MmapStore:
+    """通过内存映射按行偏移量读取JSONL文档原文"""
+
+    def __init__(self, path: str, text_field: str):
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._offsets = array("Q")
+        self._text_field = text_field
+
+    def add_offset(self, offset: int) -> None:
+        self._offsets.append(offset)
+
+    def get(self, doc_id: int) -> str:
+        start = self._offsets[doc_id]
+        end = self._mmap.find(b"\n", start)
+        line = self._mmap[start:end if end != -1 else len(self._mmap)]
+        return json.loads(line)[self._text_field]
+
+    def close(self) -> None:
+        self._mmap.close()
+        self._file.close()
+
+
+class BM25SearchBackend(SearchBackend):
+    """基于倒排索引的BM25搜索后端
+
+    倒排表使用紧凑的 ``array`` 存储文档编号，构建完成后把词频换算为
+    该词对文档的BM25得分并按得分降序排列（impact-ordered）。查询时每个词
+    最多只遍历前 ``max_postings_per_term`` 条倒排项，因此高频词在数百万条
+    片段的语料上也不会拖慢查询；倒排表短于该上限时结果是精确的。
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, max_postings_per_term: int = 1000):
+        self.k1 = k1
+        self.b = b
+        self.max_postings_per_term = max_postings_per_term
+        # 构建阶段为 (文档编号, 词频)，_finalize 后为 (文档编号, BM25得分)
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._doc_lengths = array("I")
+        self._store = _MemoryStore()
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    # -- 构建 -------------------------------------------------------------
+
+    def _index(self, text: str) -> None:
+        doc_id = len(self._doc_lengths)
+        tokens = tokenize(text)
+        self._doc_lengths.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array("I"), array("I"))
+            postings[0].append(doc_id)
+            postings[1].append(tf)
+
+    def _finalize(self) -> None:
+        """把词频换算为BM25得分，并按得分降序重排倒排表"""
+        n = len(self._doc_lengths)
+        avgdl = (sum(self._doc_lengths) / n) if n else 0.0
+        k1 = self.k1
+        length_norm = [
+            k1 * (1 - self.b + self.b * (length / avgdl if avgdl else 0.0))
+            for length in self._doc_lengths
+        ]
+        for term, (docs, tfs) in self._postings.items():
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            impacts = sorted(
+                ((idf * tf * (k1 + 1) / (tf + length_norm[doc_id]), doc_id)
+                 for doc_id, tf in zip(docs, tfs)),
+                key=lambda item: (-item[0], item[1]),
+            )
+            self._postings[term] = (
+                array("I", (doc_id for _, doc_id in impacts)),
+                array("f", (score for score, _ in impacts)),
+            )
+
+    @classmethod
+    def from_texts(cls, texts: Iterable[str], **kwargs) -> "BM25SearchBackend":
+        """从文本序列构建索引（原文保存在内存中）"""
+        backend = cls(**kwargs)
+        for text in texts:
+            backend._store.add(text)
+            backend._index(text)
+        backend._finalize()
+        return backend
+
+    @classmethod
+    def from_jsonl(cls, path: str, text_field: str = "text", use_mmap: bool = True,
+                   **kwargs) -> "BM25SearchBackend":
+        """从JSONL语料文件构建索引
+
+        Args:
+            path: JSONL文件路径，每行一个JSON对象
+            text_field: 文本所在的字段名
+            use_mmap: 为True时只保存行偏移量，命中后通过内存映射读取原文
+
+        Returns:
+            构建好的搜索后端
+        """
+        backend = cls(**kwargs)
+        if use_mmap:
+            store = _MmapStore(path, text_field)
+            backend._store = store
+        with open(path, "rb") as f:
+            offset = 0
+            for raw in f:
+                line_offset, offset = offset, offset + len(raw)
+                if not raw.strip():
+                    continue
+                text = json.loads(raw)[text_field]
+                if use_mmap:
+                    store.add_offset(line_offset)
+                else:
+                    backend._store.add(text)
+                backend._index(text)
+        backend._finalize()
+        return backend
+
+    # -- 查询 -------------------------------------------------------------
+
+    def search(self, query: str, num_results: int = 3) -> List[str]:
+        if num_results <= 0:
+            return []
+        scores: Dict[int, float] = {}
+        limit = self.max_postings_per_term
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            docs, impacts = postings
+            if not scores:
+                scores = dict(zip(docs[:limit], impacts[:limit]))
+                continue
+            get = scores.get
+            for doc_id, impact in zip(docs[:limit], impacts[:limit]):
+                scores[doc_id] = get(doc_id, 0.0) + impact
+        if not scores:
+            return []
+        top = heapq.nlargest(num_results, scores.items(), key=lambda item: (item[1], -item[0]))
+        return [self._store.get(doc_id) for doc_id, _ in top]
+
+
+# 内置的示例语料，在未配置外部语料时使用
+DEFAULT_CORPUS = [
+    "人工智能（AI）是计算机科学的一个分支，致力于创建能够执行通常需要人类智能的任务的系统。",
+    "机器学习是人工智能的一个子集，通过算法让计算机从数据中学习模式。",
+    "深度学习使用神经网络来模拟人脑的工作方式，在图像识别和自然语言处理方面取得了重大突破。",
+    "Python是一种高级编程语言，以其简洁的语法和强大的功能而闻名。",
+    "Python广泛应用于数据科学、机器学习、Web开发和自动化脚本等领域。",
+    "Python拥有丰富的第三方库生态系统，如NumPy、Pandas、Django等。",
+    "LangChain是一个用于构建基于大型语言模型应用程序的框架。",
+    "LangGraph是LangChain生态系统的一部分，专门用于构建有状态的代理工作流。",
+    "LangChain提供了丰富的工具和组件，简化了LLM应用的开发过程。",
+]
+
+_backend: Optional[SearchBackend] = None
+_backend_lock = threading.Lock()
+
+
+def _load_default_backend() -> SearchBackend:
+    path = os.getenv("SEARCH_CORPUS_PATH")
+    if path:
+        use_mmap = os.getenv("SEARCH_CORPUS_MMAP", "true").lower() != "false"
+        return BM25SearchBackend.from_jsonl(path, use_mmap=use_mmap)
+    return BM25SearchBackend.from_texts(DEFAULT_CORPUS)
+
+
+def get_search_backend() -> SearchBackend:
+    """获取当前的搜索后端，首次调用时加载语料
+
+    设置了 ``SEARCH_CORPUS_PATH`` 环境变量时从该JSONL文件加载，
+    否则使用内置示例语料。
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _load_default_backend()
+    return _backend
+
+
+def set_search_backend(backend: Optional[SearchBackend]) -> None:
+    """替换搜索后端；传入None时下次使用会重新加载默认后端"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
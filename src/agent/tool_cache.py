@@ -0,0 +1,184 @@
+"""工具结果缓存模块
+
+为 ``@tool`` 工具函数提供带TTL的结果缓存：参数归一化后作为缓存键，
+并发的相同调用只执行一次（single-flight），并统计命中率等指标。
+"""
+
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+def normalize_text(value: Any) -> Any:
+    """文本参数归一化：去除首尾空白、合并连续空白并忽略大小写"""
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    return value
+
+
+def normalize_expression(value: Any) -> Any:
+    """表达式参数归一化：去除首尾空白并合并连续空白（保留空白分隔，``"1 2"`` 与 ``"12"`` 不同）"""
+    if isinstance(value, str):
+        return " ".join(value.split())
+    return value
+
+
+class ToolResultCache:
+    """单个工具的TTL + LRU结果缓存"""
+
+    def __init__(self, name: str, ttl: float = 300.0, maxsize: int = 1024):
+        if ttl <= 0:
+            raise ValueError("ttl必须大于0")
+        if maxsize <= 0:
+            raise ValueError("maxsize必须大于0")
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._inflight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """返回缓存结果，未命中时执行compute；相同键的并发调用共享同一次执行"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return value
+                del self._entries[key]
+                self._expirations += 1
+            future = self._inflight.get(key)
+            if future is not None:
+                self._coalesced += 1
+                leader = False
+            else:
+                future = self._inflight[key] = Future()
+                self._misses += 1
+                leader = True
+
+        if not leader:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as e:
+            # 异常不缓存，但要通知所有等待者
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+            self._inflight.pop(key, None)
+        future.set_result(value)
+        return value
+
+    def clear(self) -> None:
+        """清空缓存条目（不影响统计）"""
+        with self._lock:
+            self._entries.clear()
+
+    def reset_stats(self) -> None:
+        """重置统计计数"""
+        with self._lock:
+            self._hits = self._misses = self._coalesced = 0
+            self._evictions = self._expirations = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息"""
+        with self._lock:
+            calls = self._hits + self._misses + self._coalesced
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "coalesced": self._coalesced,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "hit_rate": ((self._hits + self._coalesced) / calls) if calls else 0.0,
+            }
+
+
+# 所有带缓存工具的注册表，用于汇总指标
+_TOOL_CACHES: Dict[str, ToolResultCache] = {}
+
+
+def cached_tool(
+    ttl: float = 300.0,
+    maxsize: int = 1024,
+    normalizers: Optional[Dict[str, Callable[[Any], Any]]] = None,
+    name: Optional[str] = None,
+):
+    """为工具函数添加结果缓存的装饰器，放在 ``@tool`` 下方使用
+
+    归一化后相同的调用共享同一个结果，因此被缓存的函数的返回值不应回显原始参数。
+
+    Args:
+        ttl: 缓存有效期（秒）
+        maxsize: 最多缓存的结果数量
+        normalizers: 参数名到归一化函数的映射；未指定的字符串参数仅合并空白
+        name: 统计信息中使用的名称，默认为函数名
+
+    Returns:
+        装饰器
+    """
+    normalizers = dict(normalizers or {})
+
+    def decorator(func):
+        signature = inspect.signature(func)
+        cache_name = name or func.__name__
+        cache = ToolResultCache(cache_name, ttl=ttl, maxsize=maxsize)
+
+        def make_key(args, kwargs) -> Hashable:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return tuple(
+                (name, normalizers.get(name, normalize_expression)(value))
+                for name, value in bound.arguments.items()
+            )
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = make_key(args, kwargs)
+            try:
+                hash(key)
+            except TypeError:
+                # 不可哈希的参数无法作为缓存键，直接执行
+                return func(*args, **kwargs)
+            return cache.get_or_compute(key, lambda: func(*args, **kwargs))
+
+        wrapper.cache = cache
+        _TOOL_CACHES[cache_name] = cache
+        return wrapper
+
+    return decorator
+
+
+def get_tool_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """获取所有带缓存工具的统计信息，按工具名索引"""
+    return {name: cache.stats() for name, cache in _TOOL_CACHES.items()}
+
+
+def clear_tool_caches() -> None:
+    """清空所有工具的结果缓存"""
+    for cache in _TOOL_CACHES.values():
+        cache.clear()
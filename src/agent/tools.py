@@ -5,9 +5,35 @@
 
 import json
 import requests
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 from langchain_core.tools import tool
 
+from .calculator import evaluate, evaluate_batch
+from .search import get_search_backend
+from .tool_cache import cached_tool, normalize_text, normalize_expression
+
+
+# 模拟的天气数据，按不区分大小写的城市名索引
+_WEATHER_DATA = {
+    "北京": "晴天，温度 15-25°C，微风",
+    "上海": "多云，温度 18-28°C，东南风",
+    "广州": "小雨，温度 20-30°C，南风",
+    "深圳": "晴天，温度 22-32°C，微风",
+    "Beijing": "Sunny, 15-25°C, light breeze",
+    "Shanghai": "Cloudy, 18-28°C, southeast wind",
+    "Guangzhou": "Light rain, 20-30°C, south wind",
+    "Shenzhen": "Sunny, 22-32°C, light breeze",
+}
+_WEATHER_INDEX = {city.casefold(): info for city, info in _WEATHER_DATA.items()}
+
+
+@cached_tool(ttl=600, maxsize=1024, normalizers={"city": normalize_text}, name="get_weather")
+def _lookup_weather(city: str) -> Optional[str]:
+    """查询城市的天气信息，未知城市返回None（结果不含城市名，拼写不同的相同城市共享结果）"""
+    # 这里是一个模拟的天气API调用
+    # 在实际应用中，你应该调用真实的天气API
+    return _WEATHER_INDEX.get(normalize_text(city))
+
 
 @tool
 def get_weather(city: str) -> str:
@@ -19,20 +45,18 @@ def get_weather(city: str) -> str:
     Returns:
         包含天气信息的字符串
     """
-    # 这里是一个模拟的天气API调用
-    # 在实际应用中，你应该调用真实的天气API
-    weather_data = {
-        "北京": "晴天，温度 15-25°C，微风",
-        "上海": "多云，温度 18-28°C，东南风",
-        "广州": "小雨，温度 20-30°C，南风",
-        "深圳": "晴天，温度 22-32°C，微风",
-        "Beijing": "Sunny, 15-25°C, light breeze",
-        "Shanghai": "Cloudy, 18-28°C, southeast wind",
-        "Guangzhou": "Light rain, 20-30°C, south wind",
-        "Shenzhen": "Sunny, 22-32°C, light breeze",
-    }
-    
-    return weather_data.get(city, f"抱歉，暂时无法获取{city}的天气信息。请检查城市名称是否正确。")
+    info = _lookup_weather(city)
+    if info is None:
+        return f"抱歉，暂时无法获取{city}的天气信息。请检查城市名称是否正确。"
+    return info
+
+
+@cached_tool(ttl=300, maxsize=2048, normalizers={"query": normalize_text}, name="search_web")
+def _search_cached(query: str, num_results: int) -> Tuple[str, ...]:
+    """检索搜索结果（结果不含查询词本身，写法不同的相同查询共享结果）"""
+    # 默认使用本地倒排索引（BM25）检索，可通过 agent.search.set_search_backend 替换
+    # 在实际应用中，你可以接入真实的搜索API（如Google Search API、Bing Search API等）
+    return tuple(get_search_backend().search(query, num_results)[:num_results])
 
 
 @tool
@@ -46,38 +70,25 @@ def search_web(query: str, num_results: int = 3) -> str:
     Returns:
         搜索结果的摘要字符串
     """
-    # 这里是一个模拟的搜索功能
-    # 在实际应用中，你应该集成真实的搜索API（如Google Search API、Bing Search API等）
-    
-    mock_results = {
-        "人工智能": [
-            "人工智能（AI）是计算机科学的一个分支，致力于创建能够执行通常需要人类智能的任务的系统。",
-            "机器学习是人工智能的一个子集，通过算法让计算机从数据中学习模式。",
-            "深度学习使用神经网络来模拟人脑的工作方式，在图像识别和自然语言处理方面取得了重大突破。"
-        ],
-        "Python编程": [
-            "Python是一种高级编程语言，以其简洁的语法和强大的功能而闻名。",
-            "Python广泛应用于数据科学、机器学习、Web开发和自动化脚本等领域。",
-            "Python拥有丰富的第三方库生态系统，如NumPy、Pandas、Django等。"
-        ],
-        "LangChain": [
-            "LangChain是一个用于构建基于大型语言模型应用程序的框架。",
-            "LangGraph是LangChain生态系统的一部分，专门用于构建有状态的代理工作流。",
-            "LangChain提供了丰富的工具和组件，简化了LLM应用的开发过程。"
-        ]
-    }
-    
-    # 简单的关键词匹配
-    results = []
-    for key, values in mock_results.items():
-        if key in query or any(word in query for word in key.split()):
-            results.extend(values[:num_results])
-            break
+    results = _search_cached(query, num_results)
     
     if not results:
-        results = [f"关于'{query}'的搜索结果：这是一个模拟搜索结果。在实际应用中，这里会显示真实的网络搜索结果。"]
+        results = (f"关于'{query}'的搜索结果：这是一个模拟搜索结果。在实际应用中，这里会显示真实的网络搜索结果。",)
     
-    return "\n\n".join(f"{i+1}. {result}" for i, result in enumerate(results[:num_results]))
+    return "\n\n".join(f"{i+1}. {result}" for i, result in enumerate(results))
+
+
+@cached_tool(ttl=3600, maxsize=4096, normalizers={"expression": normalize_expression}, name="calculate")
+def _calculate_cached(expression: str) -> Tuple[bool, str]:
+    """计算表达式，返回（是否成功, 结果或错误信息）
+
+    缓存的结果不包含表达式本身，写法不同的相同表达式共享结果，回显时使用本次调用的参数。
+    """
+    try:
+        # 表达式被解析为AST并编译缓存，只允许基本的数学运算，且限制数值规模
+        return True, str(evaluate(expression))
+    except Exception as e:
+        return False, str(e)
 
 
 @tool
@@ -90,35 +101,29 @@ def calculate(expression: str) -> str:
     Returns:
         计算结果的字符串
     """
-    try:
-        # 为了安全起见，只允许基本的数学运算
-        import math
-        
-        # 定义允许的函数和常量
-        allowed_names = {
-            "abs": abs,
-            "round": round,
-            "min": min,
-            "max": max,
-            "sum": sum,
-            "pow": pow,
-            "sqrt": math.sqrt,
-            "sin": math.sin,
-            "cos": math.cos,
-            "tan": math.tan,
-            "log": math.log,
-            "log10": math.log10,
-            "exp": math.exp,
-            "pi": math.pi,
-            "e": math.e,
-        }
-        
-        # 安全地评估表达式
-        result = eval(expression, {"__builtins__": {}}, allowed_names)
-        return f"计算结果：{expression} = {result}"
+    ok, text = _calculate_cached(expression)
+    if ok:
+        return f"计算结果：{expression} = {text}"
+    return f"计算错误：{text}。请检查表达式是否正确。"
+
+
+@tool
+def calculate_batch(expressions: List[str]) -> str:
+    """批量执行数学计算
+    
+    Args:
+        expressions: 数学表达式列表，例如 ["2 + 3", "sqrt(16)"]
         
-    except Exception as e:
-        return f"计算错误：{str(e)}。请检查表达式是否正确。"
+    Returns:
+        每行一个表达式的计算结果
+    """
+    lines = []
+    for expression, result in zip(expressions, evaluate_batch(expressions)):
+        if isinstance(result, Exception):
+            lines.append(f"计算错误：{expression}：{str(result)}")
+        else:
+            lines.append(f"计算结果：{expression} = {result}")
+    return "\n".join(lines)
 
 
 # 工具列表，用于在图中注册
@@ -126,6 +131,7 @@ AVAILABLE_TOOLS = {
     "weather": get_weather,
     "search": search_web,
     "calculator": calculate,
+    "calculator_batch": calculate_batch,
 }
 
 
@@ -148,5 +154,6 @@ def get_enabled_tools(config) -> list:
         
     if config.enable_calculator_tool:
         tools.append(calculate)
+        tools.append(calculate_batch)
     
     return tools
\ No newline at end of file
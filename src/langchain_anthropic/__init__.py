@@ -5,3 +5,5 @@ class ChatAnthropic:
         return self
     def invoke(self, inputs):
         raise NotImplementedError("ChatAnthropic.invoke should be mocked in tests")
+    async def ainvoke(self, inputs):
+        raise NotImplementedError("ChatAnthropic.ainvoke should be mocked in tests")
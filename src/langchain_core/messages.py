@@ -10,4 +10,21 @@ class AIMessage(BaseMessage):
     pass
 
 class ToolMessage(BaseMessage):
-    pass
+    def __init__(self, content=None, tool_call_id=None, name=None, status="success",
+                 **kwargs):
+        super().__init__(content, **kwargs)
+        self.tool_call_id = tool_call_id
+        self.name = name
+        self.status = status
+
+class AIMessageChunk(AIMessage):
+    """A piece of a streamed AI message; chunks concatenate with ``+``."""
+
+    def __add__(self, other):
+        return AIMessageChunk(
+            content=(self.content or "") + (other.content or ""),
+            tool_calls=list(self.tool_calls) + list(other.tool_calls),
+        )
+
+    def to_message(self):
+        return AIMessage(content=self.content or "", tool_calls=list(self.tool_calls))
@@ -1,3 +1,7 @@
+import asyncio
+import inspect
+
+
 class ChatPromptTemplate:
     def __init__(self, messages):
         self.messages = messages
@@ -12,6 +16,26 @@ class ChatPromptTemplate:
                 self.llm = llm
             def invoke(self, inputs):
                 return self.llm.invoke(inputs)
+            async def ainvoke(self, inputs):
+                ainvoke = getattr(self.llm, "ainvoke", None)
+                if inspect.iscoroutinefunction(ainvoke):
+                    return await ainvoke(inputs)
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(None, self.llm.invoke, inputs)
+            def stream(self, inputs):
+                stream = getattr(self.llm, "stream", None)
+                if inspect.isgeneratorfunction(stream):
+                    yield from stream(inputs)
+                else:
+                    # Models without native streaming yield one complete chunk.
+                    yield self.llm.invoke(inputs)
+            async def astream(self, inputs):
+                astream = getattr(self.llm, "astream", None)
+                if inspect.isasyncgenfunction(astream):
+                    async for chunk in astream(inputs):
+                        yield chunk
+                else:
+                    yield await self.ainvoke(inputs)
         return Chain(llm)
 
 class MessagesPlaceholder:
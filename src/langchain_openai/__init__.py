@@ -5,3 +5,5 @@ class ChatOpenAI:
         return self
     def invoke(self, inputs):
         raise NotImplementedError("ChatOpenAI.invoke should be mocked in tests")
+    async def ainvoke(self, inputs):
+        raise NotImplementedError("ChatOpenAI.ainvoke should be mocked in tests")
@@ -0,0 +1,10 @@
+from .base import BaseCheckpointSaver, CheckpointTuple, get_thread_id
+from .memory import MemorySaver, InMemorySaver
+
+__all__ = [
+    "BaseCheckpointSaver",
+    "CheckpointTuple",
+    "get_thread_id",
+    "MemorySaver",
+    "InMemorySaver",
+]
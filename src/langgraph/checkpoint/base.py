@@ -0,0 +1,68 @@
+import asyncio
+from typing import Any, Dict, List, NamedTuple, Optional
+
+
+def get_thread_id(config):
+    """Extract ``configurable.thread_id`` from a run config, if any."""
+    if not config:
+        return None
+    return (config.get("configurable") or {}).get("thread_id")
+
+
+class CheckpointTuple(NamedTuple):
+    """What is stored for a thread: the latest snapshot plus the writes after it.
+
+    The state itself is only reconstructed by the reader (the engine replays
+    ``writes`` on top of ``snapshot`` through the graph's reducers).
+    """
+
+    snapshot: Optional[Dict[str, Any]]
+    writes: List[Dict[str, Any]]
+
+
+class BaseCheckpointSaver:
+    """Interface for persisting graph state per ``thread_id``.
+
+    State is stored as an append-only log of per-step writes (the update each
+    node returned), periodically rolled into a snapshot by ``put``. Writes may
+    be buffered; the engine calls ``flush`` once a run finishes so backends can
+    batch a whole run into one transaction.
+    """
+
+    # Number of logged writes after which the engine stores a fresh snapshot.
+    compact_every = 50
+
+    def get_tuple(self, config) -> Optional[CheckpointTuple]:
+        """Return the snapshot and pending writes for the thread, or None."""
+        raise NotImplementedError
+
+    def put_writes(self, config, writes, metadata=None):
+        """Append the update produced by one step to the thread's log."""
+        raise NotImplementedError
+
+    def put(self, config, values, metadata=None):
+        """Store ``values`` as the thread's snapshot, superseding its log."""
+        raise NotImplementedError
+
+    def flush(self):
+        """Persist any buffered writes."""
+
+    def delete_thread(self, thread_id):
+        """Remove everything saved for ``thread_id``."""
+        raise NotImplementedError
+
+    async def aget_tuple(self, config):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.get_tuple, config)
+
+    async def aput_writes(self, config, writes, metadata=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.put_writes, config, writes, metadata)
+
+    async def aput(self, config, values, metadata=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.put, config, values, metadata)
+
+    async def aflush(self):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.flush)
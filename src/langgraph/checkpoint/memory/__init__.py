@@ -1,2 +1,103 @@
-class MemorySaver:
-    pass
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from ..base import BaseCheckpointSaver, CheckpointTuple, get_thread_id
+
+
+class MemorySaver(BaseCheckpointSaver):
+    """Keeps thread state in process memory; lost on restart.
+
+    Memory is bounded: at most ``max_threads`` threads are kept (the least
+    recently used one is evicted first) and threads untouched for ``ttl``
+    seconds are dropped. ``None`` disables the respective bound.
+    """
+
+    def __init__(self, max_threads: Optional[int] = 1024, ttl: Optional[float] = None):
+        if max_threads is not None and max_threads <= 0:
+            raise ValueError("max_threads must be positive")
+        if ttl is not None and ttl <= 0:
+            raise ValueError("ttl must be positive")
+        self.max_threads = max_threads
+        self.ttl = ttl
+        # thread_id -> {"snapshot", "writes", "touched"}, least recently used first
+        self._threads = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        # Caller holds self._lock. Entries are in access order, so the expired
+        # ones are all at the front.
+        if self.ttl is None:
+            return
+        while self._threads:
+            entry = next(iter(self._threads.values()))
+            if now - entry["touched"] < self.ttl:
+                break
+            self._threads.popitem(last=False)
+
+    def _entry(self, thread_id, now, create=False):
+        # Caller holds self._lock.
+        self._expire(now)
+        entry = self._threads.get(thread_id)
+        if entry is None:
+            if not create:
+                return None
+            entry = self._threads[thread_id] = {"snapshot": None, "writes": []}
+            if self.max_threads is not None and len(self._threads) > self.max_threads:
+                self._threads.popitem(last=False)
+        self._threads.move_to_end(thread_id)
+        entry["touched"] = now
+        return entry
+
+    def get_tuple(self, config):
+        thread_id = get_thread_id(config)
+        with self._lock:
+            entry = self._entry(thread_id, time.monotonic())
+            if entry is None:
+                return None
+            return CheckpointTuple(entry["snapshot"], list(entry["writes"]))
+
+    def put_writes(self, config, writes, metadata=None):
+        thread_id = get_thread_id(config)
+        if thread_id is None:
+            return
+        with self._lock:
+            entry = self._entry(thread_id, time.monotonic(), create=True)
+            entry["writes"].append(dict(writes))
+
+    def put(self, config, values, metadata=None):
+        thread_id = get_thread_id(config)
+        if thread_id is None:
+            return
+        # Reducers may extend the run's lists in place, so copy them too.
+        snapshot = {key: list(value) if isinstance(value, list) else value
+                    for key, value in values.items()}
+        with self._lock:
+            entry = self._entry(thread_id, time.monotonic(), create=True)
+            entry["snapshot"] = snapshot
+            entry["writes"] = []
+
+    def delete_thread(self, thread_id):
+        with self._lock:
+            self._threads.pop(thread_id, None)
+
+    def __len__(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            return len(self._threads)
+
+    async def aget_tuple(self, config):
+        return self.get_tuple(config)
+
+    async def aput_writes(self, config, writes, metadata=None):
+        return self.put_writes(config, writes, metadata)
+
+    async def aput(self, config, values, metadata=None):
+        return self.put(config, values, metadata)
+
+    async def aflush(self):
+        return self.flush()
+
+
+InMemorySaver = MemorySaver
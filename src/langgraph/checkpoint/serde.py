@@ -0,0 +1,28 @@
+import json
+
+from langchain_core import messages as _messages
+
+_MESSAGE_KEY = "__message__"
+
+
+class JsonSerializer:
+    """JSON serializer that round-trips ``langchain_core`` message objects."""
+
+    def dumps(self, obj):
+        return json.dumps(obj, default=self._default, ensure_ascii=False)
+
+    def loads(self, data):
+        return json.loads(data, object_hook=self._object_hook)
+
+    def _default(self, obj):
+        if isinstance(obj, _messages.BaseMessage):
+            return {_MESSAGE_KEY: type(obj).__name__, "data": vars(obj)}
+        raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+    def _object_hook(self, obj):
+        if _MESSAGE_KEY in obj:
+            cls = getattr(_messages, obj[_MESSAGE_KEY])
+            message = cls.__new__(cls)
+            message.__dict__.update(obj["data"])
+            return message
+        return obj
@@ -0,0 +1,222 @@
+import sqlite3
+import threading
+import time
+
+from ..base import BaseCheckpointSaver, CheckpointTuple, get_thread_id
+from ..serde import JsonSerializer
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS checkpoints (
+        thread_id TEXT PRIMARY KEY,
+        step INTEGER NOT NULL,
+        state TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS writes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        thread_id TEXT NOT NULL,
+        data TEXT NOT NULL,
+        created_at REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS writes_thread_seq ON writes (thread_id, seq)",
+)
+
+
+class SqliteSaver(BaseCheckpointSaver):
+    """Persists thread state in a SQLite database running in WAL mode.
+
+    Every step appends its update to the ``writes`` log, so a save costs
+    O(new messages). ``put`` rolls the log into a snapshot row in
+    ``checkpoints`` (whose ``step`` is the last folded write ``seq``) and
+    drops the folded writes, so a reader only replays a short tail.
+
+    WAL lets any number of readers (threads or worker processes) proceed while
+    a writer commits. Each thread gets its own connection. Writes are buffered
+    and committed in a single transaction by ``flush``.
+
+    Flushes are serialized from taking the buffer through the commit, so the
+    snapshots of a later batch never overtake the writes of an earlier one.
+    A batch being committed is in neither the buffer nor the database, so
+    ``get_tuple`` waits for it; ``_flushes`` works like a sequence lock
+    (odd while a batch is in flight) to detect a flush racing the read.
+    """
+
+    def __init__(self, path, serde=None, busy_timeout=5.0, max_pending=1024,
+                 compact_every=None):
+        self.path = path
+        self.serde = serde or JsonSerializer()
+        self.busy_timeout = busy_timeout
+        self.max_pending = max_pending
+        if compact_every is not None:
+            self.compact_every = compact_every
+        self._local = threading.local()
+        self._pending_writes = []
+        self._pending_snapshots = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flushes = 0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        for statement in _SCHEMA:
+            conn.execute(statement)
+        conn.commit()
+
+    @classmethod
+    def from_conn_string(cls, path, **kwargs):
+        return cls(path, **kwargs)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=self.busy_timeout, check_same_thread=False
+            )
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_tuple(self, config):
+        thread_id = get_thread_id(config)
+        if thread_id is None:
+            return None
+        while True:
+            with self._lock:
+                flushes = self._flushes
+                pending_snapshot = self._pending_snapshots.get(thread_id)
+                pending = [data for tid, data in self._pending_writes if tid == thread_id]
+            if flushes % 2:
+                # Wait for the in-flight batch to land in the database.
+                with self._flush_lock:
+                    pass
+                continue
+            if pending_snapshot is not None:
+                # Everything up to the buffered snapshot is already folded into it.
+                state, folded = pending_snapshot
+                return CheckpointTuple(
+                    self.serde.loads(state),
+                    [self.serde.loads(data) for data in pending[folded:]],
+                )
+            snapshot, writes = self._read(thread_id)
+            with self._lock:
+                if self._flushes == flushes:
+                    break
+            # A flush started meanwhile; the buffered writes may now be in the
+            # rows just read as well, so read again.
+        writes.extend(self.serde.loads(data) for data in pending)
+        if snapshot is None and not writes:
+            return None
+        return CheckpointTuple(snapshot, writes)
+
+    def _read(self, thread_id):
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT step, state FROM checkpoints WHERE thread_id = ?", (thread_id,)
+        ).fetchone()
+        last_seq, snapshot = (row[0], self.serde.loads(row[1])) if row else (0, None)
+        writes = [
+            self.serde.loads(data)
+            for (data,) in conn.execute(
+                "SELECT data FROM writes WHERE thread_id = ? AND seq > ? ORDER BY seq",
+                (thread_id, last_seq),
+            )
+        ]
+        return snapshot, writes
+
+    def put_writes(self, config, writes, metadata=None):
+        thread_id = get_thread_id(config)
+        if thread_id is None:
+            return
+        data = self.serde.dumps(writes)
+        with self._lock:
+            self._pending_writes.append((thread_id, data))
+            overflow = len(self._pending_writes) >= self.max_pending
+        if overflow:
+            self.flush()
+
+    def put(self, config, values, metadata=None):
+        thread_id = get_thread_id(config)
+        if thread_id is None:
+            return
+        state = self.serde.dumps(values)
+        with self._lock:
+            folded = sum(1 for tid, _ in self._pending_writes if tid == thread_id)
+            self._pending_snapshots[thread_id] = (state, folded)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                writes, self._pending_writes = self._pending_writes, []
+                snapshots, self._pending_snapshots = self._pending_snapshots, {}
+                if not writes and not snapshots:
+                    return
+                self._flushes += 1
+            committed = False
+            try:
+                self._commit(writes, snapshots)
+                committed = True
+            finally:
+                with self._lock:
+                    if not committed:
+                        self._pending_writes[:0] = writes
+                        for thread_id, entry in snapshots.items():
+                            self._pending_snapshots.setdefault(thread_id, entry)
+                    self._flushes += 1
+
+    def _commit(self, writes, snapshots):
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO writes (thread_id, data, created_at) VALUES (?, ?, ?)",
+                [(thread_id, data, now) for thread_id, data in writes],
+            )
+            for thread_id, (state, folded) in snapshots.items():
+                self._store_snapshot(conn, thread_id, state, folded, writes, now)
+
+    def _store_snapshot(self, conn, thread_id, state, folded, writes, now):
+        # The snapshot covers everything committed before this batch plus the
+        # thread's first ``folded`` writes in it; later writes stay in the log.
+        unfolded = sum(1 for tid, _ in writes if tid == thread_id) - folded
+        seqs = [
+            seq for (seq,) in conn.execute(
+                "SELECT seq FROM writes WHERE thread_id = ? ORDER BY seq DESC LIMIT ?",
+                (thread_id, unfolded + 1),
+            )
+        ]
+        last_seq = seqs[unfolded] if len(seqs) > unfolded else 0
+        conn.execute(
+            "INSERT INTO checkpoints (thread_id, step, state, updated_at) "
+            "VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(thread_id) DO UPDATE SET "
+            "step = excluded.step, state = excluded.state, "
+            "updated_at = excluded.updated_at",
+            (thread_id, last_seq, state, now),
+        )
+        conn.execute(
+            "DELETE FROM writes WHERE thread_id = ? AND seq <= ?", (thread_id, last_seq)
+        )
+
+    def delete_thread(self, thread_id):
+        # Hold the flush lock so an in-flight batch cannot re-add the thread.
+        with self._flush_lock:
+            with self._lock:
+                self._pending_writes = [
+                    entry for entry in self._pending_writes if entry[0] != thread_id
+                ]
+                self._pending_snapshots.pop(thread_id, None)
+            conn = self._conn()
+            with conn:
+                conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+                conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+
+    def close(self):
+        self.flush()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1,62 @@
+import time
+from contextvars import ContextVar
+
+# Set by App.stream/astream for the duration of a streamed run.
+_stream_var = ContextVar("langgraph_stream", default=None)
+# Name of the node currently executing.
+_node_var = ContextVar("langgraph_node", default=None)
+# Absolute ``time.monotonic()`` deadline of the run executing the current node.
+_deadline_var = ContextVar("langgraph_deadline", default=None)
+
+
+class StreamContext:
+    def __init__(self, modes, emit):
+        self.modes = modes
+        self.emit = emit
+
+
+def _noop(payload):
+    return None
+
+
+def get_stream_writer():
+    """Return a callable that emits ``custom`` stream events (a no-op otherwise)."""
+    stream = _stream_var.get()
+    if stream is None or "custom" not in stream.modes:
+        return _noop
+    return lambda payload: stream.emit("custom", payload)
+
+
+def get_message_writer():
+    """Return a callable emitting LLM message chunks, or None if nobody listens.
+
+    Nodes use this to decide whether to call the model in streaming mode.
+    """
+    stream = _stream_var.get()
+    if stream is None or "messages" not in stream.modes:
+        return None
+    metadata = {"langgraph_node": _node_var.get()}
+    return lambda chunk: stream.emit("messages", (chunk, metadata))
+
+
+def get_current_node():
+    """Return the name of the node currently executing, if any."""
+    return _node_var.get()
+
+
+def get_deadline():
+    """Return the current run's deadline (a ``time.monotonic()`` value) or None."""
+    return _deadline_var.get()
+
+
+def get_time_budget(timeout=None):
+    """Return how long a call made from a node may take, in seconds.
+
+    ``timeout`` is the call's own limit; it is capped by the time left before
+    the run's deadline. Returns None when neither applies, never less than 0.
+    """
+    deadline = _deadline_var.get()
+    if deadline is None:
+        return timeout
+    remaining = max(0.0, deadline - time.monotonic())
+    return remaining if timeout is None else min(timeout, remaining)
@@ -0,0 +1,18 @@
+class GraphRunLimitError(Exception):
+    """Base class for runs stopped by a limit; ``state`` holds the partial state."""
+
+    def __init__(self, message, state=None, step=0):
+        super().__init__(message)
+        self.state = state
+        self.step = step
+
+
+class GraphRecursionError(GraphRunLimitError, RecursionError):
+    """The run executed ``recursion_limit`` steps without reaching END.
+
+    Set ``config["recursion_limit"]`` to allow longer runs.
+    """
+
+
+class GraphTimeoutError(GraphRunLimitError, TimeoutError):
+    """The run passed its ``config["deadline"]`` / ``config["timeout"]``."""
@@ -1,2 +1,2 @@
 from .state_graph import StateGraph, START, END
-from .message import add_messages
+from .message import add_messages, extend_in_place
@@ -1,2 +1,26 @@
-def add_messages(messages):
-    return messages
+def add_messages(left, right):
+    """Reducer that appends new messages to the existing list."""
+    if left is None:
+        left = []
+    if right is None:
+        return list(left)
+    if not isinstance(right, (list, tuple)):
+        right = [right]
+    return list(left) + list(right)
+
+
+def extend_in_place(left, right):
+    """Reducer that appends new items to the existing list without copying it.
+
+    The engine gives every run its own copies of the lists in its state, so
+    extending them in place is safe inside a graph; a step then costs time
+    proportional to the new items instead of the whole history.
+    """
+    if left is None:
+        left = []
+    if right is None:
+        return left
+    if not isinstance(right, (list, tuple)):
+        right = [right]
+    left.extend(right)
+    return left
@@ -1,8 +1,208 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+import os
+import queue
+import threading
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.messages import ToolMessage
+
+from ..checkpoint.base import get_thread_id
+from ..config import StreamContext, _deadline_var, _node_var, _stream_var
+from ..errors import GraphRecursionError, GraphTimeoutError
+from ..tracing import CallbackManager
+
 START = "start"
 END = "end"
 
+_executor = None
+_executor_lock = threading.Lock()
+
+DEFAULT_RECURSION_LIMIT = int(os.getenv("LANGGRAPH_RECURSION_LIMIT", "25"))
+
+
+def get_executor():
+    """Return the shared, bounded thread pool used to offload sync nodes."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                max_workers = int(os.getenv("LANGGRAPH_MAX_WORKERS", "32"))
+                _executor = ThreadPoolExecutor(
+                    max_workers=max_workers, thread_name_prefix="langgraph"
+                )
+    return _executor
+
+
+def _get_async_callable(func):
+    """Return the coroutine function to await for ``func``, or None if it is sync.
+
+    A node may be a coroutine function, an object with an async ``__call__``,
+    or a sync callable exposing its async twin through an ``afunc`` attribute.
+    """
+    afunc = getattr(func, "afunc", None)
+    if afunc is not None:
+        return afunc
+    if inspect.iscoroutinefunction(func):
+        return func
+    if inspect.iscoroutinefunction(getattr(func, "__call__", None)):
+        return func
+    return None
+
+
+def _call_sync(func, *args):
+    """Call ``func`` from sync code, driving it to completion if it is async."""
+    if getattr(func, "afunc", None) is None and _get_async_callable(func) is not None:
+        return asyncio.run(func(*args))
+    return func(*args)
+
+
+def _get_reducers(state_schema):
+    """Collect ``Annotated[type, reducer]`` reducers from a state schema."""
+    if state_schema is None:
+        return {}
+    try:
+        hints = typing.get_type_hints(state_schema, include_extras=True)
+    except Exception:
+        return {}
+    reducers = {}
+    for key, hint in hints.items():
+        for meta in getattr(hint, "__metadata__", ()):
+            if callable(meta):
+                reducers[key] = meta
+                break
+    return reducers
+
+
+_STREAM_MODES = ("updates", "values", "messages", "custom")
+
+
+def _stream_modes(stream_mode):
+    single = isinstance(stream_mode, str)
+    modes = (stream_mode,) if single else tuple(stream_mode)
+    for mode in modes:
+        if mode not in _STREAM_MODES:
+            raise ValueError(f"Unknown stream_mode {mode!r}, expected one of {_STREAM_MODES}")
+    return frozenset(modes), single
+
+
+def _snapshot(values):
+    """Copy of ``values`` that later in-place reducer updates do not reach."""
+    return {key: list(value) if isinstance(value, list) else value
+            for key, value in values.items()}
+
+
+class _RunLimits:
+    """Step and wall-clock limits of one run, read from its config.
+
+    ``recursion_limit`` caps the number of node executions. ``deadline`` is an
+    absolute ``time.monotonic()`` value; ``timeout`` (seconds) is converted to
+    one when the run starts, and the earliest of those and the deadline of an
+    enclosing run (when invoked from inside a node) wins.
+    """
+
+    __slots__ = ("recursion_limit", "deadline")
+
+    def __init__(self, config):
+        config = config or {}
+        self.recursion_limit = config.get("recursion_limit") or DEFAULT_RECURSION_LIMIT
+        deadlines = [config.get("deadline"), _deadline_var.get()]
+        timeout = config.get("timeout")
+        if timeout is not None:
+            deadlines.append(time.monotonic() + timeout)
+        deadlines = [d for d in deadlines if d is not None]
+        self.deadline = min(deadlines) if deadlines else None
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def check(self, step, state):
+        if step >= self.recursion_limit:
+            raise GraphRecursionError(
+                f"Recursion limit of {self.recursion_limit} reached "
+                "without hitting a stop condition",
+                state=_snapshot(state), step=step,
+            )
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise self.timeout_error(step, state)
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def enter(self):
+        """Expose the deadline to the node about to run (see ``get_time_budget``)."""
+        if self.deadline is None:
+            return None
+        return _deadline_var.set(self.deadline)
+
+    def exit(self, token):
+        if token is not None:
+            _deadline_var.reset(token)
+
+    def raise_if_expired(self, error, step, state):
+        """Report a node's own timeout past the run deadline as the run timing out."""
+        if (isinstance(error, (TimeoutError, asyncio.TimeoutError))
+                and not isinstance(error, GraphTimeoutError) and self.expired()):
+            raise self.timeout_error(step, state) from error
+
+    def timeout_error(self, step, state):
+        return GraphTimeoutError(
+            f"Run deadline exceeded after {step} steps", state=_snapshot(state), step=step
+        )
+
+
+def _dangling_tool_calls(state):
+    """Return the tool calls of the last AI message that have no ToolMessage yet."""
+    messages = state.get("messages")
+    if not isinstance(messages, list):
+        return []
+    answered = set()
+    for message in reversed(messages):
+        if isinstance(message, ToolMessage):
+            answered.add(message.tool_call_id)
+            continue
+        calls = getattr(message, "tool_calls", None) or []
+        return [call for call in calls if call.get("id") not in answered]
+    return []
+
+
+def _abort_update(state, error):
+    """Error ToolMessages answering the calls an aborted run left open.
+
+    Persisting a thread that ends in unanswered tool calls would make the
+    next turn on it invalid for real providers, so an aborted run closes them.
+    """
+    calls = _dangling_tool_calls(state)
+    if not calls:
+        return None
+    reason = f"{type(error).__name__}: {error}" if error is not None else "run cancelled"
+    return {"messages": [
+        ToolMessage(
+            content=f"Error: tool '{call.get('name')}' not run, {reason}",
+            tool_call_id=call.get("id"),
+            name=call.get("name"),
+            status="error",
+        )
+        for call in calls
+    ]}
+
+
+class _StreamError:
+    def __init__(self, error):
+        self.error = error
+
+
 class StateGraph:
     def __init__(self, state_schema=None):
+        self.state_schema = state_schema
+        self.reducers = _get_reducers(state_schema)
         self.nodes = {}
         self.edges = {}
         self.cond_edges = {}
@@ -16,34 +216,368 @@ class StateGraph:
     def add_conditional_edges(self, src, cond_fn, mapping):
         self.cond_edges[src] = (cond_fn, mapping)
 
-    def compile(self, checkpointer=None):
-        graph = self
-        class App:
-            def __init__(self, graph):
-                self._graph = graph
-            def get_graph(self):
-                return self._graph
-            def _run(self, state):
-                current = START
-                while True:
-                    if current == START:
-                        current = graph.edges.get(START)
-                        continue
-                    func = graph.nodes[current]
-                    res = func(state)
-                    if res:
-                        state.update(res)
-                    if current in graph.cond_edges:
-                        cond_fn, mapping = graph.cond_edges[current]
-                        nxt = mapping.get(cond_fn(state), END)
+    def compile(self, checkpointer=None, executor=None, callbacks=None):
+        return App(self, checkpointer=checkpointer, executor=executor, callbacks=callbacks)
+
+
+class App:
+    def __init__(self, graph, checkpointer=None, executor=None, callbacks=None):
+        self._graph = graph
+        self.checkpointer = checkpointer
+        self._executor = executor
+        self.callbacks = list(callbacks or [])
+
+    def add_callback(self, callback):
+        """Attach a ``GraphCallback`` to every future run of this graph."""
+        self.callbacks = self.callbacks + [callback]
+
+    def remove_callback(self, callback):
+        self.callbacks = [cb for cb in self.callbacks if cb is not callback]
+
+    def _hooks(self, config):
+        callbacks = self.callbacks
+        extra = (config or {}).get("callbacks")
+        if extra:
+            callbacks = callbacks + list(extra)
+        return CallbackManager(callbacks) if callbacks else None
+
+    @property
+    def executor(self):
+        return self._executor or get_executor()
+
+    def get_graph(self):
+        return self._graph
+
+    def _next(self, current, branch=None):
+        graph = self._graph
+        if current in graph.cond_edges:
+            _, mapping = graph.cond_edges[current]
+            return mapping.get(branch, END)
+        return graph.edges.get(current, END)
+
+    def _apply(self, state, update):
+        reducers = self._graph.reducers
+        for key, value in update.items():
+            reducer = reducers.get(key)
+            if reducer is not None and key in state:
+                state[key] = reducer(state[key], value)
+            elif reducer is not None and isinstance(value, list):
+                # The run owns its lists; reducers may extend them in place.
+                state[key] = list(value)
+            else:
+                state[key] = value
+
+    def _restore(self, checkpoint):
+        if checkpoint is None:
+            return None, 0
+        values = _snapshot(checkpoint.snapshot or {})
+        for writes in checkpoint.writes:
+            self._apply(values, writes)
+        return values, len(checkpoint.writes)
+
+    def _merge_input(self, saved, input):
+        if saved is None:
+            saved = {}
+        self._apply(saved, input)
+        return saved
+
+    def _should_checkpoint(self, config):
+        return self.checkpointer is not None and get_thread_id(config) is not None
+
+    def _needs_compaction(self, logged):
+        return logged >= self.checkpointer.compact_every
+
+    def _prepare(self, input, config):
+        checkpoint = self._should_checkpoint(config)
+        saved, logged = self._restore(
+            self.checkpointer.get_tuple(config) if checkpoint else None
+        )
+        return self._merge_input(saved, input), logged
+
+    async def _aprepare(self, input, config):
+        checkpoint = self._should_checkpoint(config)
+        saved, logged = self._restore(
+            await self.checkpointer.aget_tuple(config) if checkpoint else None
+        )
+        return self._merge_input(saved, input), logged
+
+    def _iter_steps(self, input, state, logged, config=None):
+        """Run the graph on ``state``, yielding ``(node, update)`` after each step."""
+        graph = self._graph
+        checkpoint = self._should_checkpoint(config)
+        limits = _RunLimits(config)
+        hooks = self._hooks(config)
+        run = hooks.run_start(config) if hooks else None
+        error = None
+        step = 0
+        finished = False
+        try:
+            if checkpoint:
+                self.checkpointer.put_writes(config, input, {"step": 0, "node": START})
+                logged += 1
+            current = graph.edges.get(START)
+            while current is not None and current != END:
+                # Sync nodes cannot be interrupted, so limits apply between steps.
+                limits.check(step, state)
+                event = hooks.node_start(run, current, step + 1, state) if hooks else None
+                token = _node_var.set(current)
+                deadline_token = limits.enter()
+                try:
+                    res = _call_sync(graph.nodes[current], state)
+                except BaseException as e:
+                    if hooks:
+                        hooks.node_end(event, error=e)
+                    limits.raise_if_expired(e, step, state)
+                    raise
+                finally:
+                    limits.exit(deadline_token)
+                    _node_var.reset(token)
+                if hooks:
+                    hooks.node_end(event, res)
+                if res:
+                    self._apply(state, res)
+                step += 1
+                if checkpoint and res:
+                    self.checkpointer.put_writes(config, res, {"step": step, "node": current})
+                    logged += 1
+                yield current, res
+                branch = None
+                if current in graph.cond_edges:
+                    branch = _call_sync(graph.cond_edges[current][0], state)
+                current = self._next(current, branch)
+            if checkpoint and self._needs_compaction(logged):
+                self.checkpointer.put(config, state, {"step": step})
+            finished = True
+        except GeneratorExit:
+            raise
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            try:
+                if checkpoint:
+                    update = None if finished else _abort_update(state, error)
+                    if update:
+                        self._apply(state, update)
+                        self.checkpointer.put_writes(config, update, {"step": step, "node": None})
+                    self.checkpointer.flush()
+            finally:
+                if hooks:
+                    hooks.run_end(run, error)
+
+    async def _aiter_steps(self, input, state, logged, config=None):
+        """Async twin of ``_iter_steps``."""
+        graph = self._graph
+        loop = asyncio.get_running_loop()
+        checkpoint = self._should_checkpoint(config)
+        limits = _RunLimits(config)
+        hooks = self._hooks(config)
+        run = hooks.run_start(config) if hooks else None
+        error = None
+        step = 0
+        finished = False
+        try:
+            if checkpoint:
+                await self.checkpointer.aput_writes(config, input, {"step": 0, "node": START})
+                logged += 1
+            current = graph.edges.get(START)
+            while current is not None and current != END:
+                limits.check(step, state)
+                event = hooks.node_start(run, current, step + 1, state) if hooks else None
+                token = _node_var.set(current)
+                deadline_token = limits.enter()
+                try:
+                    call = self._acall(loop, graph.nodes[current], state)
+                    remaining = limits.remaining()
+                    if remaining is None:
+                        res = await call
                     else:
-                        nxt = graph.edges.get(current, END)
-                    if nxt == END:
-                        break
-                    current = nxt
-                return state
-            def invoke(self, state, config=None):
-                return self._run(state)
-            async def ainvoke(self, state, config=None):
-                return self._run(state)
-        return App(graph)
+                        # Cancels async nodes at the deadline; an offloaded sync
+                        # node keeps its worker thread until it returns.
+                        try:
+                            res = await asyncio.wait_for(call, remaining)
+                        except asyncio.TimeoutError:
+                            raise limits.timeout_error(step, state) from None
+                except BaseException as e:
+                    if hooks:
+                        hooks.node_end(event, error=e)
+                    limits.raise_if_expired(e, step, state)
+                    raise
+                finally:
+                    limits.exit(deadline_token)
+                    _node_var.reset(token)
+                if hooks:
+                    hooks.node_end(event, res)
+                if res:
+                    self._apply(state, res)
+                step += 1
+                if checkpoint and res:
+                    await self.checkpointer.aput_writes(
+                        config, res, {"step": step, "node": current}
+                    )
+                    logged += 1
+                yield current, res
+                branch = None
+                if current in graph.cond_edges:
+                    cond_fn = graph.cond_edges[current][0]
+                    acond = _get_async_callable(cond_fn)
+                    # Routing functions are cheap, so sync ones run inline.
+                    branch = await acond(state) if acond else cond_fn(state)
+                current = self._next(current, branch)
+            if checkpoint and self._needs_compaction(logged):
+                await self.checkpointer.aput(config, state, {"step": step})
+            finished = True
+        except GeneratorExit:
+            raise
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            try:
+                if checkpoint:
+                    update = None if finished else _abort_update(state, error)
+                    if update:
+                        self._apply(state, update)
+                        await self.checkpointer.aput_writes(
+                            config, update, {"step": step, "node": None}
+                        )
+                    await self.checkpointer.aflush()
+            finally:
+                if hooks:
+                    hooks.run_end(run, error)
+
+    def _run(self, input, config=None):
+        state, logged = self._prepare(input, config)
+        for _ in self._iter_steps(input, state, logged, config):
+            pass
+        return state
+
+    async def _arun(self, input, config=None):
+        state, logged = await self._aprepare(input, config)
+        steps = self._aiter_steps(input, state, logged, config)
+        try:
+            async for _ in steps:
+                pass
+        finally:
+            await steps.aclose()
+        return state
+
+    async def _acall(self, loop, func, state):
+        afunc = _get_async_callable(func)
+        if afunc is not None:
+            return await afunc(state)
+        # run_in_executor does not propagate contextvars on its own.
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(ctx.run, func, state)
+        )
+
+    def get_state(self, config):
+        """Return the checkpointed state values for the thread in ``config``."""
+        if not self._should_checkpoint(config):
+            return None
+        return self._restore(self.checkpointer.get_tuple(config))[0]
+
+    def invoke(self, state, config=None):
+        return self._run(state, config)
+
+    async def ainvoke(self, state, config=None):
+        return await self._arun(state, config)
+
+    def stream(self, input, config=None, stream_mode="updates"):
+        """Run the graph, yielding events as they happen.
+
+        ``stream_mode`` is one of (or a list of) ``"updates"`` (``{node: update}``
+        after each step), ``"values"`` (the full state after each step),
+        ``"messages"`` (``(chunk, metadata)`` LLM token chunks emitted by nodes)
+        and ``"custom"`` (payloads from ``get_stream_writer()``). With a list,
+        events are yielded as ``(mode, payload)`` tuples.
+
+        The run executes on a background thread so token chunks are delivered
+        while a node is still running. Closing the generator stops the run at
+        the next step boundary.
+        """
+        modes, single = _stream_modes(stream_mode)
+        events = queue.Queue()
+        stopped = threading.Event()
+        done = object()
+
+        def emit(mode, payload):
+            if mode in modes:
+                events.put(payload if single else (mode, payload))
+
+        def worker():
+            _stream_var.set(StreamContext(modes, emit))
+            try:
+                state, logged = self._prepare(input, config)
+                steps = self._iter_steps(input, state, logged, config)
+                try:
+                    for node, update in steps:
+                        emit("updates", {node: update})
+                        emit("values", _snapshot(state))
+                        if stopped.is_set():
+                            break
+                finally:
+                    steps.close()
+            except BaseException as e:
+                events.put(_StreamError(e))
+            finally:
+                events.put(done)
+
+        threading.Thread(target=contextvars.copy_context().run, args=(worker,),
+                         daemon=True, name="langgraph-stream").start()
+        try:
+            while True:
+                item = events.get()
+                if item is done:
+                    break
+                if isinstance(item, _StreamError):
+                    raise item.error
+                yield item
+        finally:
+            stopped.set()
+
+    async def astream(self, input, config=None, stream_mode="updates"):
+        """Async twin of ``stream``; closing the generator cancels the run."""
+        modes, single = _stream_modes(stream_mode)
+        loop = asyncio.get_running_loop()
+        loop_thread = threading.get_ident()
+        events = asyncio.Queue()
+        done = object()
+
+        def emit(mode, payload):
+            if mode not in modes:
+                return
+            item = payload if single else (mode, payload)
+            if threading.get_ident() == loop_thread:
+                events.put_nowait(item)
+            else:
+                loop.call_soon_threadsafe(events.put_nowait, item)
+
+        async def runner():
+            _stream_var.set(StreamContext(modes, emit))
+            state, logged = await self._aprepare(input, config)
+            steps = self._aiter_steps(input, state, logged, config)
+            try:
+                async for node, update in steps:
+                    emit("updates", {node: update})
+                    emit("values", _snapshot(state))
+            finally:
+                await steps.aclose()
+
+        task = loop.create_task(runner())
+        task.add_done_callback(lambda _: events.put_nowait(done))
+        try:
+            while True:
+                item = await events.get()
+                if item is done:
+                    break
+                yield item
+            task.result()
+        finally:
+            if not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
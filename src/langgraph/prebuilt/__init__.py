@@ -1,5 +1,190 @@
+import asyncio
+import functools
+import inspect
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from langchain_core.messages import ToolMessage
+
+from ..config import get_deadline, get_time_budget
+
+_tool_executor = None
+_tool_executor_lock = threading.Lock()
+
+
+def get_tool_executor():
+    """Return the shared thread pool that runs sync tools.
+
+    Kept separate from the node pool so a ToolNode running inside a pooled
+    worker can never wait on its own pool.
+    """
+    global _tool_executor
+    if _tool_executor is None:
+        with _tool_executor_lock:
+            if _tool_executor is None:
+                max_workers = int(os.getenv("LANGGRAPH_TOOL_WORKERS", "32"))
+                _tool_executor = ThreadPoolExecutor(
+                    max_workers=max_workers, thread_name_prefix="langgraph-tool"
+                )
+    return _tool_executor
+
+
+def _tool_name(tool):
+    return getattr(tool, "name", None) or tool.__name__
+
+
+def _call_tool(tool, args):
+    if isinstance(args, dict):
+        result = tool(**args)
+    else:
+        result = tool(args)
+    if inspect.isawaitable(result):
+        result = asyncio.run(result)
+    return result
+
+
 class ToolNode:
-    def __init__(self, tools):
+    """Runs every tool call of the last AI message concurrently.
+
+    Sync tools run on a shared thread pool, async tools on the event loop.
+    ``timeout`` (seconds) bounds each call and can be overridden per tool via
+    ``tool_timeouts``, and is further capped by the time left before the run's
+    deadline; ``max_concurrency`` caps how many tool calls this node
+    runs at once across all in-flight graph runs. Results come back as
+    ``ToolMessage``s in the same order as the tool calls; failures and timeouts
+    become error messages instead of aborting the run.
+    """
+
+    def __init__(self, tools, *, timeout=None, tool_timeouts=None, max_concurrency=None):
         self.tools = tools
+        self.tools_by_name = {_tool_name(tool): tool for tool in tools}
+        self.timeout = timeout
+        self.tool_timeouts = dict(tool_timeouts or {})
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self._async_slots = weakref.WeakKeyDictionary()
+        self.afunc = self.ainvoke
+
+    def _tool_calls(self, state):
+        messages = state.get("messages") or []
+        if not messages:
+            return []
+        return list(getattr(messages[-1], "tool_calls", None) or [])
+
+    def _timeout_for(self, name):
+        return self.tool_timeouts.get(name, self.timeout)
+
+    def _message(self, call, content, status="success"):
+        return ToolMessage(
+            content=str(content),
+            tool_call_id=call.get("id"),
+            name=call.get("name"),
+            status=status,
+        )
+
+    def _error(self, call, error):
+        if isinstance(error, (FutureTimeoutError, asyncio.TimeoutError)):
+            timeout = self._timeout_for(call.get("name"))
+            if get_time_budget() == 0:
+                content = f"Error: tool '{call.get('name')}' cancelled, run deadline exceeded"
+            else:
+                content = f"Error: tool '{call.get('name')}' timed out after {timeout}s"
+        else:
+            content = f"Error: {error!r}\n Please fix your mistakes."
+        return self._message(call, content, status="error")
+
+    def _run_sync(self, tool, args):
+        if self._slots is None:
+            return _call_tool(tool, args)
+        with self._slots:
+            return _call_tool(tool, args)
+
     def __call__(self, state):
-        return {}
+        calls = self._tool_calls(state)
+        if not calls:
+            return {}
+        executor = get_tool_executor()
+        started = time.monotonic()
+        deadline = get_deadline()
+        futures = []
+        for call in calls:
+            tool = self.tools_by_name.get(call.get("name"))
+            if tool is None:
+                futures.append(None)
+                continue
+            futures.append(executor.submit(self._run_sync, tool, call.get("args") or {}))
+
+        messages = []
+        for call, future in zip(calls, futures):
+            if future is None:
+                messages.append(self._unknown(call))
+                continue
+            # All calls started together, so each waits until its own limit.
+            timeout = self._timeout_for(call.get("name"))
+            ends = started + timeout if timeout is not None else deadline
+            if ends is not None:
+                if deadline is not None:
+                    ends = min(ends, deadline)
+                timeout = max(0.0, ends - time.monotonic())
+            try:
+                result = future.result(timeout=timeout)
+                messages.append(self._message(call, result))
+            except Exception as e:
+                future.cancel()
+                messages.append(self._error(call, e))
+        return {"messages": messages}
+
+    def _unknown(self, call):
+        names = ", ".join(self.tools_by_name)
+        content = f"Error: {call.get('name')} is not a valid tool, try one of [{names}]."
+        return self._message(call, content, status="error")
+
+    def _async_semaphore(self):
+        if not self.max_concurrency:
+            return None
+        loop = asyncio.get_running_loop()
+        semaphore = self._async_slots.get(loop)
+        if semaphore is None:
+            semaphore = self._async_slots[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def _arun_one(self, call, semaphore):
+        tool = self.tools_by_name.get(call.get("name"))
+        if tool is None:
+            return self._unknown(call)
+        args = call.get("args") or {}
+        try:
+            if semaphore is not None:
+                async with semaphore:
+                    result = await self._aexecute(tool, args, call)
+            else:
+                result = await self._aexecute(tool, args, call)
+            return self._message(call, result)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return self._error(call, e)
+
+    async def _aexecute(self, tool, args, call):
+        if inspect.iscoroutinefunction(tool):
+            coro = tool(**args) if isinstance(args, dict) else tool(args)
+        else:
+            loop = asyncio.get_running_loop()
+            coro = loop.run_in_executor(
+                get_tool_executor(), functools.partial(_call_tool, tool, args)
+            )
+        return await asyncio.wait_for(coro, get_time_budget(self._timeout_for(call.get("name"))))
+
+    async def ainvoke(self, state):
+        calls = self._tool_calls(state)
+        if not calls:
+            return {}
+        semaphore = self._async_semaphore()
+        messages = await asyncio.gather(
+            *(self._arun_one(call, semaphore) for call in calls)
+        )
+        return {"messages": list(messages)}
@@ -0,0 +1,443 @@
+"""Node-level instrumentation for compiled graphs.
+
+Callbacks are attached with ``StateGraph.compile(callbacks=[...])``,
+``App.add_callback`` or per run through ``config["callbacks"]``. The engine
+reports every run and node execution to them:
+
+* ``on_run_start(run)`` / ``on_run_end(run)`` with a ``RunEvent``
+* ``on_node_start(event)`` / ``on_node_end(event)`` with a ``NodeEvent``
+  carrying the node name, step number, state size, duration and exception.
+
+Two callbacks ship with the engine: ``NodeLatencyCollector`` aggregates
+per-node latency histograms, and ``SpanTracer`` turns runs and nodes into
+OpenTelemetry-compatible spans handed to an exporter (``InMemorySpanExporter``
+or ``FileSpanExporter``, which writes OTLP/JSON lines).
+"""
+
+import atexit
+import bisect
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds in seconds (Prometheus' defaults plus a few
+# longer ones for LLM-bound nodes).
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+def state_size(state):
+    """Cheap size measure of a state: ``len()`` of sized values, 1 otherwise."""
+    size = 0
+    for value in state.values():
+        if isinstance(value, (list, tuple, dict, set)):
+            size += len(value)
+        else:
+            size += 1
+    return size
+
+
+class RunEvent:
+    """One graph run, passed to ``on_run_start`` and ``on_run_end``."""
+
+    __slots__ = ("run_id", "config", "start_time_ns", "end_time_ns", "duration",
+                 "steps", "error", "_started")
+
+    def __init__(self, run_id, config):
+        self.run_id = run_id
+        self.config = config
+        self.start_time_ns = time.time_ns()
+        self.end_time_ns = None
+        self.duration = None
+        self.steps = 0
+        self.error = None
+        self._started = time.perf_counter()
+
+
+class NodeEvent:
+    """One node execution, passed to ``on_node_start`` and ``on_node_end``.
+
+    ``duration`` (seconds), ``end_time_ns``, ``update`` and ``error`` are only
+    set by the time ``on_node_end`` runs.
+    """
+
+    __slots__ = ("run_id", "node", "step", "state_size", "start_time_ns",
+                 "end_time_ns", "duration", "update", "error", "_started")
+
+    def __init__(self, run_id, node, step, size):
+        self.run_id = run_id
+        self.node = node
+        self.step = step
+        self.state_size = size
+        self.start_time_ns = time.time_ns()
+        self.end_time_ns = None
+        self.duration = None
+        self.update = None
+        self.error = None
+        self._started = time.perf_counter()
+
+
+class GraphCallback:
+    """Base class for graph callbacks; override the hooks you need.
+
+    Hooks run synchronously on the thread executing the graph, so they should
+    be cheap. Exceptions raised by a hook are logged and never fail the run.
+    """
+
+    def on_run_start(self, run):
+        pass
+
+    def on_run_end(self, run):
+        pass
+
+    def on_node_start(self, event):
+        pass
+
+    def on_node_end(self, event):
+        pass
+
+
+class CallbackManager:
+    """Dispatches engine events to a list of callbacks."""
+
+    def __init__(self, callbacks):
+        self.callbacks = list(callbacks)
+
+    def _dispatch(self, hook, event):
+        for callback in self.callbacks:
+            try:
+                getattr(callback, hook)(event)
+            except Exception:
+                logger.exception("graph callback %r failed in %s", callback, hook)
+
+    def run_start(self, config):
+        run = RunEvent(uuid.uuid4().hex, config)
+        self._dispatch("on_run_start", run)
+        return run
+
+    def run_end(self, run, error=None):
+        run.end_time_ns = time.time_ns()
+        run.duration = time.perf_counter() - run._started
+        run.error = error
+        self._dispatch("on_run_end", run)
+
+    def node_start(self, run, node, step, state):
+        event = NodeEvent(run.run_id, node, step, state_size(state))
+        run.steps = step
+        self._dispatch("on_node_start", event)
+        return event
+
+    def node_end(self, event, update=None, error=None):
+        event.end_time_ns = time.time_ns()
+        event.duration = time.perf_counter() - event._started
+        event.update = update
+        event.error = error
+        self._dispatch("on_node_end", event)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram (not thread-safe on its own)."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, q):
+        """Estimate the ``q``-th percentile by interpolating inside its bucket."""
+        if not self.count:
+            return 0.0
+        rank = self.count * q / 100
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "buckets": dict(zip(self.buckets + (float("inf"),), self.counts)),
+        }
+
+
+class NodeLatencyCollector(GraphCallback):
+    """Aggregates per-node latency histograms and error counts."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._bucket_bounds = tuple(buckets)
+        self._histograms = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def on_node_end(self, event):
+        with self._lock:
+            histogram = self._histograms.get(event.node)
+            if histogram is None:
+                histogram = self._histograms[event.node] = Histogram(self._bucket_bounds)
+            histogram.observe(event.duration)
+            if event.error is not None:
+                self._errors[event.node] = self._errors.get(event.node, 0) + 1
+
+    def histogram(self, node):
+        with self._lock:
+            return self._histograms.get(node)
+
+    def stats(self):
+        """Return ``{node: {count, sum, mean, p50, p90, p99, errors, buckets}}``."""
+        with self._lock:
+            return {
+                node: dict(histogram.snapshot(), errors=self._errors.get(node, 0))
+                for node, histogram in self._histograms.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._errors.clear()
+
+
+# -- spans -------------------------------------------------------------------
+
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        # OTLP/JSON encodes 64-bit integers as strings.
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _span(trace_id, span_id, parent_id, name, start_ns, end_ns, attributes, error):
+    span = {
+        "traceId": trace_id,
+        "spanId": span_id,
+        "name": name,
+        "kind": 1,  # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(start_ns),
+        "endTimeUnixNano": str(end_ns),
+        "attributes": [_attribute(k, v) for k, v in attributes.items()],
+        "status": {"code": _STATUS_OK},
+    }
+    if parent_id:
+        span["parentSpanId"] = parent_id
+    if error is not None:
+        span["status"] = {"code": _STATUS_ERROR, "message": str(error)}
+        span["events"] = [{
+            "name": "exception",
+            "timeUnixNano": str(end_ns),
+            "attributes": [
+                _attribute("exception.type", type(error).__name__),
+                _attribute("exception.message", str(error)),
+            ],
+        }]
+    return span
+
+
+class SpanTracer(GraphCallback):
+    """Records each run as a root span with one child span per node.
+
+    Spans use the OTLP/JSON field layout, so any OpenTelemetry collector can
+    ingest them. The spans of a run are handed to ``exporter.export`` when the
+    run ends. Passing ``{"configurable": {"trace_id": ..., "parent_span_id": ...}}``
+    in the run config joins an existing trace.
+    """
+
+    def __init__(self, exporter, service_name="langgraph", graph_name="graph"):
+        self.exporter = exporter
+        self.service_name = service_name
+        self.graph_name = graph_name
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def on_run_start(self, run):
+        configurable = (run.config or {}).get("configurable", {})
+        trace = {
+            "trace_id": configurable.get("trace_id") or uuid.uuid4().hex,
+            "parent_id": configurable.get("parent_span_id"),
+            "span_id": uuid.uuid4().hex[:16],
+            "thread_id": configurable.get("thread_id"),
+            "spans": [],
+        }
+        with self._lock:
+            self._runs[run.run_id] = trace
+
+    def on_node_end(self, event):
+        with self._lock:
+            trace = self._runs.get(event.run_id)
+        if trace is None:
+            return
+        trace["spans"].append(_span(
+            trace["trace_id"], uuid.uuid4().hex[:16], trace["span_id"],
+            f"node {event.node}", event.start_time_ns, event.end_time_ns,
+            {
+                "langgraph.node": event.node,
+                "langgraph.step": event.step,
+                "langgraph.state_size": event.state_size,
+                "langgraph.duration_ms": event.duration * 1000,
+            },
+            event.error,
+        ))
+
+    def on_run_end(self, run):
+        with self._lock:
+            trace = self._runs.pop(run.run_id, None)
+        if trace is None:
+            return
+        attributes = {"langgraph.graph": self.graph_name, "langgraph.steps": run.steps}
+        if trace["thread_id"] is not None:
+            attributes["langgraph.thread_id"] = trace["thread_id"]
+        root = _span(
+            trace["trace_id"], trace["span_id"], trace["parent_id"],
+            f"{self.graph_name} run", run.start_time_ns, run.end_time_ns,
+            attributes, run.error,
+        )
+        self.exporter.export(self.service_name, [root] + trace["spans"])
+
+
+def to_otlp(service_name, spans):
+    """Wrap spans in an OTLP ``ExportTraceServiceRequest`` JSON document."""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [_attribute("service.name", service_name)]},
+            "scopeSpans": [{"scope": {"name": "langgraph"}, "spans": spans}],
+        }]
+    }
+
+
+class InMemorySpanExporter:
+    """Keeps exported spans in memory (an in-process collector)."""
+
+    def __init__(self, max_spans=10000):
+        self.max_spans = max_spans
+        self._spans = []
+        self._lock = threading.Lock()
+
+    def export(self, service_name, spans):
+        with self._lock:
+            self._spans.extend(spans)
+            overflow = len(self._spans) - self.max_spans
+            if overflow > 0:
+                del self._spans[:overflow]
+
+    def get_finished_spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+
+class FileSpanExporter:
+    """Appends one OTLP/JSON document per run to a file.
+
+    The output matches what the OpenTelemetry Collector's ``otlpjsonfile``
+    receiver reads. ``export`` only enqueues the spans: a background thread
+    serializes and writes them, so a run ending on an event loop never waits
+    on file I/O. Runs exported while ``max_queue`` others are pending are
+    dropped and counted in ``dropped``. ``flush()`` waits for pending writes,
+    ``shutdown()`` (also run at interpreter exit) writes them and stops the
+    thread.
+    """
+
+    _STOP = object()
+
+    def __init__(self, path, max_queue=10000):
+        self.path = path
+        self.dropped = 0
+        self._queue = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        atexit.register(self.shutdown)
+
+    def export(self, service_name, spans):
+        if not self._start():
+            return
+        try:
+            self._queue.put_nowait((service_name, spans))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _start(self):
+        with self._lock:
+            if self._closed:
+                return False
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._write_loop, name="span-exporter", daemon=True
+                )
+                self._thread.start()
+            return True
+
+    def _write_loop(self):
+        while True:
+            # Write everything that piled up since the last batch in one go.
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                lines = [
+                    json.dumps(to_otlp(*item), ensure_ascii=False)
+                    for item in batch if item is not self._STOP
+                ]
+                if lines:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write("\n".join(lines) + "\n")
+            except Exception:
+                logger.exception("Failed to write spans to %s", self.path)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if self._STOP in batch:
+                return
+
+    def flush(self):
+        """Block until every exported run has been written."""
+        self._queue.join()
+
+    def shutdown(self):
+        """Write pending runs and stop the writer thread; later exports are ignored."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            self._queue.put(self._STOP)
+            thread.join()
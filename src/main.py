@@ -7,15 +7,32 @@
 """
 
 import os
+import json
+import time
 import asyncio
-from typing import Optional
+from typing import Any, Callable, Dict, List, Optional
 from dotenv import load_dotenv
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 
-from agent import create_agent_graph, run_agent, arun_agent, Configuration
+from agent import (
+    create_agent_graph,
+    run_agent,
+    arun_agent,
+    arun_agent_batch,
+    astream_agent,
+    flush_trace_exports,
+    Configuration,
+)
+from agent import metrics
+from agent.admission import PRIORITIES, AdmissionController, AdmissionRejected, AdmissionTicket
+from agent.coalesce import SingleFlight, query_key
+from agent.batch import run_batch_file
+from agent.clients import aclose_http_clients
+from agent.search import get_search_backend
 
 # 加载环境变量
 load_dotenv()
@@ -24,14 +41,43 @@ load_dotenv()
 class QueryRequest(BaseModel):
     """查询请求模型"""
     query: str
-    thread_id: Optional[str] = "default"
+    # 为None时是无状态查询，不读写对话记忆
+    thread_id: Optional[str] = None
     config: Optional[dict] = None
+    # 本次请求的最长运行时间（秒），为None时使用配置中的run_timeout
+    timeout: Optional[float] = None
+    # 准入优先级：interactive先于batch
+    priority: str = "interactive"
 
 
 class QueryResponse(BaseModel):
     """查询响应模型"""
     answer: str
-    thread_id: str
+    thread_id: Optional[str]
+
+
+class BatchQueryRequest(BaseModel):
+    """批量查询请求模型"""
+    queries: List[str]
+    thread_ids: Optional[List[Optional[str]]] = None
+    config: Optional[dict] = None
+    max_concurrency: Optional[int] = None
+
+
+class BatchItemResponse(BaseModel):
+    """批量查询中单个查询的结果"""
+    index: int
+    query: str
+    thread_id: Optional[str] = None
+    answer: Optional[str] = None
+    error: Optional[str] = None
+    elapsed: float
+
+
+class BatchQueryResponse(BaseModel):
+    """批量查询响应模型"""
+    results: List[BatchItemResponse]
+    elapsed: float
 
 
 # 创建FastAPI应用
@@ -42,6 +88,74 @@ app = FastAPI(
 )
 
 
+@app.on_event("startup")
+async def load_search_corpus():
+    """启动时加载搜索语料，避免首个请求承担建索引的开销"""
+    await asyncio.get_running_loop().run_in_executor(None, get_search_backend)
+
+
+@app.on_event("shutdown")
+async def close_llm_clients():
+    """关闭时释放共享的模型API连接池，并等待追踪数据写完"""
+    await aclose_http_clients()
+    await asyncio.get_running_loop().run_in_executor(None, flush_trace_exports)
+
+
+class RequestMetricsMiddleware:
+    """记录请求数、进行中的请求数和端到端耗时
+
+    纯ASGI中间件：请求在最后一块响应体发出、客户端断开或应用出错时才算结束，
+    所以流式响应的耗时覆盖整个流，而不是只到响应头发出为止。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metrics.HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        status = 500
+        finished = False
+
+        def finish():
+            nonlocal finished
+            if finished:
+                return
+            finished = True
+            metrics.HTTP_IN_FLIGHT.dec()
+            # 使用路由模板而不是原始路径，避免标签基数失控
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            metrics.HTTP_LATENCY.labels(path).observe(time.perf_counter() - started)
+            metrics.HTTP_REQUESTS.labels(scope["method"], path, status).inc()
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                finish()
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish()
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            finish()
+
+
+app.add_middleware(RequestMetricsMiddleware)
+
+
 @app.get("/")
 async def root():
     """根路径"""
@@ -58,34 +172,275 @@ async def health_check():
     return {"status": "healthy"}
 
 
+# 请求可以覆盖的配置项；基础URL、文件路径、连接池和限流等基础设施配置只由服务端决定，
+# 否则客户端可以把API密钥发往自己的地址，或在任意路径创建文件
+REQUEST_CONFIG_FIELDS = frozenset({
+    "model_provider",
+    "model_name",
+    "temperature",
+    "max_tokens",
+    "fake_llm_options",
+    "llm_timeout",
+    "enable_hedging",
+    "system_prompt",
+    "enable_weather_tool",
+    "enable_search_tool",
+    "enable_calculator_tool",
+    "tool_timeout",
+    "max_iterations",
+    "run_timeout",
+    "max_context_tokens",
+    "context_keep_first_message",
+    "enable_request_coalescing",
+    "enable_human_in_loop",
+    "enable_memory",
+})
+
+
+def build_config(request) -> Configuration:
+    """根据请求中的配置覆盖项创建配置，不允许覆盖或取值无效的配置项返回400"""
+    config = Configuration()
+    if request.config:
+        forbidden = sorted(set(request.config) - REQUEST_CONFIG_FIELDS)
+        if forbidden:
+            raise HTTPException(status_code=400, detail=f"不允许覆盖的配置项: {', '.join(forbidden)}")
+        for key, value in request.config.items():
+            try:
+                setattr(config, key, value)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"配置项 {key} 无效: {e}")
+    return config
+
+
+# 合并相同的并发无状态/query请求
+query_flights = SingleFlight("query")
+
+
+def is_stateless(request, config: Configuration) -> bool:
+    """请求不读写对话记忆时，相同的查询可以共享结果"""
+    return request.thread_id is None or not config.enable_memory
+
+
+def check_timeout(request) -> None:
+    """拒绝非正数的请求超时"""
+    if request.timeout is not None and request.timeout <= 0:
+        raise HTTPException(status_code=400, detail="timeout必须大于0")
+
+
+# 限制同时执行的代理运行数，超出的请求按优先级排队
+admission = AdmissionController(
+    max_in_flight=int(os.getenv("AGENT_MAX_IN_FLIGHT", "32")),
+    max_queue=int(os.getenv("AGENT_MAX_QUEUE", "64")),
+    queue_timeout=float(os.getenv("AGENT_QUEUE_TIMEOUT", "10")),
+)
+
+
+def check_priority(request) -> None:
+    """拒绝未知的准入优先级"""
+    if request.priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"未知的优先级: {request.priority}")
+
+
+def rejected(error: AdmissionRejected) -> HTTPException:
+    """把准入拒绝转换为带Retry-After的429/503响应"""
+    return HTTPException(
+        status_code=error.status_code,
+        detail=str(error),
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus格式的运行指标"""
+    return PlainTextResponse(
+        metrics.render_metrics(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.post("/query", response_model=QueryResponse)
 async def query_agent(request: QueryRequest):
     """查询代理"""
+    check_timeout(request)
+    check_priority(request)
+    # 创建配置
+    config = build_config(request)
     try:
-        # 创建配置
-        config = Configuration()
-        if request.config:
-            # 更新配置
-            for key, value in request.config.items():
-                if hasattr(config, key):
-                    setattr(config, key, value)
+        # 运行代理；相同的并发无状态查询共享同一次运行，只占用一个准入名额，
+        # 共享的运行按等待者中最高的优先级排队
+        ticket = AdmissionTicket(request.priority)
         
-        # 运行代理
-        answer = await arun_agent(
-            query=request.query,
-            config=config,
-            thread_id=request.thread_id
-        )
+        async def run():
+            async with admission.admit(ticket=ticket):
+                return await arun_agent(
+                    query=request.query,
+                    config=config,
+                    thread_id=request.thread_id,
+                    timeout=request.timeout
+                )
+        
+        if is_stateless(request, config) and config.enable_request_coalescing:
+            answer = await query_flights.do(
+                query_key(request.query, config, request.timeout), run, context=ticket,
+                on_join=lambda shared: admission.promote(shared, request.priority)
+            )
+        else:
+            answer = await run()
         
         return QueryResponse(
             answer=answer,
             thread_id=request.thread_id
         )
         
+    except AdmissionRejected as e:
+        raise rejected(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/query/batch", response_model=BatchQueryResponse)
+async def query_agent_batch(request: BatchQueryRequest):
+    """批量查询代理
+    
+    并发执行全部查询（受 ``max_concurrency`` 限制，且不超过服务端的并发上限），
+    按输入顺序返回每个查询的回答或错误及耗时；单个查询失败不会导致整个请求失败。
+    每个查询都以batch优先级单独经过准入控制，未被接纳的查询记为该项的错误。
+    """
+    if request.thread_ids is not None and len(request.thread_ids) != len(request.queries):
+        raise HTTPException(status_code=400, detail="thread_ids的数量必须与queries一致")
+    if request.max_concurrency is not None and request.max_concurrency <= 0:
+        raise HTTPException(status_code=400, detail="max_concurrency必须大于0")
+    
+    config = build_config(request)
+    max_concurrency = min(request.max_concurrency or config.batch_concurrency,
+                          admission.max_in_flight)
+    try:
+        started = time.perf_counter()
+        results = await arun_agent_batch(
+            request.queries,
+            config=config,
+            thread_ids=request.thread_ids,
+            max_concurrency=max_concurrency,
+            admit=lambda: admission.admit("batch")
+        )
+        return BatchQueryResponse(
+            results=[BatchItemResponse(**result) for result in results],
+            elapsed=time.perf_counter() - started
+        )
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# 流式响应格式对应的媒体类型
+STREAM_MEDIA_TYPES = {
+    "sse": "text/event-stream",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """把代理事件编码为一条SSE消息"""
+    data = json.dumps(event, ensure_ascii=False)
+    return f"event: {event['type']}\ndata: {data}\n\n"
+
+
+def format_ndjson(event: Dict[str, Any]) -> str:
+    """把代理事件编码为一行JSON"""
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+
+def _stream_format(http_request: Request, format: Optional[str]) -> str:
+    if format is None:
+        accept = http_request.headers.get("accept", "")
+        format = "ndjson" if "application/x-ndjson" in accept else "sse"
+    if format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"不支持的流式格式: {format}")
+    return format
+
+
+def _release_once(controller: AdmissionController, started: float) -> Callable[[], None]:
+    """返回只生效一次的名额归还函数，流结束和响应结束时都会调用"""
+    released = False
+    
+    def release() -> None:
+        nonlocal released
+        if not released:
+            released = True
+            controller.release(time.monotonic() - started)
+    
+    return release
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """占用准入名额的流式响应
+    
+    事件流的 ``finally`` 只在流开始迭代后才会执行；客户端在响应体开始前断开、
+    或响应体从未被迭代时，由这里的 ``finally`` 归还名额。
+    """
+    
+    def __init__(self, *args, release: Callable[[], None], **kwargs):
+        super().__init__(*args, **kwargs)
+        self._release = release
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._release()
+
+
+@app.post("/query/stream")
+async def query_agent_stream(request: QueryRequest, http_request: Request,
+                             format: Optional[str] = None):
+    """流式查询代理
+    
+    以SSE（默认）或NDJSON（``format=ndjson`` 或 ``Accept: application/x-ndjson``）
+    格式边执行边返回事件：LLM输出片段、工具调用、工具结果、节点完成和最终回答。
+    客户端断开连接时取消正在执行的代理。
+    准入名额在返回响应前获取（被拒绝时返回429/503），在流结束或连接断开时归还。
+    """
+    check_timeout(request)
+    check_priority(request)
+    format = _stream_format(http_request, format)
+    encode = format_sse if format == "sse" else format_ndjson
+    config = build_config(request)
+    try:
+        await admission.acquire(request.priority)
+    except AdmissionRejected as e:
+        raise rejected(e)
+    release = _release_once(admission, time.monotonic())
+    
+    async def body():
+        events = astream_agent(
+            query=request.query,
+            config=config,
+            thread_id=request.thread_id,
+            timeout=request.timeout
+        )
+        try:
+            async for event in events:
+                if await http_request.is_disconnected():
+                    break
+                yield encode(event)
+        finally:
+            # 关闭事件流会取消仍在执行的图形
+            await events.aclose()
+            release()
+    
+    try:
+        return AdmittedStreamingResponse(
+            body(),
+            release=release,
+            media_type=STREAM_MEDIA_TYPES[format],
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    except BaseException:
+        release()
+        raise
+
+
 @app.get("/config")
 async def get_default_config():
     """获取默认配置"""
@@ -149,6 +504,23 @@ def single_query_mode(query: str):
     print(f"\n📝 回答: {answer}")
 
 
+def batch_mode(input_path: str, output_path: str, concurrency: Optional[int] = None,
+               resume: bool = True):
+    """JSONL批量处理模式"""
+    print(f"📦 批量处理: {input_path} -> {output_path}")
+    
+    stats = run_batch_file(
+        input_path,
+        output_path,
+        config=Configuration(),
+        concurrency=concurrency,
+        resume=resume
+    )
+    
+    print(f"\n✅ 完成 {stats['completed']} 条，失败 {stats['errors']} 条，"
+          f"用时 {stats['elapsed']:.1f}秒")
+
+
 def start_server(host: str = "localhost", port: int = 8000):
     """启动Web服务器"""
     print(f"🚀 启动LangGraph代理API服务器")
@@ -164,7 +536,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="LangGraph代理项目")
     parser.add_argument(
         "--mode",
-        choices=["interactive", "server", "query"],
+        choices=["interactive", "server", "query", "batch"],
         default="interactive",
         help="运行模式"
     )
@@ -173,6 +545,27 @@ if __name__ == "__main__":
         type=str,
         help="单次查询内容（仅在query模式下使用）"
     )
+    parser.add_argument(
+        "--input",
+        type=str,
+        help="输入JSONL文件，每行一个查询（仅在batch模式下使用）"
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="输出JSONL文件，结果逐条追加写入（仅在batch模式下使用）"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=None,
+        help="并发执行的查询数（仅在batch模式下使用）"
+    )
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="忽略已有进度，从头开始处理（仅在batch模式下使用）"
+    )
     parser.add_argument(
         "--host",
         type=str,
@@ -196,4 +589,9 @@ if __name__ == "__main__":
         if not args.query:
             print("❌ 错误: 在query模式下必须提供--query参数")
         else:
-            single_query_mode(args.query)
\ No newline at end of file
+            single_query_mode(args.query)
+    elif args.mode == "batch":
+        if not args.input or not args.output:
+            print("❌ 错误: 在batch模式下必须提供--input和--output参数")
+        else:
+            batch_mode(args.input, args.output, args.concurrency, not args.no_resume)
\ No newline at end of file
@@ -2,6 +2,8 @@
 
 This module provides a ``MultiAgentManager`` class that can
 instantiate multiple agent graphs and route messages between them.
+When an agent's configuration sets ``max_context_tokens``, its history is
+compacted to that window after every exchange, so histories stay bounded.
 """
 
 from typing import Dict, List
@@ -9,6 +11,7 @@ from typing import Dict, List
 from langchain_core.messages import AIMessage, HumanMessage, BaseMessage
 
 from agent import Configuration, create_agent_graph
+from agent.context import ContextWindow, PrefixSums, extend_totals
 
 
 class MultiAgentManager:
@@ -18,6 +21,10 @@ class MultiAgentManager:
         """Create manager with a mapping of agent name to ``Configuration``."""
         self.graphs = {name: create_agent_graph(cfg) for name, cfg in configs.items()}
         self.histories: Dict[str, List[BaseMessage]] = {name: [] for name in configs}
+        # Token prefix sums aligned with (a prefix of) each history; every
+        # message is counted once.
+        self.token_totals: Dict[str, List[int]] = {name: [] for name in configs}
+        self.windows = {name: ContextWindow.from_config(cfg) for name, cfg in configs.items()}
 
     def send_to_agent(self, agent_name: str, message: str) -> str:
         """Send a message to a specific agent and get its reply."""
@@ -28,9 +35,16 @@ class MultiAgentManager:
             "user_input": message,
             "final_answer": None,
         }
+        window = self.windows[agent_name]
+        if window is not None:
+            # The engine copies the lists it is given, so no copy is needed here.
+            state["token_totals"] = self.token_totals[agent_name]
         result = self.graphs[agent_name].invoke(state)
-        history.append(HumanMessage(content=message))
-        history.extend(result["messages"])
+        # The graph appends its replies to the input messages, so the result
+        # already holds the full conversation in a list the run owned.
+        self.histories[agent_name] = result["messages"]
+        if window is not None:
+            self._compact(agent_name, window, result.get("token_totals") or [])
         reply = ""
         for msg in reversed(result["messages"]):
             if isinstance(msg, AIMessage) or hasattr(msg, "content"):
@@ -38,6 +52,12 @@ class MultiAgentManager:
                 break
         return reply
 
+    def _compact(self, agent_name: str, window: ContextWindow, totals: List[int]) -> None:
+        """Drop history that no longer fits the agent's context window."""
+        history = self.histories[agent_name]
+        totals = PrefixSums(totals, extend_totals(history, totals), len(history))
+        self.histories[agent_name], self.token_totals[agent_name] = window.compact(history, totals)
+
     def relay_message(self, sender: str, receiver: str, message: str) -> str:
         """Relay a message from one agent to another."""
         reply = self.send_to_agent(receiver, message)
@@ -7,13 +7,53 @@ import os
 import sys
 import pytest
 import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import patch, MagicMock
 
 # 添加src目录到Python路径
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
 
-from agent import Configuration, create_agent_graph, run_agent, arun_agent
-from agent.tools import get_weather, search_web, calculate, get_enabled_tools
+from agent import (
+    Configuration,
+    create_agent_graph,
+    get_agent_graph,
+    invalidate_graph_cache,
+    get_graph_cache_stats,
+    get_node_latency_stats,
+    flush_trace_exports,
+    run_agent,
+    arun_agent,
+    run_agent_batch,
+    arun_agent_batch,
+    stream_agent,
+    astream_agent,
+)
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+from agent.fake_llm import FakeChatModel, FakeLLMError, make_sampler
+from agent.graph import create_llm
+from agent.context import ContextWindow, PrefixSums, extend_totals, message_tokens
+from agent.clients import (
+    HTTPXPool, KeepAlivePool, aclose_http_clients, close_http_clients, get_http_client,
+    get_http_client_stats
+)
+from agent.admission import AdmissionController, AdmissionTicket, QueueFull, QueueTimeout
+from agent.coalesce import SingleFlight, query_key
+from agent.hedging import HedgedChatModel, LatencyWindow
+from agent.rate_limit import (
+    RateLimitedChatModel, RateLimiter, RateLimitTimeout, estimate_tokens, is_rate_limit_error
+)
+from agent.llm_cache import CachedChatModel, LLMResponseCache, cache_key, get_llm_cache_stats
+from agent import metrics
+from agent.batch import BatchRunner, LatencyHistogram, run_batch_file
+from agent.graph_cache import GraphCache, config_fingerprint
+from agent import calculator
+from agent.calculator import CalculationError, evaluate, evaluate_batch
+from agent.search import BM25SearchBackend, tokenize
+from agent.tool_cache import cached_tool, normalize_text, get_tool_cache_stats
+from agent.tools import get_weather, search_web, calculate, calculate_batch, get_enabled_tools
 
 
 class TestConfiguration:
@@ -114,7 +154,8 @@ class TestTools:
             enable_calculator_tool=True
         )
         tools = get_enabled_tools(config)
-        assert len(tools) == 3
+        assert len(tools) == 4
+        assert calculate_batch in tools
         
         # 测试部分启用
         config = Configuration(
@@ -135,6 +176,205 @@ class TestTools:
         assert len(tools) == 0
 
 
+class TestCalculator:
+    """表达式求值器测试"""
+
+    def test_evaluate_basic(self):
+        """基本运算、函数与常量"""
+        assert evaluate("2 + 3 * 4") == 14
+        assert evaluate("sqrt(16)") == 4.0
+        assert evaluate("max(1, 5, 3) + sum([1, 2])") == 8
+        assert evaluate("2 * pi") == pytest.approx(6.283185307)
+
+    def test_rejects_unsafe_syntax(self):
+        """拒绝属性访问、未知名称和未授权函数"""
+        for expression in ["__import__('os')", "(1).__class__", "x + 1", "open('f')", "'a' * 3"]:
+            with pytest.raises(CalculationError):
+                evaluate(expression)
+
+    def test_limits(self):
+        """超大幂运算和操作数被快速拒绝"""
+        start = time.perf_counter()
+        for expression in ["pow(10, 10**8)", "10 ** 100000", "9 ** 9 ** 9", "(10 ** 1000) * (10 ** 1000)",
+                           "round(1, -10000000)", "round(1.5, 10**9)", "round(1, 0.5)"]:
+            with pytest.raises(CalculationError):
+                evaluate(expression)
+        assert time.perf_counter() - start < 1.0
+
+    def test_whitespace_normalized_compile_cache(self):
+        """空白不同的表达式复用同一个编译结果"""
+        calculator.compile_expression.cache_clear()
+        evaluate("1 + 2")
+        evaluate("1  +\t2")
+        evaluate(" 1 +  2 ")
+        assert calculator.compile_expression.cache_info().misses == 1
+
+    def test_complex_results_rejected(self):
+        """负数的分数次幂不返回复数"""
+        for expression in ["(-8) ** 0.5", "pow(-8, 0.5)"]:
+            with pytest.raises(CalculationError):
+                evaluate(expression)
+        assert evaluate("round(3.14159, 2)") == 3.14
+        assert evaluate("round(12345, -2)") == 12300
+
+    def test_whitespace_between_numbers(self):
+        """数字之间的空白不会被删除后拼接成另一个数字"""
+        with pytest.raises(CalculationError):
+            evaluate("1 2")
+        assert evaluate("12") == 12
+        assert isinstance(evaluate_batch(["1 2"])[0], CalculationError)
+
+    def test_deep_expression_rejected(self):
+        """嵌套过深的表达式返回CalculationError而不是RecursionError"""
+        expression = "+".join(["1"] * 499)
+        assert len(expression) <= calculator.MAX_EXPRESSION_LENGTH
+        with pytest.raises(CalculationError):
+            evaluate(expression)
+        assert isinstance(evaluate_batch([expression])[0], CalculationError)
+        assert evaluate("+".join(["1"] * 50)) == 50
+
+    def test_evaluate_batch(self):
+        """批量计算保持顺序，并逐项返回错误"""
+        results = evaluate_batch(["1 + 1", "1.5 * 2", "1 / 0", "bad", "2.5 * 2", "sqrt(-1.0)"])
+        assert results[0] == 2
+        assert results[1] == 3.0
+        assert isinstance(results[2], ZeroDivisionError)
+        assert isinstance(results[3], CalculationError)
+        assert results[4] == 5.0
+        assert isinstance(results[5], ValueError)
+
+    def test_evaluate_batch_vectorized(self):
+        """NumPy向量化结果与逐个计算一致"""
+        pytest.importorskip("numpy")
+        expressions = [f"sqrt({i}.0) * 2 + {i} / 3" for i in range(200)]
+        results = evaluate_batch(expressions)
+        assert results == pytest.approx([evaluate(e) for e in expressions])
+
+    def test_calculate_batch_tool(self):
+        """批量计算工具逐行输出"""
+        output = calculate_batch(["2 + 3", "1 / 0"])
+        lines = output.split("\n")
+        assert "5" in lines[0]
+        assert "错误" in lines[1]
+
+
+class TestSearchBackend:
+    """倒排索引搜索后端测试"""
+
+    def test_tokenize_cjk_bigrams(self):
+        """中文切分为二元组，英文按词小写"""
+        assert tokenize("人工智能 Python3") == ["人工", "工智", "智能", "python3"]
+        assert tokenize("猫") == ["猫"]
+
+    def test_bm25_ranking(self):
+        """更相关的文档排在前面，且返回数量受限"""
+        backend = BM25SearchBackend.from_texts([
+            "今天天气很好",
+            "人工智能改变世界",
+            "人工智能与机器学习：人工智能的未来",
+        ])
+        results = backend.search("人工智能", num_results=2)
+        assert results == ["人工智能与机器学习：人工智能的未来", "人工智能改变世界"]
+        assert backend.search("量子计算") == []
+
+    def test_from_jsonl_mmap(self, tmp_path):
+        """从JSONL加载语料，内存映射与内存模式结果一致"""
+        path = tmp_path / "corpus.jsonl"
+        lines = [{"text": f"文档{i} 关于Python编程的第{i}条"} for i in range(50)]
+        lines.append({"text": "LangGraph 状态图"})
+        path.write_text("\n".join(json.dumps(line, ensure_ascii=False) for line in lines) + "\n",
+                        encoding="utf-8")
+
+        mapped = BM25SearchBackend.from_jsonl(str(path))
+        in_memory = BM25SearchBackend.from_jsonl(str(path), use_mmap=False)
+        assert len(mapped) == 51
+        assert mapped.search("LangGraph") == ["LangGraph 状态图"]
+        assert mapped.search("python 编程", 5) == in_memory.search("python 编程", 5)
+
+
+class TestToolCache:
+    """工具结果缓存测试"""
+
+    def test_normalized_arguments_share_entry(self):
+        """大小写和空白不同的参数命中同一缓存条目"""
+        calls = []
+
+        @cached_tool(ttl=60, normalizers={"city": normalize_text})
+        def lookup(city: str) -> str:
+            calls.append(city)
+            return city.upper()
+
+        assert lookup("Beijing") == "BEIJING"
+        assert lookup("  beijing ") == "BEIJING"
+        assert lookup(city="BEIJING") == "BEIJING"
+        assert len(calls) == 1
+        assert lookup.cache.stats()["hits"] == 2
+
+    def test_ttl_expiry(self):
+        """过期条目会重新计算"""
+        calls = []
+
+        @cached_tool(ttl=0.01)
+        def compute(x: int) -> int:
+            calls.append(x)
+            return x * 2
+
+        compute(1)
+        time.sleep(0.02)
+        compute(1)
+        assert len(calls) == 2
+        assert compute.cache.stats()["expirations"] == 1
+
+    def test_single_flight(self):
+        """并发的相同调用只执行一次"""
+        calls = []
+
+        @cached_tool(ttl=60)
+        def slow(x: int) -> int:
+            calls.append(x)
+            time.sleep(0.1)
+            return x
+
+        threads = [threading.Thread(target=slow, args=(7,)) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert calls == [7]
+        stats = slow.cache.stats()
+        assert stats["misses"] == 1
+        assert stats["coalesced"] == 4
+
+    def test_builtin_tools_are_cached(self):
+        """内置工具注册了缓存并暴露指标"""
+        assert get_weather("beijing") == get_weather("Beijing")
+        stats = get_tool_cache_stats()
+        assert {"get_weather", "search_web", "calculate"} <= set(stats)
+
+    def test_cached_tools_echo_current_argument(self):
+        """缓存命中时回复中的参数来自本次调用，而不是首次调用的写法"""
+        assert "Atlantis" in get_weather("Atlantis")
+        reply = get_weather("  ATLANTIS ")
+        assert "  ATLANTIS " in reply and "Atlantis" not in reply
+        assert get_weather("  beijing ") == get_weather("Beijing")
+
+        assert "Zzyzx Qux" in search_web("Zzyzx Qux")
+        hits = get_tool_cache_stats()["search_web"]["hits"]
+        reply = search_web("zzyzx   qux")
+        assert "zzyzx   qux" in reply and "Zzyzx Qux" not in reply
+        assert get_tool_cache_stats()["search_web"]["hits"] == hits + 1
+
+    def test_calculate_cache_keeps_meaning_and_echo(self):
+        """计算结果按表达式含义缓存，回显的表达式来自本次调用"""
+        assert calculate("12") == "计算结果：12 = 12"
+        assert "错误" in calculate("1 2")
+        hits = get_tool_cache_stats()["calculate"]["hits"]
+        assert calculate(" 7 *  6 ") == "计算结果： 7 *  6  = 42"
+        assert calculate("7 * 6") == "计算结果：7 * 6 = 42"
+        assert get_tool_cache_stats()["calculate"]["hits"] == hits + 1
+
+
 class TestAgentGraph:
     """代理图形测试"""
     
@@ -170,8 +410,57 @@ class TestAgentGraph:
         assert "tools" not in graph.nodes
 
 
+class TestGraphCache:
+    """已编译图形缓存测试"""
+
+    def setup_method(self):
+        invalidate_graph_cache()
+
+    def test_fingerprint_is_stable(self):
+        """相同配置的指纹一致，不同配置的指纹不同"""
+        assert config_fingerprint(Configuration()) == config_fingerprint(Configuration())
+        assert config_fingerprint(Configuration()) != config_fingerprint(Configuration(temperature=0.5))
+
+    def test_identical_configs_share_graph(self):
+        """相同配置复用同一个已编译图形"""
+        before = get_graph_cache_stats()
+        app1 = get_agent_graph(Configuration())
+        app2 = get_agent_graph(Configuration())
+        app3 = get_agent_graph(Configuration(enable_weather_tool=False))
+
+        assert app1 is app2
+        assert app1 is not app3
+        stats = get_graph_cache_stats()
+        assert stats["hits"] - before["hits"] == 1
+        assert stats["misses"] - before["misses"] == 2
+
+    def test_invalidate(self):
+        """显式失效后重新构建"""
+        config = Configuration()
+        app1 = get_agent_graph(config)
+        assert invalidate_graph_cache(config) == 1
+        assert get_agent_graph(config) is not app1
+
+    def test_lru_eviction(self):
+        """超过容量时淘汰最久未使用的条目"""
+        cache = GraphCache(max_size=2)
+        a, b, c = (Configuration(temperature=t) for t in (0.1, 0.2, 0.3))
+        cache.get_or_create(a, object)
+        cache.get_or_create(b, object)
+        cache.get_or_create(a, object)  # a 变为最近使用
+        cache.get_or_create(c, object)
+
+        assert cache.get(a) is not None
+        assert cache.get(b) is None
+        assert cache.stats()["evictions"] == 1
+
+
 class TestAgentExecution:
     """代理执行测试"""
+
+    def setup_method(self):
+        # 避免复用其他测试缓存的图形（其中的LLM可能是另一个模拟对象）
+        invalidate_graph_cache()
     
     @patch('agent.graph.ChatOpenAI')
     def test_run_agent_mock(self, mock_openai):
@@ -213,6 +502,1350 @@ class TestAgentExecution:
             assert "异步测试响应" in result
 
 
+    @patch('agent.graph.ChatOpenAI')
+    def test_arun_agent_uses_async_llm(self, mock_openai):
+        """异步运行时代理节点使用LLM的ainvoke"""
+        mock_response = MagicMock()
+        mock_response.content = "异步LLM响应"
+        mock_response.tool_calls = []
+
+        class AsyncLLM:
+            def invoke(self, inputs):
+                raise AssertionError("不应调用同步invoke")
+
+            async def ainvoke(self, inputs):
+                return mock_response
+
+        mock_llm = MagicMock()
+        mock_llm.bind_tools.return_value = AsyncLLM()
+        mock_openai.return_value = mock_llm
+
+        result = asyncio.run(arun_agent("测试查询", Configuration()))
+        assert result == "异步LLM响应"
+
+
+    @patch('agent.graph.ChatOpenAI')
+    def test_run_agent_remembers_thread(self, mock_openai):
+        """相同thread_id的连续调用能看到之前的对话"""
+        seen = []
+
+        def fake_invoke(inputs):
+            seen.append([m.content for m in inputs["messages"]])
+            response = MagicMock()
+            response.content = f"回复{len(seen)}"
+            response.tool_calls = []
+            return response
+
+        mock_llm = MagicMock()
+        mock_llm.bind_tools.return_value.invoke.side_effect = fake_invoke
+        mock_openai.return_value = mock_llm
+
+        config = Configuration()
+        run_agent("第一个问题", config, thread_id="memory_test")
+        run_agent("第二个问题", config, thread_id="memory_test")
+
+        assert seen[1] == ["第一个问题", "回复1", "第二个问题"]
+
+        # 不指定thread_id的调用是无状态的，互相看不到对方的对话
+        run_agent("密码是hunter2", config)
+        run_agent("刚才说了什么", config)
+        assert seen[-1] == ["刚才说了什么"]
+
+
+    @patch('agent.graph.ChatOpenAI')
+    def test_tool_loop_returns_tool_messages(self, mock_openai):
+        """工具调用后LLM能看到对应的ToolMessage"""
+        seen = []
+
+        def fake_invoke(inputs):
+            seen.append(list(inputs["messages"]))
+            response = MagicMock()
+            if len(seen) == 1:
+                response.content = ""
+                response.tool_calls = [
+                    {"name": "get_weather", "args": {"city": "北京"}, "id": "call_1"},
+                    {"name": "calculate", "args": {"expression": "2 + 3"}, "id": "call_2"},
+                ]
+            else:
+                response.content = "完成"
+                response.tool_calls = []
+            return response
+
+        mock_llm = MagicMock()
+        mock_llm.bind_tools.return_value.invoke.side_effect = fake_invoke
+        mock_openai.return_value = mock_llm
+
+        result = run_agent("北京天气和2+3", Configuration(enable_memory=False))
+
+        assert result == "完成"
+        tool_messages = [m for m in seen[1] if isinstance(m, ToolMessage)]
+        assert [m.tool_call_id for m in tool_messages] == ["call_1", "call_2"]
+        assert "晴天" in tool_messages[0].content
+        assert "5" in tool_messages[1].content
+
+
+    @patch('agent.graph.ChatOpenAI')
+    def test_stream_agent_events(self, mock_openai):
+        """流式运行产生工具调用、工具结果、LLM片段和最终回答事件"""
+        calls = []
+
+        class StreamingLLM:
+            def stream(self, inputs):
+                calls.append(inputs)
+                if len(calls) == 1:
+                    yield AIMessageChunk(content="", tool_calls=[
+                        {"name": "calculate", "args": {"expression": "2+3"}, "id": "call_1"}
+                    ])
+                    return
+                for piece in ("结果", "是5"):
+                    yield AIMessageChunk(content=piece)
+
+        mock_llm = MagicMock()
+        mock_llm.bind_tools.return_value = StreamingLLM()
+        mock_openai.return_value = mock_llm
+
+        events = list(stream_agent("2+3", Configuration(enable_memory=False)))
+        types = [event["type"] for event in events]
+
+        assert types == ["tool_call", "node", "tool_result", "node",
+                         "token", "token", "node", "final"]
+        assert events[0]["name"] == "calculate"
+        assert "5" in events[2]["content"]
+        assert [e["content"] for e in events if e["type"] == "token"] == ["结果", "是5"]
+        assert events[-1]["answer"] == "结果是5"
+
+    @patch('agent.graph.ChatOpenAI')
+    def test_astream_agent_falls_back_to_single_chunk(self, mock_openai):
+        """LLM不支持流式输出时整条回答作为一个片段产生"""
+        mock_response = MagicMock()
+        mock_response.content = "完整回答"
+        mock_response.tool_calls = []
+        mock_llm = MagicMock()
+        mock_llm.bind_tools.return_value.invoke.return_value = mock_response
+        mock_openai.return_value = mock_llm
+
+        async def collect():
+            return [event async for event in astream_agent("你好", Configuration())]
+
+        events = asyncio.run(collect())
+        assert events[0] == {"type": "token", "content": "完整回答", "node": "agent"}
+        assert events[-1] == {"type": "final", "answer": "完整回答"}
+
+
+    @patch('agent.graph.ChatOpenAI')
+    def test_run_agent_batch_orders_results_and_isolates_errors(self, mock_openai):
+        """批量运行按输入顺序返回结果，单个失败不影响其他查询"""
+        active = 0
+        peak = 0
+        lock = threading.Lock()
+
+        class SlowLLM:
+            async def ainvoke(self, inputs):
+                nonlocal active, peak
+                query = inputs["messages"][-1].content
+                with lock:
+                    active += 1
+                    peak = max(peak, active)
+                try:
+                    await asyncio.sleep(0.02 if query != "q0" else 0.05)
+                finally:
+                    with lock:
+                        active -= 1
+                response = MagicMock()
+                response.content = f"答:{query}"
+                response.tool_calls = []
+                return response
+
+        mock_llm = MagicMock()
+        mock_llm.bind_tools.return_value = SlowLLM()
+        mock_openai.return_value = mock_llm
+
+        config = Configuration(enable_memory=False)
+        queries = [f"q{i}" for i in range(6)]
+        def flaky_extract(result):
+            if result["messages"][0].content == "q3":
+                raise RuntimeError("坏结果")
+            return result["messages"][-1].content
+
+        with patch('agent.graph._extract_answer', side_effect=flaky_extract):
+            results = run_agent_batch(queries, config, max_concurrency=2)
+
+        assert [r["index"] for r in results] == list(range(6))
+        assert results[0]["answer"] == "答:q0"
+        assert results[3]["answer"] is None
+        assert "坏结果" in results[3]["error"]
+        assert all(r["elapsed"] > 0 for r in results)
+        assert peak == 2
+
+    def test_arun_agent_batch_admits_each_query(self):
+        """每个查询单独经过准入，未被接纳的查询记为该项的错误"""
+        controller = AdmissionController(max_in_flight=1, max_queue=0)
+        config = Configuration(model_provider="fake", enable_memory=False)
+
+        def admit():
+            return controller.admit("batch")
+
+        async def main():
+            # 名额被占满时查询被拒绝，归还名额后正常执行
+            await controller.acquire()
+            try:
+                results = await arun_agent_batch(["a"], config, admit=admit)
+            finally:
+                controller.release()
+            return results + await arun_agent_batch(["b", "c"], config, max_concurrency=1, admit=admit)
+
+        results = asyncio.run(main())
+        assert "QueueFull" in results[0]["error"] and results[0]["answer"] is None
+        assert all(r["error"] is None for r in results[1:])
+        assert controller.in_flight == 0
+
+    def test_arun_agent_batch_validates_thread_ids(self):
+        with pytest.raises(ValueError):
+            asyncio.run(arun_agent_batch(["a", "b"], Configuration(), thread_ids=["t1"]))
+
+
+class TestBatchFile:
+    """JSONL批量处理测试"""
+
+    def _write_input(self, path, count):
+        lines = [json.dumps({"id": f"id{i}", "query": f"q{i}"}, ensure_ascii=False)
+                 for i in range(count)]
+        lines[2] = ""
+        lines[3] = "不是JSON"
+        path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    def _read_output(self, path):
+        return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+    def test_processes_file_and_reports_stats(self, tmp_path):
+        source, target = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+        self._write_input(source, 20)
+
+        async def fake_invoke(app, query, config, thread_id):
+            await asyncio.sleep(0.001)
+            return f"答:{query}"
+
+        with patch('agent.batch._ainvoke_agent', side_effect=fake_invoke), \
+                patch('agent.batch.get_agent_graph'):
+            stats = run_batch_file(str(source), str(target), concurrency=4, report_interval=0)
+
+        records = {r["line"]: r for r in self._read_output(target)}
+        assert sorted(records) == [i for i in range(20) if i != 2]
+        assert records[0]["answer"] == "答:q0"
+        assert records[0]["id"] == "id0"
+        assert records[3]["answer"] is None and records[3]["error"]
+        assert stats["completed"] == 19
+        assert stats["errors"] == 1
+        assert stats["latency_p50"] > 0
+
+    def test_resumes_after_crash(self, tmp_path):
+        source, target = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+        self._write_input(source, 30)
+        calls = []
+
+        class Crash(BaseException):
+            pass
+
+        async def crashing_invoke(app, query, config, thread_id):
+            calls.append(query)
+            if len(calls) > 10:
+                raise Crash()
+            return query
+
+        with patch('agent.batch._ainvoke_agent', side_effect=crashing_invoke), \
+                patch('agent.batch.get_agent_graph'):
+            with pytest.raises(Crash):
+                run_batch_file(str(source), str(target), concurrency=3, report_interval=0)
+        first = self._read_output(target)
+        # 模拟崩溃时写了一半的记录
+        with open(target, "ab") as f:
+            f.write(b'{"line": 2')
+
+        async def fake_invoke(app, query, config, thread_id):
+            calls.append(query)
+            return query
+
+        calls.clear()
+        with patch('agent.batch._ainvoke_agent', side_effect=fake_invoke), \
+                patch('agent.batch.get_agent_graph'):
+            stats = run_batch_file(str(source), str(target), concurrency=3, report_interval=0)
+
+        lines = [r["line"] for r in self._read_output(target)]
+        assert sorted(lines) == [i for i in range(30) if i != 2]
+        done_first = {r["line"] for r in first}
+        # 已完成的行不会重复执行
+        assert sorted(int(q[1:]) for q in calls) == [
+            i for i in range(30) if i not in done_first and i not in (2, 3)
+        ]
+        assert stats["skipped"] >= len(first)
+
+    def test_slow_line_pauses_reading(self, tmp_path):
+        """水位线停在慢的行上时，读入的行数不超过max_ahead"""
+        source, target = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+        self._write_input(source, 40)
+        started = []
+        before_slow_done = []
+
+        async def fake_invoke(app, query, config, thread_id):
+            started.append(int(query[1:]))
+            if query == "q0":
+                await asyncio.sleep(0.05)
+                before_slow_done.extend(started)
+            return query
+
+        with patch('agent.batch._ainvoke_agent', side_effect=fake_invoke), \
+                patch('agent.batch.get_agent_graph'):
+            stats = run_batch_file(str(source), str(target), concurrency=2,
+                                   report_interval=0, max_ahead=6)
+
+        assert max(before_slow_done) < 6
+        assert stats["completed"] == 39
+        with pytest.raises(ValueError):
+            BatchRunner(str(source), str(target), concurrency=4, max_ahead=2)
+
+    def test_latency_histogram_percentiles(self):
+        histogram = LatencyHistogram()
+        for i in range(1, 101):
+            histogram.record(i / 100)
+        assert histogram.percentile(50) == pytest.approx(0.5, rel=0.05)
+        assert histogram.percentile(99) == pytest.approx(0.99, rel=0.05)
+        assert histogram.percentile(100) == 1.0
+
+
+TOOL_SCRIPT_FOR_TESTS = [
+    {"tool_calls": [{"name": "calculate", "args": {"expression": "6*7"}}]},
+    "答案是42",
+]
+
+
+class TestFakeLLM:
+    """离线假模型测试"""
+
+    def setup_method(self):
+        invalidate_graph_cache()
+
+    def test_scripted_tool_loop(self):
+        config = Configuration(
+            model_provider="fake",
+            enable_memory=False,
+            fake_llm_options={"responses": TOOL_SCRIPT_FOR_TESTS},
+        )
+        events = list(stream_agent("6乘7", config))
+        assert [e["type"] for e in events if e["type"] != "token"] == [
+            "tool_call", "node", "tool_result", "node", "node", "final"
+        ]
+        assert "42" in events[2]["content"]
+        assert events[-1]["answer"] == "答案是42"
+        # 按对话位置选取回答，重复运行结果相同
+        assert run_agent("6乘7", config) == "答案是42"
+
+    def test_seeded_responses_are_deterministic(self):
+        tools = get_enabled_tools(Configuration())
+        a = FakeChatModel(seed=7, tool_call_rate=0.0).bind_tools(tools)
+        b = FakeChatModel(seed=7, tool_call_rate=0.0).bind_tools(tools)
+        inputs = {"messages": [HumanMessage(content="介绍一下LangGraph")]}
+        assert a.invoke(inputs).content == b.invoke(inputs).content
+        assert "介绍一下LangGraph" in a.invoke(inputs).content
+
+        caller = FakeChatModel(seed=7, tool_call_rate=1.0).bind_tools(tools)
+        call = caller.invoke(inputs).tool_calls[0]
+        assert call["name"] in {"get_weather", "search_web", "calculate"}
+        assert list(call["args"].values()) == ["介绍一下LangGraph"]
+
+    def test_streaming_rate_and_errors(self):
+        model = FakeChatModel(responses=["一二三四五"], tokens_per_second=200)
+        inputs = {"messages": [HumanMessage(content="hi")]}
+        started = time.perf_counter()
+        chunks = list(model.stream(inputs))
+        assert [c.content for c in chunks] == list("一二三四五")
+        assert time.perf_counter() - started >= 4 / 200
+
+        failing = FakeChatModel(responses=["x"], error_rate=1.0)
+        with pytest.raises(FakeLLMError):
+            failing.invoke(inputs)
+        config = Configuration(model_provider="fake", enable_memory=False,
+                               fake_llm_options={"error_rate": 1.0})
+        assert "模拟的模型调用失败" in run_agent("hi", config)
+
+    def test_node_timing_and_trace_export(self, tmp_path):
+        path = tmp_path / "spans.jsonl"
+        config = Configuration(
+            model_provider="fake",
+            enable_memory=False,
+            trace_export_path=str(path),
+            fake_llm_options={"responses": TOOL_SCRIPT_FOR_TESTS},
+        )
+        before = get_node_latency_stats().get("tools", {}).get("count", 0)
+        assert run_agent("6乘7", config) == "答案是42"
+
+        assert get_node_latency_stats()["tools"]["count"] == before + 1
+        flush_trace_exports()
+        spans = json.loads(path.read_text(encoding="utf-8"))[
+            "resourceSpans"][0]["scopeSpans"][0]["spans"]
+        assert [s["name"] for s in spans] == ["agent run", "node agent", "node tools", "node agent"]
+
+    def test_latency_distributions(self):
+        import random
+        rng = random.Random(0)
+        assert make_sampler(0.25)(rng) == 0.25
+        samples = [make_sampler({"distribution": "uniform", "low": 0.1, "high": 0.2})(rng)
+                   for _ in range(100)]
+        assert all(0.1 <= x <= 0.2 for x in samples)
+        assert make_sampler({"distribution": "lognormal", "median": 0.1, "sigma": 0.5})(rng) > 0
+        with pytest.raises(ValueError):
+            make_sampler({"distribution": "pareto"})
+
+
+class TestRunLimits:
+    """最大迭代次数与运行时间限制测试"""
+
+    def setup_method(self):
+        invalidate_graph_cache()
+
+    def _looping_config(self, **kwargs):
+        # 每次都要求调用工具的模型，不加限制时永远不会结束
+        return Configuration(
+            model_provider="fake",
+            enable_memory=False,
+            fake_llm_options={"responses": [
+                {"content": "正在计算", "tool_calls": [
+                    {"name": "calculate", "args": {"expression": "1+1"}}]},
+            ]},
+            **kwargs,
+        )
+
+    def test_max_iterations_returns_partial_answer(self):
+        config = self._looping_config(max_iterations=3)
+        answer = run_agent("算一下", config)
+        assert answer.startswith("已达到最大迭代次数（3）")
+        assert answer.endswith("正在计算")
+        assert asyncio.run(arun_agent("算一下", config)) == answer
+
+        events = list(stream_agent("算一下", config))
+        assert events[-1]["type"] == "final"
+        assert events[-1]["stopped"] == "max_iterations"
+        assert len([e for e in events if e["type"] == "tool_call"]) == 3
+
+        results = run_agent_batch(["a", "b"], config)
+        assert [r["error"] for r in results] == [None, None]
+        assert all(r["answer"].startswith("已达到最大迭代次数") for r in results)
+
+    def test_run_timeout_returns_partial_answer(self):
+        config = Configuration(
+            model_provider="fake",
+            enable_memory=False,
+            run_timeout=0.05,
+            fake_llm_options={"responses": ["太慢了"], "latency": 5},
+        )
+        started = time.perf_counter()
+        answer = asyncio.run(arun_agent("hi", config))
+        assert time.perf_counter() - started < 1
+        assert answer == "已超过运行时间限制（0.05秒），未能得到完整的回答。"
+
+        events = list(stream_agent("hi", self._looping_config(run_timeout=0.0)))
+        assert events[-1]["stopped"] == "timeout"
+
+    def test_llm_timeout_and_request_timeout(self):
+        config = Configuration(
+            model_provider="fake",
+            enable_memory=False,
+            llm_timeout=0.05,
+            fake_llm_options={"responses": ["太慢了"], "latency": 5},
+        )
+        started = time.perf_counter()
+        assert asyncio.run(arun_agent("hi", config)) == "抱歉，模型调用超时（0.05秒）"
+        assert time.perf_counter() - started < 1
+
+        # 单次请求的超时优先于配置，剩余时间短于llm_timeout时按运行超时处理
+        slow = Configuration(
+            model_provider="fake",
+            enable_memory=False,
+            run_timeout=60,
+            llm_timeout=30,
+            fake_llm_options={"responses": ["太慢了"], "latency": 5},
+        )
+        started = time.perf_counter()
+        answer = asyncio.run(arun_agent("hi", slow, timeout=0.05))
+        assert time.perf_counter() - started < 1
+        assert answer.startswith("已超过运行时间限制（0.05秒）")
+
+    def test_streaming_llm_call_stops_at_deadline(self):
+        config = Configuration(
+            model_provider="fake",
+            enable_memory=False,
+            fake_llm_options={"responses": ["一二三四五六七八九十" * 10], "tokens_per_second": 100},
+        )
+        started = time.perf_counter()
+        events = list(stream_agent("hi", config, timeout=0.1))
+        assert time.perf_counter() - started < 0.5
+        assert events[-1]["stopped"] == "timeout"
+        assert 0 < len([e for e in events if e["type"] == "token"]) < 100
+
+
+class TestHedging:
+    """LLM对冲与降级测试"""
+
+    HI = {"messages": [HumanMessage(content="hi")]}
+
+    def _pair(self, primary_latency=0.5, **kwargs):
+        return HedgedChatModel([
+            ("primary", FakeChatModel(responses=["慢"], latency=primary_latency)),
+            ("secondary", FakeChatModel(responses=["快"])),
+        ], **kwargs)
+
+    def test_hedge_wins_when_primary_is_slow(self):
+        model = self._pair(delay=0.05)
+        for call in (model.invoke, lambda inputs: asyncio.run(model.ainvoke(inputs))):
+            started = time.perf_counter()
+            assert call(self.HI).content == "快"
+            assert time.perf_counter() - started < 0.3
+
+        stats = model.get_stats()
+        assert stats["requests"] == 2
+        assert stats["hedged"] == 2
+        assert stats["hedge_won"] == 2
+        # 主模型在延迟内返回时不触发对冲
+        fast = self._pair(primary_latency=0.0, delay=0.2)
+        assert fast.invoke(self.HI).content == "慢"
+        assert fast.get_stats()["hedged"] == 0
+
+    def test_loser_is_cancelled(self):
+        cancelled = []
+
+        class Hanging(FakeChatModel):
+            async def ainvoke(self, inputs):
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    cancelled.append(True)
+                    raise
+
+        model = HedgedChatModel([("a", Hanging()), ("b", FakeChatModel(responses=["快"]))],
+                                delay=0.01)
+
+        async def main():
+            result = await model.ainvoke(self.HI)
+            await asyncio.sleep(0)
+            return result
+
+        assert asyncio.run(main()).content == "快"
+        assert cancelled == [True]
+
+    def test_fallback_on_errors(self):
+        model = HedgedChatModel([
+            ("broken", FakeChatModel(responses=["x"], error_rate=1.0)),
+            ("backup", FakeChatModel(responses=["备用"])),
+        ], hedge=False)
+        assert model.invoke(self.HI).content == "备用"
+        assert asyncio.run(model.ainvoke(self.HI)).content == "备用"
+        assert model.get_stats()["fallback"] == 2
+        assert model.get_stats()["hedged"] == 0
+
+        failing = HedgedChatModel([
+            ("a", FakeChatModel(error_rate=1.0)),
+            ("b", FakeChatModel(error_rate=1.0)),
+        ])
+        with pytest.raises(FakeLLMError):
+            failing.invoke(self.HI)
+        assert failing.get_stats()["failed"] == 1
+
+    def test_streams_hedge_on_first_chunk(self):
+        model = self._pair(delay=0.05)
+        started = time.perf_counter()
+        assert [c.content for c in model.stream(self.HI)] == ["快"]
+        assert time.perf_counter() - started < 0.3
+
+        async def collect():
+            return [c.content async for c in model.astream(self.HI)]
+
+        assert asyncio.run(collect()) == ["快"]
+        assert model.get_stats()["hedge_won"] == 2
+
+    def test_percentile_delay(self):
+        window = LatencyWindow(size=100, percentile=90, min_samples=10)
+        for i in range(9):
+            window.record(i / 100)
+        assert window.value() is None
+        for i in range(9, 100):
+            window.record(i / 100)
+        assert window.value() == pytest.approx(0.89, abs=0.1)
+
+        model = self._pair(default_delay=0.3, min_samples=10)
+        assert model.hedge_delay() == 0.3
+        assert self._pair(hedge=False).hedge_delay() is None
+
+    def test_configured_from_configuration(self):
+        invalidate_graph_cache()
+        config = Configuration(
+            model_provider="fake",
+            enable_memory=False,
+            fake_llm_options={"responses": ["慢"], "latency": 1},
+            fallback_models=[{"model_name": "backup", "fake_llm_options": {"responses": ["快"]}}],
+            hedge_delay=0.05,
+        )
+        started = time.perf_counter()
+        assert run_agent("hi", config) == "快"
+        assert time.perf_counter() - started < 0.5
+        rendered = metrics.render_metrics()
+        assert 'agent_llm_hedge_events_total{model="fake:gpt-4o-mini",event="hedge_won"}' in rendered
+        with pytest.raises(ValueError):
+            create_llm(Configuration(model_provider="fake", fallback_models=[{"no_such_field": 1}]))
+
+
+class TestLLMCache:
+    """模型回答缓存测试"""
+
+    def _cached(self, cache, **kwargs):
+        model = FakeChatModel(**kwargs)
+        return model, CachedChatModel(model, cache, {"model": "fake", "temperature": 0})
+
+    def test_memory_hits_ignore_whitespace_and_tool_call_ids(self):
+        model, cached = self._cached(LLMResponseCache(), seed=1)
+        first = cached.invoke({"messages": [HumanMessage(content="什么是  LangGraph？")]})
+        second = cached.invoke({"messages": [HumanMessage(content=" 什么是 LangGraph？\n")]})
+        assert second.content == first.content
+        assert model.calls == 1
+        assert asyncio.run(cached.ainvoke(
+            {"messages": [HumanMessage(content="什么是 LangGraph？")]})).content == first.content
+        assert model.calls == 1
+        assert cached.cache.stats()["memory_hits"] == 2
+
+        namespace = {"model": "fake"}
+        history = [AIMessageChunk(content="", tool_calls=[{"name": "calculate", "args": {"x": 1}, "id": "a"}]),
+                   ToolMessage(content="1", tool_call_id="a", name="calculate")]
+        other = [AIMessageChunk(content="", tool_calls=[{"name": "calculate", "args": {"x": 1}, "id": "b"}]),
+                 ToolMessage(content="1", tool_call_id="b", name="calculate")]
+        assert cache_key(namespace, history) == cache_key(namespace, other)
+        assert cache_key(namespace, history) != cache_key({"model": "other"}, history)
+
+    def test_tools_are_part_of_the_key(self):
+        model, cached = self._cached(LLMResponseCache(), seed=1, tool_call_rate=0.0)
+        inputs = {"messages": [HumanMessage(content="hi")]}
+        cached.bind_tools([calculate]).invoke(inputs)
+        cached.bind_tools([calculate]).invoke(inputs)
+        cached.bind_tools([calculate, get_weather]).invoke(inputs)
+        assert model.calls == 2
+
+    def test_ttl_and_lru(self):
+        cache = LLMResponseCache(maxsize=2, ttl=0.05)
+        for key in ("a", "b", "c"):
+            cache.put(key, AIMessage(content=key))
+        assert cache.get("a") is None
+        assert cache.get("c").content == "c"
+        time.sleep(0.06)
+        assert cache.get("c") is None
+        stats = cache.stats()
+        assert stats["evictions"] == 1
+        assert stats["expirations"] == 1
+        assert stats["misses"] == 2
+
+    def test_sqlite_tier_survives_restart(self, tmp_path):
+        path = str(tmp_path / "llm_cache.sqlite")
+        model, cached = self._cached(LLMResponseCache(path=path), responses=[
+            {"content": "", "tool_calls": [{"name": "calculate", "args": {"expression": "1+1"}}]}
+        ])
+        inputs = {"messages": [HumanMessage(content="1+1")]}
+        original = cached.invoke(inputs)
+
+        restarted = LLMResponseCache(path=path)
+        model2, cached2 = self._cached(restarted, responses=["不应调用"])
+        restored = cached2.invoke(inputs)
+        assert model2.calls == 0
+        assert restored.tool_calls == original.tool_calls
+        assert isinstance(restored, AIMessage)
+        cached2.invoke(inputs)
+        assert restarted.stats()["disk_hits"] == 1
+        assert restarted.stats()["memory_hits"] == 1
+
+        expired = LLMResponseCache(path=path, ttl=0.01)
+        expired.put("k", AIMessage(content="x"))
+        time.sleep(0.02)
+        assert expired.purge_expired() == 1
+
+    def test_async_paths_keep_sqlite_off_the_loop(self, tmp_path):
+        """异步调用时磁盘层的读写在线程池中执行"""
+        path = str(tmp_path / "llm_cache.sqlite")
+        cache = LLMResponseCache(path=path)
+        threads = []
+        disk_get, disk_put = cache._disk_get, cache._disk_put
+        cache._disk_get = lambda *args: threads.append(threading.get_ident()) or disk_get(*args)
+        cache._disk_put = lambda *args: threads.append(threading.get_ident()) or disk_put(*args)
+        model, cached = self._cached(cache, responses=["一二三"])
+        inputs = {"messages": [HumanMessage(content="数数")]}
+
+        async def main():
+            first = await cached.ainvoke(inputs)
+            streamed = [c.content async for c in cached.astream({"messages": [HumanMessage(content="再数")]})]
+            return threading.get_ident(), first, streamed
+
+        loop_thread, first, streamed = asyncio.run(main())
+        assert first.content == "一二三"
+        assert len(threads) == 4 and loop_thread not in threads
+        restored = LLMResponseCache(path=path)
+        assert restored.get(cached._key(inputs)).content == "一二三"
+        assert cache.stats()["stores"] == 2
+
+    def test_stream_caches_complete_output(self):
+        model, cached = self._cached(LLMResponseCache(), responses=["一二三"])
+        inputs = {"messages": [HumanMessage(content="数数")]}
+        assert [c.content for c in cached.stream(inputs)] == ["一", "二", "三"]
+
+        async def collect():
+            return [c.content async for c in cached.astream(inputs)]
+
+        assert asyncio.run(collect()) == ["一二三"]
+        assert model.calls == 1
+
+    def test_configuration_and_temperature_bypass(self):
+        invalidate_graph_cache()
+        base = dict(model_provider="fake", enable_memory=False, enable_llm_cache=True,
+                    fake_llm_options={"responses": TOOL_SCRIPT_FOR_TESTS, "latency": 0.05})
+        assert not isinstance(create_llm(Configuration(**base)), CachedChatModel)
+        assert isinstance(create_llm(Configuration(**base, temperature=0.0)), CachedChatModel)
+        assert isinstance(create_llm(Configuration(
+            **base, llm_cache_nonzero_temperature=True)), CachedChatModel)
+
+        config = Configuration(**base, temperature=0.0)
+        assert run_agent("6乘7", config) == "答案是42"
+        started = time.perf_counter()
+        assert run_agent("6乘7", config) == "答案是42"
+        assert time.perf_counter() - started < 0.05
+        assert get_llm_cache_stats()["memory"]["hits"] >= 2
+        assert 'agent_llm_cache{cache="memory",stat="memory_hits"}' in metrics.render_metrics()
+
+
+class TestSingleFlight:
+    """并发请求合并测试"""
+
+    def test_concurrent_calls_share_one_execution(self):
+        flights = SingleFlight("test")
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            return "结果"
+
+        async def main():
+            results = await asyncio.gather(*(flights.do("k", work) for _ in range(5)))
+            assert len(flights) == 0
+            # 执行结束后不再合并，新的调用会重新执行
+            results.append(await flights.do("k", work))
+            return results
+
+        assert asyncio.run(main()) == ["结果"] * 6
+        assert len(calls) == 2
+        assert flights.saved == 4
+        assert 'agent_coalesced_calls_total{name="test"} 4' in metrics.render_metrics()
+
+    def test_joiners_receive_leader_context(self):
+        """合并到进行中的执行时，等待者拿到发起者的context"""
+        flights = SingleFlight("test_context")
+        joined = []
+
+        async def work():
+            await asyncio.sleep(0.01)
+            return "结果"
+
+        async def main():
+            return await asyncio.gather(*(
+                flights.do("k", work, context=i, on_join=joined.append) for i in range(3)
+            ))
+
+        assert asyncio.run(main()) == ["结果"] * 3
+        assert joined == [0, 0]
+
+    def test_errors_reach_every_waiter(self):
+        flights = SingleFlight("test_errors")
+
+        async def broken():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        async def main():
+            return await asyncio.gather(*(flights.do("k", broken) for _ in range(3)),
+                                        return_exceptions=True)
+
+        errors = asyncio.run(main())
+        assert all(isinstance(e, ValueError) for e in errors)
+
+    def test_cancellation_only_stops_shared_work_when_everyone_left(self):
+        flights = SingleFlight("test_cancel")
+        cancelled = []
+
+        async def work():
+            try:
+                await asyncio.sleep(0.05)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+            return "完成"
+
+        async def main():
+            first = asyncio.ensure_future(flights.do("k", work))
+            second = asyncio.ensure_future(flights.do("k", work))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            assert await second == "完成"
+            assert cancelled == []
+
+            lone = asyncio.ensure_future(flights.do("k", work))
+            await asyncio.sleep(0.01)
+            lone.cancel()
+            await asyncio.sleep(0.01)
+            assert cancelled == [True]
+            assert len(flights) == 0
+
+        asyncio.run(main())
+
+    def test_query_key_normalization(self):
+        config = Configuration(model_provider="fake")
+        assert query_key("北京 天气", config) == query_key("  北京   天气\n", config)
+        assert query_key("北京天气", config) != query_key("北京天气", config, timeout=5)
+        assert query_key("北京天气", config) != query_key(
+            "北京天气", Configuration(model_provider="fake", temperature=0.5))
+
+
+class TestRateLimit:
+    """LLM调用限流测试"""
+
+    class RateLimitError(Exception):
+        status_code = 429
+
+        def __init__(self, retry_after):
+            super().__init__("rate limited")
+            self.response = MagicMock(status_code=429, headers={"retry-after": str(retry_after)})
+
+    def test_estimate_tokens(self):
+        messages = [HumanMessage(content="北京天气"), AIMessage(content="abcdefgh")]
+        assert estimate_tokens(messages, max_tokens=100) == (4 + 4) + (2 + 4) + 100
+        assert estimate_tokens([], None) == 256
+
+    def test_bucket_reserves_in_order_and_respects_max_wait(self):
+        limiter = RateLimiter("test:bucket", rpm=60, burst=2)
+        assert limiter.reserve(10) == 0
+        assert limiter.reserve(10) == 0
+        with pytest.raises(RateLimitTimeout):
+            limiter.reserve(10, max_wait=0.1)
+        # 超时的预约不占用配额
+        assert limiter.reserve(10) == pytest.approx(1.0, abs=0.05)
+        assert limiter.reserve(10) == pytest.approx(2.0, abs=0.05)
+
+    def test_token_bucket_settles_actual_usage(self):
+        limiter = RateLimiter("test:tokens", tpm=600, burst=10)
+        assert limiter.reserve(100) == 0
+        assert limiter.reserve(10) > 0
+        limiter.settle(100, 20)
+        assert limiter.stats()["tokens"] == pytest.approx(-10 + 80, abs=1)
+
+    def test_quota_is_shared_through_the_state_file(self, tmp_path):
+        path = str(tmp_path / "limits.db")
+        # 两个实例各自打开连接，相当于两个工作进程
+        first = RateLimiter("test:shared", rpm=60, path=path, burst=1)
+        second = RateLimiter("test:shared", rpm=60, path=path, burst=1)
+        assert first.reserve(1) == 0
+        assert second.reserve(1) == pytest.approx(1.0, abs=0.05)
+        first.penalize(retry_after=5)
+        stats = second.stats()
+        assert stats["scale"] == 0.5
+        assert stats["blocked_for"] == pytest.approx(5, abs=0.1)
+
+    def test_wrapper_adapts_to_429(self):
+        limiter = RateLimiter("test:adaptive", rpm=600, burst=10)
+        model = MagicMock()
+        model.invoke.side_effect = self.RateLimitError(retry_after=0)
+        limited = RateLimitedChatModel(model, limiter)
+        assert is_rate_limit_error(model.invoke.side_effect)
+        with pytest.raises(self.RateLimitError):
+            limited.invoke({"messages": [HumanMessage(content="hi")]})
+        assert limiter.stats()["scale"] == 0.5
+
+        model.invoke.side_effect = None
+        model.invoke.return_value = AIMessage(content="ok")
+        assert limited.invoke({"messages": [HumanMessage(content="hi")]}).content == "ok"
+        assert limiter.stats()["scale"] == pytest.approx(0.55)
+        assert 'agent_llm_rate_limited_total{model="test:adaptive"} 1' in metrics.render_metrics()
+
+    def test_async_paths_keep_sqlite_off_the_loop(self, tmp_path):
+        """异步调用时SQLite事务在线程池中执行"""
+        limiter = RateLimiter("test:async", rpm=600, path=str(tmp_path / "limits.db"))
+        threads = []
+        transact = limiter._store.transact
+
+        def recording(key, update):
+            threads.append(threading.get_ident())
+            return transact(key, update)
+
+        limiter._store.transact = recording
+        limiter._scale = 0.5
+        limited = RateLimitedChatModel(FakeChatModel(responses=["ok"]), limiter)
+        inputs = {"messages": [HumanMessage(content="hi")]}
+
+        async def main():
+            loop_thread = threading.get_ident()
+            assert (await limited.ainvoke(inputs)).content == "ok"
+            chunks = [chunk async for chunk in limited.astream(inputs)]
+            return loop_thread, chunks
+
+        loop_thread, chunks = asyncio.run(main())
+        assert "".join(c.content for c in chunks) == "ok"
+        assert threads and loop_thread not in threads
+
+    def test_create_llm_wraps_limited_models(self):
+        config = Configuration(model_provider="fake", llm_rpm=600)
+        llm = create_llm(config)
+        assert isinstance(llm, RateLimitedChatModel)
+        assert llm.limiter is create_llm(config).limiter
+        assert not isinstance(create_llm(Configuration(model_provider="fake")), RateLimitedChatModel)
+        assert asyncio.run(arun_agent("你好", config))
+
+
+class _StubLLMHandler(BaseHTTPRequestHandler):
+    """本地桩服务：记录每个请求使用的客户端端口，``/drop`` 在响应后静默关闭连接"""
+
+    protocol_version = "HTTP/1.1"
+    ports = []
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        type(self).ports.append(self.client_address[1])
+        if self.path.endswith("/slow"):
+            time.sleep(0.05)
+        payload = json.dumps({"echo": body.decode("utf-8")}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        if self.path.endswith("/drop"):
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class TestContextWindow:
+    """上下文窗口截断测试"""
+
+    @staticmethod
+    def _turn(i):
+        return [
+            HumanMessage(content=f"问题{i}" * 10),
+            AIMessage(content="", tool_calls=[{"name": "calculate", "args": {"expression": "1+1"},
+                                               "id": f"c{i}"}]),
+            ToolMessage(content="2" * 40, tool_call_id=f"c{i}", name="calculate"),
+            AIMessage(content=f"回答{i}" * 10),
+        ]
+
+    def test_counts_only_new_messages(self):
+        messages = self._turn(0)
+        totals = extend_totals(messages, [])
+        assert totals[-1] == sum(message_tokens(m) for m in messages)
+        messages += self._turn(1)
+        with patch("agent.context.message_tokens", wraps=message_tokens) as counter:
+            new = extend_totals(messages, totals)
+        assert counter.call_count == 4 and len(new) == 4
+        assert new[-1] == sum(message_tokens(m) for m in messages)
+
+    def test_trim_keeps_latest_turn_and_tool_results(self):
+        history = self._turn(0) + self._turn(1) + self._turn(2)[:3]
+        totals = extend_totals(history, [])
+        window = ContextWindow(max_tokens=totals[-1] - totals[5])
+        trimmed = window.trim(history, totals)
+        # 保留的部分不以工具结果开头，并且包含最近的用户消息、工具调用和工具结果
+        assert not isinstance(trimmed[0], ToolMessage)
+        assert trimmed[-3:] == history[-3:]
+        assert sum(message_tokens(m) for m in trimmed) <= window.budget
+
+        # 预算小于固定保留的内容时，仍然发送最近一轮
+        tiny = ContextWindow(max_tokens=1).trim(history, totals)
+        assert tiny == history[-3:]
+        assert ContextWindow(max_tokens=10**6).trim(history, totals) == history
+
+    def test_prefix_sums_view(self):
+        """前缀和视图与拼接后的列表一致，不复制已保存的部分"""
+        history = self._turn(0) + self._turn(1)
+        totals = extend_totals(history, [])
+        saved = totals[:5]
+        view = PrefixSums(saved, extend_totals(history, saved), len(history))
+        assert list(view) == totals and view[-1] == totals[-1] and view[2:4] == totals[2:4]
+        window = ContextWindow(max_tokens=totals[-1] - totals[3])
+        assert window.trim(history, view) == window.trim(history, totals)
+        # 保存的前缀和比消息长时截到消息数
+        assert list(PrefixSums(totals, [], 3)) == totals[:3]
+        with pytest.raises(IndexError):
+            view[len(history)]
+
+    def test_keep_first_and_compact(self):
+        history = self._turn(0) + self._turn(1) + self._turn(2)
+        totals = extend_totals(history, [])
+        window = ContextWindow(max_tokens=totals[-1] - totals[3], keep_first=True)
+        kept, kept_totals = window.compact(history, totals)
+        assert kept[0] is history[0]
+        assert kept[-4:] == history[-4:]
+        assert len(kept) < len(history)
+        assert kept_totals == extend_totals(kept, [])
+        assert kept_totals[-1] <= window.budget
+
+    @patch('agent.graph.ChatOpenAI')
+    def test_agent_sends_trimmed_context(self, mock_openai):
+        invalidate_graph_cache()
+        sent = []
+
+        def reply(inputs):
+            sent.append(list(inputs["messages"]))
+            return AIMessage(content="好的" * 20)
+
+        mock_llm = MagicMock()
+        mock_llm.bind_tools.return_value.invoke.side_effect = reply
+        mock_openai.return_value = mock_llm
+        config = Configuration(system_prompt="助手", max_tokens=10, max_context_tokens=150,
+                               enable_weather_tool=False, enable_search_tool=False,
+                               enable_calculator_tool=False)
+        for i in range(8):
+            run_agent(f"第{i}个问题" * 5, config, thread_id="context-window")
+        app = create_agent_graph(config)
+        state = app.get_state({"configurable": {"thread_id": "context-window"}})
+        assert len(state["messages"]) == 16
+        assert state["token_totals"] == extend_totals(state["messages"][:15], [])
+        assert len(sent[-1]) < 15
+        assert sent[-1][-1].content == "第7个问题" * 5
+        assert sum(message_tokens(m) for m in sent[-1]) <= ContextWindow.from_config(config).budget
+
+
+class TestHTTPClients:
+    """模型API连接池测试"""
+
+    @pytest.fixture
+    def server(self):
+        _StubLLMHandler.ports = []
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _StubLLMHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield f"http://127.0.0.1:{server.server_address[1]}/v1"
+        server.shutdown()
+        server.server_close()
+
+    def test_sequential_requests_reuse_one_connection(self, server):
+        pool = KeepAlivePool(server)
+        for i in range(5):
+            response = pool.request("POST", "/chat", body=str(i).encode())
+            assert response.status_code == 200
+            assert json.loads(response.content) == {"echo": str(i)}
+        stats = pool.stats()
+        assert stats["connections_opened"] == 1
+        assert stats["connections_reused"] == 4
+        assert stats["idle"] == 1 and stats["in_use"] == 0
+        assert len(set(_StubLLMHandler.ports)) == 1
+        pool.close()
+
+    def test_concurrency_is_bounded_by_pool_size(self, server):
+        pool = KeepAlivePool(server, max_connections=2)
+        threads = [threading.Thread(target=pool.request, args=("POST", "/slow")) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = pool.stats()
+        assert stats["requests"] == 6
+        assert stats["peak_in_use"] == 2
+        assert stats["connections_opened"] == 2
+        assert len(set(_StubLLMHandler.ports)) == 2
+        pool.close()
+
+    def test_connection_closed_by_server_is_replaced(self, server):
+        pool = KeepAlivePool(server)
+        pool.request("POST", "/drop")
+        time.sleep(0.05)
+        # 复用的连接已被服务端关闭，换新连接重试
+        assert pool.request("POST", "/chat", body=b"again").status_code == 200
+        assert pool.stats()["connections_opened"] == 2
+        pool.close()
+
+    def test_registry_shares_pools_per_key(self, server):
+        try:
+            first = get_http_client("openai", "sk-one", server)
+            assert get_http_client("OpenAI", "sk-one", server + "/") is first
+            assert get_http_client("openai", "sk-two", server) is not first
+            assert first.request("POST", "/chat").status_code == 200
+            stats = get_http_client_stats()
+            assert f"openai {server}" in stats
+            assert "sk-one" not in json.dumps(stats)
+            assert f'agent_http_pool{{pool="openai {server}",stat="requests"}} 1' \
+                in metrics.render_metrics()
+        finally:
+            close_http_clients()
+        assert get_http_client_stats() == {}
+
+    def test_httpx_pool_reuses_connections(self, server):
+        """SDK使用的httpx客户端复用keep-alive连接"""
+        pytest.importorskip("httpx")
+        pool = HTTPXPool(server, http2=False)
+        for i in range(5):
+            response = pool.request("POST", "/chat", body=str(i).encode())
+            assert response.json() == {"echo": str(i)}
+        stats = pool.stats()
+        assert stats["requests"] == 5 and stats["in_use"] == 0
+        assert stats["connections"] == 1 and stats["idle"] == 1
+        assert len(set(_StubLLMHandler.ports)) == 1
+        pool.close()
+
+    def test_httpx_pool_in_use_survives_failures(self):
+        """连接失败的请求同样归还in_use计数"""
+        httpx = pytest.importorskip("httpx")
+        pool = HTTPXPool("http://127.0.0.1:9/v1", http2=False, timeout=1.0)
+        with pytest.raises(httpx.HTTPError):
+            pool.request("POST", "/chat")
+
+        async def main():
+            with pytest.raises(httpx.HTTPError):
+                await pool.arequest("POST", "/chat")
+            # 在事件循环中必须等待关闭完成
+            with pytest.raises(RuntimeError):
+                pool.close()
+            await pool.aclose()
+
+        asyncio.run(main())
+        stats = pool.stats()
+        assert stats["requests"] == 2
+        assert stats["in_use"] == 0 and stats["peak_in_use"] == 1
+        assert pool.async_client.is_closed
+
+    def test_httpx_async_client_across_event_loops(self, server):
+        """异步客户端可以在先后多个事件循环中使用，每个事件循环有自己的连接"""
+        pytest.importorskip("httpx")
+        pool = HTTPXPool(server, http2=False)
+
+        async def main():
+            response = await pool.arequest("POST", "/chat", body=b"x")
+            assert response.json() == {"echo": "x"}
+
+        for _ in range(3):
+            asyncio.run(main())
+        # 已结束的事件循环的连接池被丢弃
+        assert len(pool._async_transports.transports()) <= 1
+        assert pool.stats()["requests"] == 3
+        pool.close()
+        assert pool.async_client.is_closed
+
+    def test_async_close_registry(self, server):
+        """事件循环中通过aclose_http_clients关闭全部连接池"""
+        pytest.importorskip("httpx")
+
+        async def main():
+            pool = get_http_client("openai", "sk-async", server)
+            assert (await pool.arequest("POST", "/chat")).status_code == 200
+            assert pool.stats()["connections"] == 1
+            await aclose_http_clients()
+            return pool
+
+        pool = asyncio.run(main())
+        assert pool.async_client.is_closed and pool.client.is_closed
+        assert get_http_client_stats() == {}
+
+    def test_create_llm_passes_base_url(self):
+        llm = create_llm(Configuration(llm_base_url="http://127.0.0.1:9/v1"))
+        assert llm.kwargs["base_url"] == "http://127.0.0.1:9/v1"
+
+
+class TestAdmission:
+    """准入控制测试"""
+
+    def test_queued_requests_run_by_priority_then_arrival(self):
+        controller = AdmissionController(max_in_flight=1, max_queue=4, queue_timeout=1.0)
+        order = []
+
+        async def request(name, priority):
+            async with controller.admit(priority):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        async def main():
+            first = asyncio.ensure_future(request("first", "interactive"))
+            await asyncio.sleep(0)
+            waiting = [asyncio.ensure_future(request(name, priority)) for name, priority in (
+                ("batch1", "batch"), ("chat1", "interactive"),
+                ("batch2", "batch"), ("chat2", "interactive"))]
+            await asyncio.sleep(0)
+            assert controller.stats()["queued"] == {"interactive": 2, "batch": 2}
+            await asyncio.gather(first, *waiting)
+
+        asyncio.run(main())
+        assert order == ["first", "chat1", "chat2", "batch1", "batch2"]
+        assert controller.in_flight == 0 and controller.queued == 0
+
+    def test_full_queue_rejects_fast_and_sheds_batch_first(self):
+        controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=1.0)
+
+        async def main():
+            await controller.acquire()
+            batch = asyncio.ensure_future(controller.acquire("batch"))
+            await asyncio.sleep(0)
+            # 交互请求挤出排队中的批量请求
+            chat = asyncio.ensure_future(controller.acquire("interactive"))
+            await asyncio.sleep(0)
+            with pytest.raises(QueueFull) as evicted:
+                await batch
+            # 队列中只剩交互请求时，新请求立即被拒绝
+            started = time.monotonic()
+            with pytest.raises(QueueFull) as full:
+                await controller.acquire("batch")
+            assert time.monotonic() - started < 0.05
+            controller.release()
+            await chat
+            controller.release()
+            return evicted.value, full.value
+
+        evicted, full = asyncio.run(main())
+        assert full.status_code == 429 and full.retry_after >= 1
+        assert isinstance(evicted, QueueFull)
+        assert controller.in_flight == 0
+        rendered = metrics.render_metrics()
+        assert 'agent_admission_rejected_total{priority="batch",reason="queue_full"}' in rendered
+
+    def test_queue_timeout_and_cancellation_release_their_place(self):
+        controller = AdmissionController(max_in_flight=1, max_queue=4, queue_timeout=0.02)
+
+        async def main():
+            await controller.acquire()
+            with pytest.raises(QueueTimeout) as timeout:
+                await controller.acquire()
+            cancelled = asyncio.ensure_future(controller.acquire(timeout=1.0))
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await cancelled
+            assert controller.queued == 0
+            controller.release()
+            return timeout.value
+
+        error = asyncio.run(main())
+        assert error.status_code == 503
+        assert controller.in_flight == 0
+
+    def test_promoted_ticket_jumps_the_queue(self):
+        """排队中的票据被提升后按新的优先级出队"""
+        controller = AdmissionController(max_in_flight=1, max_queue=4, queue_timeout=1.0)
+        order = []
+
+        async def request(name, priority=None, ticket=None):
+            async with controller.admit(priority or "interactive", ticket=ticket):
+                order.append(name)
+
+        async def main():
+            await controller.acquire()
+            ticket = AdmissionTicket("batch")
+            waiting = [
+                asyncio.ensure_future(request("batch1", "batch")),
+                asyncio.ensure_future(request("shared", ticket=ticket)),
+                asyncio.ensure_future(request("chat", "interactive")),
+            ]
+            await asyncio.sleep(0)
+            controller.promote(ticket, "interactive")
+            # 不会降低优先级
+            controller.promote(ticket, "batch")
+            assert ticket.priority == "interactive"
+            assert controller.stats()["queued"] == {"interactive": 2, "batch": 1}
+            controller.release()
+            await asyncio.gather(*waiting)
+
+        asyncio.run(main())
+        assert order == ["shared", "chat", "batch1"]
+        assert controller.in_flight == 0 and controller.queued == 0
+
+    def test_invalid_arguments(self):
+        with pytest.raises(ValueError):
+            AdmissionController(max_in_flight=0)
+
+        async def main():
+            await AdmissionController().acquire("urgent")
+
+        with pytest.raises(ValueError):
+            asyncio.run(main())
+
+
+class TestMetrics:
+    """运行指标测试"""
+
+    def test_sharded_counter_sums_across_threads(self):
+        counter = metrics.Counter("test_events", "测试", ["kind"])
+        child = counter.labels("a")
+
+        def work():
+            for _ in range(1000):
+                child.inc()
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert child.value() == 8000
+
+    def test_finished_threads_fold_shards(self):
+        """已结束线程的分片被合并，分片数不随线程总数增长"""
+        gauge = metrics.Gauge("test_short_lived", "测试")
+
+        def work():
+            gauge.inc(2)
+            gauge.dec()
+
+        for _ in range(200):
+            t = threading.Thread(target=work)
+            t.start()
+            t.join()
+        assert gauge._default.value() == 200
+        assert len(gauge._default._shards._cells) <= 1
+
+    def test_render_prometheus_text(self):
+        registry = metrics.Registry()
+        requests = registry.register(metrics.Counter("demo_requests", "请求数", ["path"]))
+        in_flight = registry.register(metrics.Gauge("demo_in_flight", "进行中"))
+        latency = registry.register(metrics.Histogram("demo_seconds", "耗时", buckets=(0.1, 1)))
+        requests.labels('/q"x').inc(2)
+        in_flight.inc()
+        in_flight.inc()
+        in_flight.dec()
+        latency.observe(0.05)
+        latency.observe(0.5)
+        latency.observe(5)
+
+        text = registry.render()
+        assert "# TYPE demo_requests_total counter" in text
+        assert 'demo_requests_total{path="/q\\"x"} 2' in text
+        assert "demo_in_flight 1" in text
+        assert 'demo_seconds_bucket{le="0.1"} 1' in text
+        assert 'demo_seconds_bucket{le="1"} 2' in text
+        assert 'demo_seconds_bucket{le="+Inf"} 3' in text
+        assert "demo_seconds_count 3" in text
+        assert "demo_seconds_sum 5.55" in text
+
+    def test_agent_run_records_metrics(self, tmp_path):
+        invalidate_graph_cache()
+        config = Configuration(
+            model_provider="fake",
+            model_name="fake-metrics",
+            checkpoint_backend="sqlite",
+            checkpoint_path=str(tmp_path / "metrics.sqlite"),
+            fake_llm_options={"responses": TOOL_SCRIPT_FOR_TESTS},
+        )
+        llm_calls = metrics.LLM_CALLS.labels("fake", "fake-metrics", "success")
+        tool_calls = metrics.TOOL_CALLS.labels("calculate", "success")
+        flushes = metrics.CHECKPOINT_LATENCY.labels("sqlite", "flush")
+        before = (llm_calls.value(), tool_calls.value(), flushes.snapshot()[2])
+
+        assert run_agent("6乘7", config, thread_id="metrics") == "答案是42"
+
+        assert llm_calls.value() == before[0] + 2
+        assert tool_calls.value() == before[1] + 1
+        assert flushes.snapshot()[2] == before[2] + 1
+        text = metrics.render_metrics()
+        assert 'agent_node_duration_seconds_count{node="tools"}' in text
+        assert 'agent_tool_cache_hit_rate{tool="calculate"}' in text
+        assert 'agent_graph_cache{stat="hits"}' in text
+
+
 class TestIntegration:
     """集成测试"""
     
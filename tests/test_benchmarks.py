@@ -0,0 +1,58 @@
+"""基准测试框架测试"""
+
+import json
+import os
+import sys
+
+# 添加src和benchmarks目录到Python路径
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.append(os.path.join(ROOT, 'src'))
+sys.path.append(os.path.join(ROOT, 'benchmarks'))
+
+import run_benchmarks as bench_run
+from harness import Benchmark, compare, run_benchmark, summarize
+
+
+class TestHarness:
+    """基准框架测试"""
+
+    def test_summarize_per_op(self):
+        stats = summarize([0.2, 0.4, 0.6], ops=2)
+        assert stats["median"] == 0.2
+        assert stats["min"] == 0.1
+        assert stats["ops_per_sec"] == 5.0
+
+    def test_compare_flags_regressions(self):
+        baseline = {
+            "a": {"name": "a", "status": "ok", "median": 1.0},
+            "b": {"name": "b", "status": "ok", "median": 1.0},
+        }
+        results = [
+            {"name": "a", "status": "ok", "median": 1.5},
+            {"name": "b", "status": "ok", "median": 0.5},
+            {"name": "c", "status": "ok", "median": 1.0},
+        ]
+        comparisons = {c["name"]: c for c in compare(results, baseline, tolerance=0.2)}
+        assert comparisons["a"]["regression"]
+        assert comparisons["b"]["improvement"]
+        assert "c" not in comparisons
+
+    def test_errors_are_reported(self):
+        def broken(i):
+            raise RuntimeError("boom")
+
+        result = run_benchmark(Benchmark("broken", broken, warmup=0), iterations=1)
+        assert result["status"] == "error"
+        assert "boom" in result["reason"]
+
+    def test_run_writes_json_and_compares_baseline(self, tmp_path):
+        baseline = tmp_path / "baseline.json"
+        output = tmp_path / "results.json"
+        args = ["-k", "graph", "--iterations", "2", "--baseline", str(baseline)]
+
+        assert bench_run.main(args + ["--save-baseline"]) == 0
+        assert bench_run.main(args + ["--output", str(output), "--tolerance", "100"]) == 0
+
+        results = json.loads(output.read_text(encoding="utf-8"))["results"]
+        assert {r["name"] for r in results} == {"graph.compile", "graph.step_overhead"}
+        assert all(r["status"] == "ok" for r in results)
@@ -0,0 +1,810 @@
+"""图形执行引擎测试"""
+
+import os
+import sys
+import time
+import asyncio
+import json
+import sqlite3
+import threading
+from typing import Annotated, List
+from typing_extensions import TypedDict
+
+import pytest
+
+# 添加src目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from langchain_core.messages import HumanMessage, AIMessage, AIMessageChunk, ToolMessage
+from langchain_core.tools import tool
+from langgraph.graph import StateGraph, START, END
+from langgraph.graph.message import add_messages, extend_in_place
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.prebuilt import ToolNode
+from langgraph.config import get_message_writer, get_stream_writer, get_time_budget
+from langgraph.errors import GraphRecursionError, GraphTimeoutError
+from langgraph.tracing import (
+    FileSpanExporter, GraphCallback, InMemorySpanExporter, NodeLatencyCollector, SpanTracer
+)
+
+
+def _linear_graph(*nodes):
+    """按顺序串联节点构建图形"""
+    workflow = StateGraph(dict)
+    previous = START
+    for name, func in nodes:
+        workflow.add_node(name, func)
+        workflow.add_edge(previous, name)
+        previous = name
+    workflow.add_edge(previous, END)
+    return workflow.compile()
+
+
+class TestAsyncExecution:
+    """异步执行路径测试"""
+
+    def test_async_node_is_awaited(self):
+        """异步节点在ainvoke中被await"""
+        async def node(state):
+            await asyncio.sleep(0)
+            return {"value": state["value"] + 1}
+
+        app = _linear_graph(("a", node), ("b", node))
+        assert asyncio.run(app.ainvoke({"value": 0}))["value"] == 2
+
+    def test_async_node_in_sync_invoke(self):
+        """同步invoke也能执行纯异步节点"""
+        async def node(state):
+            return {"value": "async"}
+
+        app = _linear_graph(("a", node))
+        assert app.invoke({})["value"] == "async"
+
+    def test_sync_node_is_offloaded(self):
+        """同步节点在线程池中执行，不占用事件循环线程"""
+        seen = {}
+
+        def node(state):
+            seen["thread"] = threading.current_thread()
+            return {}
+
+        app = _linear_graph(("a", node))
+
+        async def main():
+            await app.ainvoke({})
+            return threading.current_thread()
+
+        loop_thread = asyncio.run(main())
+        assert seen["thread"] is not loop_thread
+
+    def test_afunc_preferred_over_sync(self):
+        """节点通过afunc属性提供异步版本时优先使用"""
+        def node(state):
+            return {"path": "sync"}
+
+        async def anode(state):
+            return {"path": "async"}
+
+        node.afunc = anode
+        app = _linear_graph(("a", node))
+        assert app.invoke({})["path"] == "sync"
+        assert asyncio.run(app.ainvoke({}))["path"] == "async"
+
+    def test_async_conditional_edges(self):
+        """异步条件函数被await"""
+        async def route(state):
+            return "done"
+
+        workflow = StateGraph(dict)
+        workflow.add_node("a", lambda state: {"visited": True})
+        workflow.add_edge(START, "a")
+        workflow.add_conditional_edges("a", route, {"done": END})
+        app = workflow.compile()
+        assert asyncio.run(app.ainvoke({}))["visited"] is True
+
+    def test_concurrent_runs_overlap(self):
+        """并发运行的图形互不阻塞"""
+        async def slow(state):
+            await asyncio.sleep(0.05)
+            return {"done": True}
+
+        app = _linear_graph(("a", slow))
+
+        async def main():
+            start = time.perf_counter()
+            await asyncio.gather(*(app.ainvoke({}) for _ in range(50)))
+            return time.perf_counter() - start
+
+        assert asyncio.run(main()) < 0.5
+
+
+class TestStreaming:
+    """流式执行测试"""
+
+    def test_stream_updates_and_values(self):
+        app = _linear_graph(
+            ("a", lambda state: {"x": 1}),
+            ("b", lambda state: {"y": state["x"] + 1}),
+        )
+        assert list(app.stream({})) == [{"a": {"x": 1}}, {"b": {"y": 2}}]
+        assert list(app.stream({}, stream_mode="values"))[-1] == {"x": 1, "y": 2}
+
+    def test_stream_messages_and_custom(self):
+        def talk(state):
+            get_stream_writer()({"progress": 0.5})
+            writer = get_message_writer()
+            for piece in ("你", "好"):
+                writer(AIMessageChunk(content=piece))
+            return {"done": True}
+
+        app = _linear_graph(("talk", talk))
+        events = list(app.stream({}, stream_mode=["messages", "custom", "updates"]))
+        assert events[0] == ("custom", {"progress": 0.5})
+        tokens = [(payload[0].content, payload[1]["langgraph_node"])
+                  for mode, payload in events if mode == "messages"]
+        assert tokens == [("你", "talk"), ("好", "talk")]
+        assert events[-1] == ("updates", {"talk": {"done": True}})
+
+    def test_writers_are_noops_outside_streaming(self):
+        seen = []
+
+        def node(state):
+            seen.append(get_message_writer())
+            get_stream_writer()("ignored")
+            return {}
+
+        _linear_graph(("node", node)).invoke({})
+        assert seen == [None]
+
+    def test_astream_delivers_tokens_before_node_finishes(self):
+        release = None
+
+        async def talk(state):
+            get_message_writer()(AIMessageChunk(content="片段"))
+            await release.wait()
+            return {"done": True}
+
+        app = _linear_graph(("talk", talk))
+
+        async def main():
+            nonlocal release
+            release = asyncio.Event()
+            stream = app.astream({}, stream_mode="messages")
+            chunk, meta = await asyncio.wait_for(stream.__anext__(), 1)
+            release.set()
+            rest = [item async for item in stream]
+            return chunk.content, rest
+
+        content, rest = asyncio.run(main())
+        assert content == "片段"
+        assert rest == []
+
+    def test_closing_astream_cancels_run(self):
+        cancelled = []
+
+        async def first(state):
+            return {"x": 1}
+
+        async def forever(state):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        app = _linear_graph(("first", first), ("forever", forever))
+
+        async def main():
+            stream = app.astream({})
+            assert await stream.__anext__() == {"first": {"x": 1}}
+            await asyncio.sleep(0.01)
+            await stream.aclose()
+
+        asyncio.run(main())
+        assert cancelled == [True]
+
+    def test_stream_propagates_errors(self):
+        def broken(state):
+            raise RuntimeError("boom")
+
+        app = _linear_graph(("broken", broken))
+        try:
+            list(app.stream({}))
+        except RuntimeError as e:
+            assert str(e) == "boom"
+        else:
+            raise AssertionError("expected RuntimeError")
+
+
+class _Recorder(GraphCallback):
+    def __init__(self):
+        self.events = []
+
+    def on_run_start(self, run):
+        self.events.append(("run_start", None))
+
+    def on_run_end(self, run):
+        self.events.append(("run_end", run.steps, run.error))
+
+    def on_node_start(self, event):
+        self.events.append(("start", event.node, event.step, event.state_size))
+
+    def on_node_end(self, event):
+        self.events.append(("end", event.node, event.duration >= 0, event.error))
+
+
+class TestTracing:
+    """节点回调与追踪测试"""
+
+    def test_hooks_report_nodes_in_order(self):
+        recorder = _Recorder()
+        workflow = StateGraph(dict)
+        workflow.add_node("a", lambda state: {"items": [1, 2]})
+        workflow.add_node("b", lambda state: {"done": True})
+        workflow.add_edge(START, "a")
+        workflow.add_edge("a", "b")
+        workflow.add_edge("b", END)
+        workflow.compile(callbacks=[recorder]).invoke({"x": 1})
+
+        assert recorder.events == [
+            ("run_start", None),
+            ("start", "a", 1, 1),
+            ("end", "a", True, None),
+            ("start", "b", 2, 3),
+            ("end", "b", True, None),
+            ("run_end", 2, None),
+        ]
+
+    def test_errors_and_per_run_callbacks(self):
+        def broken(state):
+            raise ValueError("bad")
+
+        app = _linear_graph(("broken", broken))
+        recorder = _Recorder()
+        try:
+            app.invoke({}, config={"callbacks": [recorder]})
+        except ValueError:
+            pass
+        assert recorder.events[2][0] == "end"
+        assert isinstance(recorder.events[2][3], ValueError)
+        assert isinstance(recorder.events[-1][2], ValueError)
+        # 通过config传入的回调只作用于这一次运行
+        assert app.callbacks == []
+
+    def test_failing_callback_does_not_break_run(self):
+        class Broken(GraphCallback):
+            def on_node_start(self, event):
+                raise RuntimeError("callback bug")
+
+        app = _linear_graph(("a", lambda state: {"x": 1}))
+        app.add_callback(Broken())
+        assert app.invoke({}) == {"x": 1}
+
+    def test_latency_collector_async(self):
+        async def slow(state):
+            await asyncio.sleep(0.02)
+            return {"x": 1}
+
+        collector = NodeLatencyCollector()
+        app = _linear_graph(("slow", slow), ("fast", lambda state: {"y": 1}))
+        app.add_callback(collector)
+        for _ in range(3):
+            asyncio.run(app.ainvoke({}))
+
+        stats = collector.stats()
+        assert stats["slow"]["count"] == 3
+        assert stats["slow"]["mean"] >= 0.02
+        assert 0.01 <= stats["slow"]["p50"] <= 0.05
+        assert stats["fast"]["mean"] < stats["slow"]["mean"]
+
+    def test_span_tracer_builds_otlp_spans(self, tmp_path):
+        memory = InMemorySpanExporter()
+        path = tmp_path / "traces" / "spans.jsonl"
+        app = _linear_graph(("a", lambda state: {"x": 1}), ("b", lambda state: {"y": 2}))
+        app.add_callback(SpanTracer(memory, graph_name="demo"))
+        exporter = FileSpanExporter(str(path))
+        app.add_callback(SpanTracer(exporter))
+        app.invoke({}, config={"configurable": {"thread_id": "t1", "trace_id": "ab" * 16}})
+
+        root, span_a, span_b = memory.get_finished_spans()
+        assert root["name"] == "demo run"
+        assert "parentSpanId" not in root
+        assert span_a["name"] == "node a"
+        assert span_a["parentSpanId"] == root["spanId"]
+        assert {s["traceId"] for s in (root, span_a, span_b)} == {"ab" * 16}
+        assert int(span_b["startTimeUnixNano"]) >= int(span_a["endTimeUnixNano"])
+
+        # 文件由后台线程写入
+        exporter.flush()
+        document = json.loads(path.read_text(encoding="utf-8").splitlines()[0])
+        spans = document["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        assert [s["name"] for s in spans] == ["graph run", "node a", "node b"]
+
+    def test_file_exporter_writes_off_the_caller_thread(self, tmp_path, monkeypatch):
+        """导出只入队，写文件在后台线程中进行；关闭时写完剩余的数据"""
+        path = tmp_path / "spans.jsonl"
+        exporter = FileSpanExporter(str(path))
+        release = threading.Event()
+        writers = []
+        real_open = open
+
+        def slow_open(*args, **kwargs):
+            writers.append(threading.current_thread())
+            release.wait(5)
+            return real_open(*args, **kwargs)
+
+        monkeypatch.setattr("builtins.open", slow_open)
+        started = time.perf_counter()
+        for i in range(3):
+            exporter.export("svc", [{"name": f"run{i}"}])
+        assert time.perf_counter() - started < 0.5
+        release.set()
+        exporter.shutdown()
+        monkeypatch.undo()
+        assert threading.current_thread() not in writers
+        lines = path.read_text(encoding="utf-8").splitlines()
+        names = [json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"][0]["name"]
+                 for line in lines]
+        assert names == ["run0", "run1", "run2"]
+        # 关闭后的导出被忽略
+        exporter.export("svc", [{"name": "late"}])
+        assert len(path.read_text(encoding="utf-8").splitlines()) == 3
+
+
+def _loop_graph():
+    """每步计数加一、永不结束的循环图形"""
+    workflow = StateGraph(dict)
+    workflow.add_node("tick", lambda state: {"count": state.get("count", 0) + 1})
+    workflow.add_edge(START, "tick")
+    workflow.add_edge("tick", "tick")
+    return workflow
+
+
+class TestRunLimits:
+    """步数与运行时间限制测试"""
+
+    def test_recursion_limit_keeps_partial_state(self):
+        recorder = _Recorder()
+        app = _loop_graph().compile(callbacks=[recorder])
+        with pytest.raises(GraphRecursionError) as info:
+            app.invoke({}, config={"recursion_limit": 5})
+        assert info.value.step == 5
+        assert info.value.state == {"count": 5}
+        assert isinstance(recorder.events[-1][2], GraphRecursionError)
+
+        # 未指定时使用默认上限
+        with pytest.raises(GraphRecursionError):
+            asyncio.run(app.ainvoke({}))
+        assert _linear_graph(("a", lambda state: {"x": 1})).invoke(
+            {}, config={"recursion_limit": 1}) == {"x": 1}
+
+    def test_sync_deadline_checked_between_steps(self):
+        def slow(state):
+            time.sleep(0.02)
+            return {"count": state.get("count", 0) + 1}
+
+        workflow = StateGraph(dict)
+        workflow.add_node("tick", slow)
+        workflow.add_edge(START, "tick")
+        workflow.add_edge("tick", "tick")
+        started = time.perf_counter()
+        with pytest.raises(GraphTimeoutError) as info:
+            workflow.compile().invoke({}, config={"timeout": 0.1, "recursion_limit": 1000})
+        assert time.perf_counter() - started < 0.5
+        assert info.value.state["count"] >= 3
+
+    def test_async_deadline_cancels_running_node(self):
+        cancelled = []
+
+        async def hang(state):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        app = _linear_graph(("first", lambda state: {"x": 1}), ("hang", hang))
+        started = time.perf_counter()
+        with pytest.raises(GraphTimeoutError) as info:
+            asyncio.run(app.ainvoke({}, config={"deadline": time.monotonic() + 0.05}))
+        assert time.perf_counter() - started < 1
+        assert cancelled == [True]
+        assert info.value.state == {"x": 1}
+
+    def test_deadline_visible_to_nodes_and_nested_runs(self):
+        budgets = []
+
+        def inner(state):
+            budgets.append(get_time_budget())
+            return {}
+
+        nested = _linear_graph(("inner", inner))
+
+        def outer(state):
+            budgets.append(get_time_budget(60))
+            nested.invoke({})
+            return {}
+
+        app = _linear_graph(("outer", outer))
+        app.invoke({}, config={"timeout": 5})
+        asyncio.run(app.ainvoke({}, config={"timeout": 5}))
+        assert len(budgets) == 4
+        # 节点自身的超时被运行剩余时间截断，嵌套运行继承外层的截止时间
+        assert all(0 < budget <= 5 for budget in budgets)
+        app.invoke({})
+        assert budgets[-1] is None
+        assert get_time_budget(3) == 3
+
+    def test_tool_calls_capped_by_deadline(self):
+        node = ToolNode([slow_upper], timeout=30)
+        app = _linear_graph(("tools", node))
+        state = _tool_state(("slow_upper", {"text": "a"}))
+        for run in (app.invoke, lambda s, config: asyncio.run(app.ainvoke(s, config=config))):
+            started = time.perf_counter()
+            try:
+                result = run(state, config={"timeout": 0.05})
+            except GraphTimeoutError:
+                # 异步路径中引擎可能先于工具节点取消整个节点
+                pass
+            else:
+                assert "run deadline exceeded" in result["messages"][-1].content
+            assert time.perf_counter() - started < 0.15
+
+    def test_checkpoint_flushed_when_limit_hit(self, tmp_path):
+        path = str(tmp_path / "limits.sqlite")
+        app = _loop_graph().compile(checkpointer=SqliteSaver(path))
+        config = {"configurable": {"thread_id": "t"}, "recursion_limit": 3}
+        with pytest.raises(GraphRecursionError):
+            app.invoke({}, config=config)
+        writes = SqliteSaver(path).get_tuple(config).writes
+        assert writes[-1] == {"count": 3}
+
+    def test_aborted_run_closes_dangling_tool_calls(self):
+        """在工具调用之后中止时，保存的线程以错误ToolMessage结尾"""
+        def agent(state):
+            call = {"name": "upper", "args": {}, "id": f"call_{len(state['messages'])}"}
+            return {"messages": [AIMessage(content="", tool_calls=[call])]}
+
+        def tools(state):
+            call = state["messages"][-1].tool_calls[0]
+            return {"messages": [ToolMessage(content="ok", tool_call_id=call["id"], name="upper")]}
+
+        workflow = StateGraph(ChatState)
+        workflow.add_node("agent", agent)
+        workflow.add_node("tools", tools)
+        workflow.add_edge(START, "agent")
+        workflow.add_edge("agent", "tools")
+        workflow.add_edge("tools", "agent")
+        app = workflow.compile(checkpointer=MemorySaver())
+        runs = (app.invoke, lambda s, config: asyncio.run(app.ainvoke(s, config=config)))
+        for i, run in enumerate(runs):
+            config = {"configurable": {"thread_id": f"t{i}"}, "recursion_limit": 3}
+            with pytest.raises(GraphRecursionError) as info:
+                run({"messages": [HumanMessage(content="hi")]}, config)
+            # 异常中的部分状态保持原样
+            assert info.value.state["messages"][-1].tool_calls
+            messages = app.get_state(config)["messages"]
+            assert isinstance(messages[-1], ToolMessage)
+            assert messages[-1].status == "error"
+            assert messages[-1].tool_call_id == messages[-2].tool_calls[0]["id"]
+            assert "GraphRecursionError" in messages[-1].content
+
+
+class ChatState(TypedDict):
+    messages: Annotated[List, add_messages]
+    turns: int
+
+
+def _echo_graph(checkpointer):
+    """每轮回复一条AI消息的简单对话图形"""
+    def reply(state):
+        return {
+            "messages": [AIMessage(content=f"reply{len(state['messages'])}")],
+            "turns": state.get("turns", 0) + 1,
+        }
+
+    workflow = StateGraph(ChatState)
+    workflow.add_node("reply", reply)
+    workflow.add_edge(START, "reply")
+    workflow.add_edge("reply", END)
+    return workflow.compile(checkpointer=checkpointer)
+
+
+class TestCheckpointing:
+    """检查点持久化测试"""
+
+    def test_reducer_appends_messages(self):
+        """带reducer的键追加而非覆盖"""
+        app = _echo_graph(None)
+        result = app.invoke({"messages": [HumanMessage(content="hi")]})
+        assert [m.content for m in result["messages"]] == ["hi", "reply1"]
+
+    def test_in_place_reducer_leaves_inputs_and_snapshots_alone(self):
+        """原地追加的reducer不改动调用者的输入、已保存的检查点和异常中的状态"""
+        class LogState(TypedDict):
+            log: Annotated[List, extend_in_place]
+
+        workflow = StateGraph(LogState)
+        workflow.add_node("a", lambda state: {"log": ["a"]})
+        workflow.add_node("b", lambda state: {"log": ["b"]})
+        workflow.add_edge(START, "a")
+        workflow.add_edge("a", "b")
+        workflow.add_edge("b", END)
+        saver = MemorySaver()
+        saver.compact_every = 1
+        app = workflow.compile(checkpointer=saver)
+        config = {"configurable": {"thread_id": "t"}}
+        given = ["in"]
+        first = app.invoke({"log": given}, config=config)
+        assert given == ["in"]
+        assert first["log"] == ["in", "a", "b"]
+        second = app.invoke({"log": ["again"]}, config=config)
+        assert second["log"] == ["in", "a", "b", "again", "a", "b"]
+        assert first["log"] == ["in", "a", "b"]
+        values = list(app.stream({"log": []}, config=config, stream_mode="values"))
+        assert [len(v["log"]) for v in values] == [7, 8]
+        with pytest.raises(GraphRecursionError) as info:
+            app.invoke({"log": ["x"]}, config={"recursion_limit": 1})
+        assert info.value.state["log"] == ["x", "a"]
+
+    def test_memory_saver_keeps_thread_history(self):
+        """同一thread_id的多次调用共享历史，不同线程互相隔离"""
+        app = _echo_graph(MemorySaver())
+        thread = {"configurable": {"thread_id": "t1"}}
+        app.invoke({"messages": [HumanMessage(content="one")]}, config=thread)
+        result = app.invoke({"messages": [HumanMessage(content="two")]}, config=thread)
+
+        assert [m.content for m in result["messages"]] == ["one", "reply1", "two", "reply3"]
+        assert result["turns"] == 2
+
+        other = app.invoke(
+            {"messages": [HumanMessage(content="x")]},
+            config={"configurable": {"thread_id": "t2"}},
+        )
+        assert len(other["messages"]) == 2
+
+    def test_sqlite_saver_survives_restart(self, tmp_path):
+        """SQLite检查点在新实例（模拟重启或其他进程）中可见"""
+        path = str(tmp_path / "checkpoints.sqlite")
+        thread = {"configurable": {"thread_id": "t1"}}
+
+        app = _echo_graph(SqliteSaver(path))
+        asyncio.run(app.ainvoke({"messages": [HumanMessage(content="one")]}, config=thread))
+
+        restarted = _echo_graph(SqliteSaver(path))
+        result = restarted.invoke({"messages": [HumanMessage(content="two")]}, config=thread)
+        assert [m.content for m in result["messages"]] == ["one", "reply1", "two", "reply3"]
+        assert isinstance(result["messages"][0], HumanMessage)
+
+        conn = sqlite3.connect(path)
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        conn.close()
+
+    def test_sqlite_saver_batches_until_flush(self, tmp_path):
+        """put_writes只缓冲写入，flush时一次提交"""
+        path = str(tmp_path / "checkpoints.sqlite")
+        saver = SqliteSaver(path)
+        thread = {"configurable": {"thread_id": "t1"}}
+        saver.put_writes(thread, {"messages": [HumanMessage(content="a")]})
+
+        reader = SqliteSaver(path)
+        assert reader.get_tuple(thread) is None
+        assert saver.get_tuple(thread).writes[0]["messages"][0].content == "a"
+
+        saver.flush()
+        assert reader.get_tuple(thread).writes[0]["messages"][0].content == "a"
+
+    @staticmethod
+    def _stall_flush(saver):
+        """让saver的下一次flush在取走缓冲区之后、提交之前暂停"""
+        entered, gate = threading.Event(), threading.Event()
+        conn = saver._conn
+        flusher = threading.Thread(target=saver.flush)
+
+        def stalled():
+            if threading.current_thread() is flusher:
+                entered.set()
+                gate.wait(5)
+            return conn()
+
+        saver._conn = stalled
+        flusher.start()
+        assert entered.wait(5)
+        return flusher, gate
+
+    def test_read_during_flush_sees_in_flight_writes(self, tmp_path):
+        """提交中的批次既不在缓冲区也不在数据库时，读取等待提交完成"""
+        saver = SqliteSaver(str(tmp_path / "checkpoints.sqlite"))
+        thread = {"configurable": {"thread_id": "t1"}}
+        saver.put_writes(thread, {"messages": [HumanMessage(content="a")]})
+        flusher, gate = self._stall_flush(saver)
+
+        result = {}
+        reader = threading.Thread(target=lambda: result.update(checkpoint=saver.get_tuple(thread)))
+        reader.start()
+        time.sleep(0.05)
+        assert reader.is_alive()
+        gate.set()
+        flusher.join(5)
+        reader.join(5)
+        assert [w["messages"][0].content for w in result["checkpoint"].writes] == ["a"]
+
+    def test_concurrent_flushes_do_not_duplicate_messages(self, tmp_path):
+        """后一批的快照不会越过前一批尚未提交的写入"""
+        path = str(tmp_path / "checkpoints.sqlite")
+        saver = SqliteSaver(path)
+        thread = {"configurable": {"thread_id": "t1"}}
+        message = HumanMessage(content="a")
+        saver.put_writes(thread, {"messages": [message]})
+        flusher, gate = self._stall_flush(saver)
+
+        saver.put(thread, {"messages": [message]})
+        second = threading.Thread(target=saver.flush)
+        second.start()
+        time.sleep(0.05)
+        gate.set()
+        flusher.join(5)
+        second.join(5)
+
+        checkpoint = SqliteSaver(path).get_tuple(thread)
+        assert len(checkpoint.snapshot["messages"]) == 1
+        assert checkpoint.writes == []
+
+
+class TestDeltaCheckpoints:
+    """增量检查点日志测试"""
+
+    def test_writes_only_store_new_messages(self, tmp_path):
+        """每步只记录节点返回的增量，而不是完整消息列表"""
+        path = str(tmp_path / "checkpoints.sqlite")
+        app = _echo_graph(SqliteSaver(path, compact_every=1000))
+        thread = {"configurable": {"thread_id": "t1"}}
+        for i in range(5):
+            app.invoke({"messages": [HumanMessage(content=f"q{i}")]}, config=thread)
+
+        conn = sqlite3.connect(path)
+        rows = [data for (data,) in conn.execute("SELECT data FROM writes ORDER BY seq")]
+        conn.close()
+        assert len(rows) == 10
+        assert all(row.count("__message__") == 1 for row in rows)
+
+    def test_compaction_rolls_log_into_snapshot(self, tmp_path):
+        """日志达到阈值后被折叠为快照，重建状态保持一致"""
+        path = str(tmp_path / "checkpoints.sqlite")
+        app = _echo_graph(SqliteSaver(path, compact_every=4))
+        thread = {"configurable": {"thread_id": "t1"}}
+        for i in range(5):
+            app.invoke({"messages": [HumanMessage(content=f"q{i}")]}, config=thread)
+
+        checkpoint = SqliteSaver(path).get_tuple(thread)
+        assert checkpoint.snapshot is not None
+        assert len(checkpoint.writes) < 4
+
+        state = _echo_graph(SqliteSaver(path)).get_state(thread)
+        assert len(state["messages"]) == 10
+        assert state["messages"][-1].content == "reply9"
+        assert state["turns"] == 5
+
+    def test_memory_saver_compaction(self):
+        """内存后端同样折叠日志"""
+        saver = MemorySaver()
+        saver.compact_every = 2
+        app = _echo_graph(saver)
+        thread = {"configurable": {"thread_id": "t1"}}
+        for i in range(3):
+            app.invoke({"messages": [HumanMessage(content=f"q{i}")]}, config=thread)
+
+        checkpoint = saver.get_tuple(thread)
+        assert checkpoint.writes == []
+        assert len(checkpoint.snapshot["messages"]) == 6
+
+    def test_memory_saver_is_bounded(self):
+        """内存后端按LRU淘汰线程，空闲超时的线程被丢弃"""
+        saver = MemorySaver(max_threads=2)
+        app = _echo_graph(saver)
+        threads = [{"configurable": {"thread_id": f"t{i}"}} for i in range(3)]
+        app.invoke({"messages": [HumanMessage(content="q0")]}, config=threads[0])
+        app.invoke({"messages": [HumanMessage(content="q1")]}, config=threads[1])
+        # 访问t0后，t1成为最久未使用的线程
+        assert saver.get_tuple(threads[0]) is not None
+        app.invoke({"messages": [HumanMessage(content="q2")]}, config=threads[2])
+        assert len(saver) == 2
+        assert saver.get_tuple(threads[1]) is None
+        assert saver.get_tuple(threads[0]) is not None
+
+        expiring = MemorySaver(ttl=0.05)
+        _echo_graph(expiring).invoke({"messages": [HumanMessage(content="q")]}, config=threads[0])
+        assert expiring.get_tuple(threads[0]) is not None
+        time.sleep(0.06)
+        assert expiring.get_tuple(threads[0]) is None
+        assert len(expiring) == 0
+
+
+@tool
+def slow_upper(text: str) -> str:
+    """同步慢工具"""
+    time.sleep(0.2)
+    return text.upper()
+
+
+@tool
+async def slow_reverse(text: str) -> str:
+    """异步慢工具"""
+    await asyncio.sleep(0.2)
+    return text[::-1]
+
+
+def _tool_state(*calls):
+    tool_calls = [
+        {"name": name, "args": args, "id": f"call_{i}"}
+        for i, (name, args) in enumerate(calls)
+    ]
+    return {"messages": [AIMessage(content="", tool_calls=tool_calls)]}
+
+
+class TestToolNode:
+    """并行工具节点测试"""
+
+    def test_sync_calls_run_in_parallel_and_keep_order(self):
+        """多个工具调用并发执行，结果按调用顺序返回"""
+        node = ToolNode([slow_upper, slow_reverse])
+        state = _tool_state(("slow_upper", {"text": "ab"}), ("slow_reverse", {"text": "ab"}),
+                            ("slow_upper", {"text": "cd"}))
+
+        start = time.perf_counter()
+        messages = node(state)["messages"]
+        elapsed = time.perf_counter() - start
+
+        assert elapsed < 0.5
+        assert [m.content for m in messages] == ["AB", "ba", "CD"]
+        assert [m.tool_call_id for m in messages] == ["call_0", "call_1", "call_2"]
+        assert all(isinstance(m, ToolMessage) for m in messages)
+
+    def test_async_calls_run_in_parallel(self):
+        """异步路径同时处理同步与异步工具"""
+        node = ToolNode([slow_upper, slow_reverse])
+        state = _tool_state(("slow_reverse", {"text": "xy"}), ("slow_upper", {"text": "xy"}))
+
+        start = time.perf_counter()
+        messages = asyncio.run(node.ainvoke(state))["messages"]
+        assert time.perf_counter() - start < 0.35
+        assert [m.content for m in messages] == ["yx", "XY"]
+
+    def test_timeout_and_errors_become_messages(self):
+        """超时、异常和未知工具都转为错误消息"""
+        @tool
+        def broken(text: str) -> str:
+            """总是失败的工具"""
+            raise RuntimeError("boom")
+
+        node = ToolNode([slow_upper, broken], tool_timeouts={"slow_upper": 0.05})
+        state = _tool_state(("slow_upper", {"text": "a"}), ("broken", {"text": "a"}),
+                            ("missing", {}))
+        for messages in (node(state)["messages"], asyncio.run(node.ainvoke(state))["messages"]):
+            assert [m.status for m in messages] == ["error", "error", "error"]
+            assert "timed out" in messages[0].content
+            assert "boom" in messages[1].content
+            assert "not a valid tool" in messages[2].content
+
+    def test_concurrency_cap(self):
+        """全局并发上限限制同时执行的工具数"""
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        @tool
+        def tracked(i: int) -> int:
+            """记录并发度的工具"""
+            with lock:
+                active.append(i)
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.remove(i)
+            return i
+
+        node = ToolNode([tracked], max_concurrency=2)
+        state = _tool_state(*[("tracked", {"i": i}) for i in range(6)])
+        assert [m.content for m in node(state)["messages"]] == [str(i) for i in range(6)]
+        assert max(peak) <= 2
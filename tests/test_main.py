@@ -0,0 +1,211 @@
+"""API服务测试
+
+这个文件包含了对 ``main.py`` 中HTTP端点的测试，需要安装FastAPI和httpx。
+"""
+
+import os
+import sys
+import json
+import asyncio
+import threading
+import time
+import pytest
+
+# 添加src目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+
+from fastapi.testclient import TestClient
+
+import main
+from agent.admission import AdmissionController
+
+
+FAKE_QUERY = {
+    "query": "你好",
+    "thread_id": None,
+    "config": {"model_provider": "fake", "enable_memory": False},
+}
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    """每个测试使用单独的准入控制器"""
+    controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=5.0)
+    monkeypatch.setattr(main, "admission", controller)
+    return controller
+
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+class TestStreamAdmission:
+    """流式端点的准入控制测试"""
+
+    def test_admitted_stream_releases_slot(self, controller, client):
+        """被接纳的流式请求完成后归还名额"""
+        response = client.post("/query/stream", json=FAKE_QUERY)
+        assert response.status_code == 200
+        assert "event: " in response.text
+        assert controller.in_flight == 0
+
+    def test_queued_stream_runs_after_release(self, controller, client):
+        """名额被占用时请求排队，名额归还后继续执行"""
+        client.portal.call(controller.acquire)
+        result = {}
+
+        def post():
+            result["response"] = client.post("/query/stream", json=FAKE_QUERY)
+
+        thread = threading.Thread(target=post)
+        thread.start()
+        deadline = time.monotonic() + 5
+        while controller.queued == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert controller.queued == 1
+        client.portal.call(controller.release)
+        thread.join(5)
+        assert result["response"].status_code == 200
+        assert controller.in_flight == 0 and controller.queued == 0
+
+    def test_rejected_stream_returns_retry_after(self, controller, client):
+        """队列已满时快速返回429和Retry-After"""
+        controller.max_queue = 0
+        client.portal.call(controller.acquire)
+        try:
+            response = client.post("/query/stream", json=FAKE_QUERY)
+            assert response.status_code == 429
+            assert int(response.headers["Retry-After"]) >= 1
+        finally:
+            client.portal.call(controller.release)
+        assert controller.in_flight == 0
+
+    def test_disconnect_before_body_releases_slot(self, controller):
+        """客户端在响应体开始前断开时也归还名额"""
+        payload = json.dumps(dict(FAKE_QUERY, config=dict(
+            FAKE_QUERY["config"], fake_llm_options={"latency": 0.2}))).encode("utf-8")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0", "spec_version": "2.3"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": "/query/stream",
+            "raw_path": b"/query/stream",
+            "root_path": "",
+            "query_string": b"",
+            "headers": [
+                (b"host", b"testserver"),
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(payload)).encode("ascii")),
+            ],
+            "client": ("testclient", 50000),
+            "server": ("testserver", 80),
+        }
+        messages = [{"type": "http.request", "body": payload, "more_body": False}]
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message["type"])
+
+        async def run():
+            try:
+                await main.app(scope, receive, send)
+            except Exception:
+                # 断开连接的处理方式取决于Starlette版本，这里只关心名额
+                pass
+
+        asyncio.run(run())
+        assert controller.in_flight == 0
+
+    def test_batch_items_admitted_individually(self, controller, client):
+        """批量请求的每个查询单独准入，并发数不超过服务端上限"""
+        controller.max_queue = 8
+        payload = {"queries": ["a", "b", "c"], "config": FAKE_QUERY["config"], "max_concurrency": 1000}
+        response = client.post("/query/batch", json=payload)
+        assert response.status_code == 200
+        assert all(item["error"] is None for item in response.json()["results"])
+        assert controller.in_flight == 0 and controller.queued == 0
+
+
+class TestRequestConfig:
+    """请求配置覆盖项测试"""
+
+    @pytest.mark.parametrize("key, value", [
+        ("llm_base_url", "http://attacker.example/v1"),
+        ("checkpoint_path", "/tmp/owned.sqlite"),
+        ("trace_export_path", "/tmp/owned.jsonl"),
+        ("llm_cache_path", "/tmp/owned-cache.sqlite"),
+        ("rate_limit_path", "/tmp/owned-limits.sqlite"),
+        ("fallback_models", [{"llm_base_url": "http://attacker.example/v1"}]),
+        ("no_such_field", 1),
+    ])
+    def test_infrastructure_fields_are_rejected(self, client, key, value):
+        """基础设施配置项和未知配置项返回400"""
+        for path in ("/query", "/query/stream"):
+            response = client.post(path, json=dict(FAKE_QUERY, config={**FAKE_QUERY["config"], key: value}))
+            assert response.status_code == 400
+            assert key in response.json()["detail"]
+
+    def test_allowed_fields_are_applied(self):
+        """允许的配置项覆盖默认值"""
+        request = main.QueryRequest(query="hi", config={"temperature": 0.5, "max_iterations": 3})
+        config = main.build_config(request)
+        assert config.temperature == 0.5 and config.max_iterations == 3
+
+
+class TestRequestMetrics:
+    """请求指标中间件测试"""
+
+    def _run(self, app, receive):
+        scope = {"type": "http", "method": "GET", "path": "/stream", "headers": []}
+        observed = []
+        middleware = main.RequestMetricsMiddleware(app)
+
+        async def send(message):
+            observed.append((message["type"], main.metrics.HTTP_IN_FLIGHT._default.value()))
+
+        before = main.metrics.HTTP_IN_FLIGHT._default.value()
+        asyncio.run(middleware(scope, receive, send))
+        assert main.metrics.HTTP_IN_FLIGHT._default.value() == before
+        return observed, before
+
+    def test_stream_counted_until_last_body(self):
+        """流式响应在最后一块响应体发出前一直计为进行中"""
+        async def app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"a", "more_body": True})
+            await asyncio.sleep(0.05)
+            await send({"type": "http.response.body", "body": b"b", "more_body": False})
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        latency = main.metrics.HTTP_LATENCY.labels("unmatched")
+        total_before = latency.snapshot()[1]
+        observed, before = self._run(app, receive)
+        assert [value for _, value in observed] == [before + 1] * 3
+        assert latency.snapshot()[1] - total_before >= 0.05
+
+    def test_disconnect_ends_request(self):
+        """客户端断开时立即结束计数"""
+        async def app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await receive()
+            await send({"type": "http.response.body", "body": b"late", "more_body": True})
+
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        observed, before = self._run(app, receive)
+        assert observed == [("http.response.start", before + 1), ("http.response.body", before)]
@@ -44,3 +44,29 @@ def test_relay_between_agents(mock_openai):
     # 检查历史记录
     assert any(msg.content == "A1" for msg in manager.histories["researcher"] if hasattr(msg, "content"))
     assert any(msg.content == "B1" for msg in manager.histories["critic"] if hasattr(msg, "content"))
+
+
+@patch('agent.graph.ChatOpenAI')
+def test_histories_are_bounded_by_context_window(mock_openai):
+    """测试设置上下文窗口后代理历史不会无限增长"""
+    from langchain_core.messages import AIMessage
+    from agent import invalidate_graph_cache
+    from agent.context import ContextWindow, extend_totals
+
+    invalidate_graph_cache()
+    mock_llm = MagicMock()
+    mock_llm.bind_tools.return_value.invoke.return_value = AIMessage(content="收到" * 20)
+    mock_openai.return_value = mock_llm
+
+    config = Configuration(system_prompt="助手", max_tokens=10, max_context_tokens=200,
+                           enable_weather_tool=False, enable_search_tool=False,
+                           enable_calculator_tool=False)
+    manager = MultiAgentManager({"researcher": config})
+    for i in range(20):
+        manager.send_to_agent("researcher", f"第{i}条消息" * 5)
+
+    history = manager.histories["researcher"]
+    assert len(history) < 40
+    assert history[-1].content == "收到" * 20
+    assert manager.token_totals["researcher"] == extend_totals(history, [])
+    assert manager.token_totals["researcher"][-1] <= ContextWindow.from_config(config).budget